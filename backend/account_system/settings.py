@@ -65,6 +65,8 @@ if DEBUG:
     INTERNAL_IPS = ['127.0.0.1']
     DEBUG_TOOLBAR_CONFIG = {
         'SHOW_TOOLBAR_CALLBACK': lambda request: True,
+        # 跳过工具栏在 manage.py test 时的配置检查（测试用例中关闭工具栏）
+        'IS_RUNNING_TESTS': False,
     }
 
 ROOT_URLCONF = 'account_system.urls'
@@ -143,6 +145,9 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# 知识库数据目录（向量缓存、索引等）
+KNOWLEDGE_DATA_ROOT = BASE_DIR / 'knowledge_data'
+
 # 验证码配置
 CAPTCHA_LENGTH = 4
 CAPTCHA_TIMEOUT = 1
@@ -0,0 +1,291 @@
+"""
+近似最近邻索引（IVF / IVF-PQ，纯 numpy，CPU 运行）：k-means 把向量划分为 nlist 个倒排列表，
+IVF-PQ 在列表内按残差做乘积量化编码。查询时只访问最近的 nprobe 个列表，用查表法估算得分，
+再用原始 float32 向量精确重排前 top_k × rerank 个候选
+
+每次构建一组 .npy 文件（位于数据代目录的 ann/ 下，<name> 为构建名称）：
+    <name>.centroids.npy   nlist × dim 聚类中心
+    <name>.offsets.npy     每个列表在 rows/codes 中的起止位置（长度 nlist + 1）
+    <name>.rows.npy        按列表排列的行号（列表内升序）
+    <name>.codebooks.npy   pq_m × 256 × (dim / pq_m) 残差码本（仅 IVF-PQ）
+    <name>.codes.npy       按列表排列的 PQ 编码，uint8（仅 IVF-PQ）
+"""
+import logging
+import os
+import time
+
+import numpy as np
+
+from ..rules import KNOWLEDGE_INDEX_CONFIG, KNOWLEDGE_SEARCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+ANN_TYPES = ('ivf_flat', 'ivf_pq')
+INDEX_TYPES = ('flat',) + ANN_TYPES
+ANN_DIR = 'ann'
+_ANN_FILES = ('centroids', 'offsets', 'rows', 'codebooks', 'codes')
+
+
+class AnnConfigError(ValueError):
+    pass
+
+
+def ann_paths(directory, name):
+    return {part: os.path.join(directory, f'{name}.{part}.npy') for part in _ANN_FILES}
+
+
+def resolve_ann_config(vector_store_config, dim=None):
+    """从 vector_store_config 解析索引类型与构建参数；返回 None 表示使用精确检索。nlist 为 0 时构建时按行数确定"""
+    config = vector_store_config or {}
+    index_type = config.get('index_type') or 'flat'
+    if index_type not in INDEX_TYPES:
+        raise AnnConfigError(f'不支持的索引类型: {index_type}')
+    if index_type == 'flat':
+        return None
+    try:
+        nlist = int(config.get('nlist') or 0)
+        pq_m = int(config.get('pq_m') or 0)
+    except (TypeError, ValueError):
+        raise AnnConfigError('nlist 和 pq_m 必须为整数')
+    if index_type == 'ivf_pq':
+        if not pq_m and dim:
+            pq_m = _default_pq_m(dim)
+        if dim and pq_m and dim % pq_m:
+            raise AnnConfigError(f'pq_m={pq_m} 必须能整除向量维度 {dim}')
+    else:
+        pq_m = 0
+    return {'type': index_type, 'nlist': nlist, 'pq_m': pq_m}
+
+
+def resolve_search_params(vector_store_config):
+    """查询时的召回/延迟参数：nprobe 越大召回越高越慢；rerank 为精确重排候选数相对 top_k 的倍数"""
+    config = vector_store_config or {}
+    try:
+        nprobe = int(config.get('nprobe') or KNOWLEDGE_SEARCH_CONFIG['ANN_NPROBE'])
+        rerank = int(config.get('rerank') or KNOWLEDGE_SEARCH_CONFIG['ANN_RERANK_FACTOR'])
+    except (TypeError, ValueError):
+        raise AnnConfigError('nprobe 和 rerank 必须为整数')
+    if nprobe <= 0 or rerank <= 0:
+        raise AnnConfigError('nprobe 和 rerank 必须大于0')
+    return {'nprobe': nprobe, 'rerank': rerank}
+
+
+def _default_pq_m(dim):
+    # 每个子空间约 PQ_SUBVECTOR_DIM 维，取能整除维度的最接近值
+    target = max(1, dim // KNOWLEDGE_INDEX_CONFIG['ANN_PQ_SUBVECTOR_DIM'])
+    divisors = [m for m in range(1, dim + 1) if dim % m == 0]
+    return min(divisors, key=lambda m: (abs(m - target), m))
+
+
+def _assign(data, centroids, centroid_norms=None):
+    """返回每行最近的聚类中心下标（平方欧氏距离），分块计算以限制临时矩阵大小"""
+    if centroid_norms is None:
+        centroid_norms = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(data), dtype=np.int64)
+    block = max(1, (1 << 22) // max(len(centroids), 1))
+    for start in range(0, len(data), block):
+        part = data[start:start + block]
+        labels[start:start + block] = np.argmin(centroid_norms - 2 * (part @ centroids.T), axis=1)
+    return labels
+
+
+def kmeans(data, k, iterations, rng):
+    """Lloyd k-means；空簇用随机样本重新初始化"""
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(data, centroids)
+        counts = np.bincount(labels, minlength=k)
+        order = np.argsort(labels, kind='stable')
+        present = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[present]
+        centroids[present] = np.add.reduceat(data[order], starts, axis=0) / counts[present, None]
+        empty = counts == 0
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()))]
+    return centroids
+
+
+def _space(vectors, norms, metric):
+    """余弦相似度在单位化后的空间里聚类和编码，点积与欧氏距离使用原始向量"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if metric == 'cosine':
+        return vectors / np.maximum(np.asarray(norms, dtype=np.float32)[:, None], 1e-12)
+    return vectors
+
+
+def build_ann(index, directory, name, config, metric, live=None):
+    """对 index 的前 index.count 行（只取存活行）构建 IVF/IVF-PQ，返回写入 manifest 的描述"""
+    start_time = time.monotonic()
+    rng = np.random.default_rng(KNOWLEDGE_INDEX_CONFIG['ANN_SEED'])
+    live = index.live_mask() if live is None else live
+    live_rows = np.flatnonzero(live)
+    if not len(live_rows):
+        raise AnnConfigError('索引没有可用的行')
+    dim = index.dim
+    # 经验值：列表数约为行数平方根的 4 倍
+    nlist = config['nlist'] or int(np.clip(4 * np.sqrt(len(live_rows)), 16, KNOWLEDGE_INDEX_CONFIG['ANN_MAX_NLIST']))
+    nlist = min(nlist, len(live_rows))
+    pq_m = config['pq_m']
+    block_rows = KNOWLEDGE_SEARCH_CONFIG['SCAN_BLOCK_ROWS']
+
+    # 训练：在抽样上做 k-means 与残差码本
+    sample_size = min(len(live_rows), max(nlist * KNOWLEDGE_INDEX_CONFIG['ANN_TRAIN_PER_LIST'], 256 * 4),
+                      KNOWLEDGE_INDEX_CONFIG['ANN_MAX_TRAIN_ROWS'])
+    sample_rows = np.sort(rng.choice(live_rows, sample_size, replace=False))
+    sample = _space(index.vectors[sample_rows], index.norms[sample_rows], metric)
+    iterations = KNOWLEDGE_INDEX_CONFIG['ANN_KMEANS_ITERS']
+    centroids = kmeans(sample, nlist, iterations, rng).astype(np.float32)
+    nlist = len(centroids)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    codebooks = None
+    if pq_m:
+        dsub = dim // pq_m
+        residual = sample - centroids[_assign(sample, centroids, centroid_norms)]
+        codebooks = np.zeros((pq_m, 256, dsub), dtype=np.float32)
+        for j in range(pq_m):
+            book = kmeans(np.ascontiguousarray(residual[:, j * dsub:(j + 1) * dsub]), 256, iterations, rng)
+            # 样本不足 256 时重复已有码字，编码只会落在有效码字上
+            codebooks[j] = book[np.arange(256) % len(book)]
+    del sample
+
+    # 编码：分块读取全部存活行
+    labels = np.empty(len(live_rows), dtype=np.int64)
+    codes = np.empty((len(live_rows), pq_m), dtype=np.uint8) if pq_m else None
+    for start in range(0, len(live_rows), block_rows):
+        rows = live_rows[start:start + block_rows]
+        data = _space(index.vectors[rows], index.norms[rows], metric)
+        block_labels = _assign(data, centroids, centroid_norms)
+        labels[start:start + len(rows)] = block_labels
+        if pq_m:
+            residual = data - centroids[block_labels]
+            for j in range(pq_m):
+                codes[start:start + len(rows), j] = _assign(residual[:, j * dsub:(j + 1) * dsub], codebooks[j])
+    order = np.argsort(labels, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.int64)
+    arrays = {'centroids': centroids, 'offsets': offsets, 'rows': live_rows[order].astype(np.int64)}
+    if pq_m:
+        arrays.update(codebooks=codebooks, codes=codes[order])
+    write_ann(directory, name, arrays)
+    seconds = round(time.monotonic() - start_time, 3)
+    logger.info(f'[KnowledgeANN] 构建 {config["type"]} 完成: {len(live_rows)} 行，nlist={nlist}，pq_m={pq_m}，耗时 {seconds}s')
+    return {
+        'name': name,
+        'type': config['type'],
+        'config': config,
+        'metric': metric,
+        'nlist': nlist,
+        'pq_m': pq_m,
+        'rows': index.count,
+        'indexed': int(len(live_rows)),
+        'build_seconds': seconds,
+        'built': time.time(),
+    }
+
+
+def write_ann(directory, name, arrays):
+    os.makedirs(directory, exist_ok=True)
+    paths = ann_paths(directory, name)
+    for part, array in arrays.items():
+        np.save(paths[part], array)
+
+
+def remap_ann(source_dir, directory, name, info, row_map):
+    """压缩后行号变化：按 row_map 改写行号并丢弃已删除的行，聚类中心与码本原样保留"""
+    ann = AnnIndex(source_dir, info)
+    lists = np.repeat(np.arange(ann.nlist), np.diff(ann.offsets))
+    rows = row_map[np.asarray(ann.rows)]
+    keep = rows >= 0
+    arrays = {
+        'centroids': np.asarray(ann.centroids),
+        'offsets': np.concatenate([[0], np.cumsum(np.bincount(lists[keep], minlength=ann.nlist))]).astype(np.int64),
+        'rows': rows[keep],
+    }
+    if ann.pq_m:
+        arrays.update(codebooks=np.asarray(ann.codebooks), codes=np.asarray(ann.codes)[keep])
+    write_ann(directory, name, arrays)
+    covered = row_map[:info['rows']]
+    return dict(info, name=name, rows=int((covered >= 0).sum()), indexed=int(keep.sum()))
+
+
+class AnnIndex:
+    """只读的 IVF/IVF-PQ 索引，数据文件以内存映射方式打开"""
+
+    def __init__(self, directory, info):
+        self.info = info
+        self.type = info['type']
+        self.metric = info['metric']
+        self.rows_covered = info['rows']
+        self.pq_m = info['pq_m']
+        paths = ann_paths(directory, info['name'])
+        self.centroids = np.load(paths['centroids'])
+        self.offsets = np.load(paths['offsets'])
+        self.rows = np.load(paths['rows'], mmap_mode='r')
+        self.nlist = len(self.centroids)
+        if self.pq_m:
+            self.codebooks = np.load(paths['codebooks'])
+            self.codes = np.load(paths['codes'], mmap_mode='r')
+            self.dsub = self.codebooks.shape[2]
+
+    def _probe(self, query, nprobe):
+        if self.metric == 'euclidean':
+            coarse = -((self.centroids - query) ** 2).sum(axis=1)
+        else:
+            coarse = self.centroids @ query
+        nprobe = min(nprobe, self.nlist)
+        return np.argpartition(-coarse, nprobe - 1)[:nprobe], coarse
+
+    def candidates(self, query, nprobe):
+        """返回被访问列表中的 (rows, 估算得分)；IVF-Flat 不估算，得分为 None"""
+        query = np.asarray(query, dtype=np.float32)
+        if self.metric == 'cosine':
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+        probes, coarse = self._probe(query, nprobe)
+        rows, estimates = [], []
+        if self.pq_m and self.metric != 'euclidean':
+            # 内积可按子空间拆分：得分 = q·中心 + Σ q_j·码字，所有列表共用一张查找表
+            lut = np.einsum('jkd,jd->jk', self.codebooks, query.reshape(self.pq_m, self.dsub))
+        for list_id in probes:
+            start, end = int(self.offsets[list_id]), int(self.offsets[list_id + 1])
+            if start == end:
+                continue
+            rows.append(np.asarray(self.rows[start:end]))
+            if not self.pq_m:
+                continue
+            codes = np.asarray(self.codes[start:end])
+            if self.metric == 'euclidean':
+                residual = (query - self.centroids[list_id]).reshape(self.pq_m, 1, self.dsub)
+                table = ((residual - self.codebooks) ** 2).sum(axis=2)
+                estimates.append(-table[np.arange(self.pq_m), codes].sum(axis=1))
+            else:
+                estimates.append(coarse[list_id] + lut[np.arange(self.pq_m), codes].sum(axis=1))
+        if not rows:
+            return np.zeros(0, dtype=np.int64), None
+        return np.concatenate(rows), (np.concatenate(estimates) if self.pq_m else None)
+
+    def size_bytes(self):
+        total = self.centroids.nbytes + self.offsets.nbytes + self.rows.nbytes
+        if self.pq_m:
+            total += self.codebooks.nbytes + self.codes.nbytes
+        return total
+
+
+def benchmark_recall(index, queries, top_k, metric, variants):
+    """以 float32 精确检索为基准测量各检索方式的 recall@k 与平均延迟；variants 为 [(名称, search 参数)]"""
+    truth, elapsed = [], 0.0
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = index.search(query, top_k, metric, exact=True)
+        elapsed += (time.perf_counter() - start) * 1000
+        truth.append(set(rows.tolist()))
+    total = max(sum(len(rows) for rows in truth), 1)
+    results = [{'mode': 'exact float32', 'recall': 1.0, 'avg_ms': round(elapsed / len(queries), 3)}]
+    for label, params in variants:
+        hits, elapsed = 0, 0.0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            rows, _ = index.search(query, top_k, metric, **params)
+            elapsed += (time.perf_counter() - start) * 1000
+            hits += len(expected & set(rows.tolist()))
+        results.append({'mode': label, 'recall': round(hits / total, 4), 'avg_ms': round(elapsed / len(queries), 3)})
+    return results
@@ -0,0 +1,125 @@
+"""
+知识库存储回收：按数据库核对磁盘上的向量与派生数据，回收不再被引用的部分，并把碎片化的索引压缩为稠密的新一代
+    indexes/kb_<id>/      知识库已删除时删除整个目录；其余知识库移除已删除文件的行，已移除的行较多时压缩，回收旧数据代
+    chroma_db/<file_id>/  旧版单文件 Chroma 目录：文件已删除，或内容已导入知识库索引（之后不会再被读取）
+    text/                 提取文本产物：没有知识文件或索引引用的产物，以及中断写入留下的临时文件
+最近修改过的产物与临时文件在 GRACE_SECONDS 内不回收，避免与进行中的处理冲突。
+由 knowledge_gc 命令执行，或由 worker 空闲时按 INTERVAL_SECONDS 定期执行
+"""
+import logging
+import os
+import shutil
+import time
+
+from ..models import KnowledgeBase, KnowledgeFile
+from ..rules import KNOWLEDGE_GC_CONFIG
+from .text_artifact import artifact_root
+from .vector_index import compact_index, dir_bytes, drop_index, index_references, index_root, release_idle_indexes
+from .vector_store import chroma_file_ids, chroma_path, chroma_stamp
+
+logger = logging.getLogger(__name__)
+
+
+def _orphan_indexes(kb_ids, dry_run):
+    """知识库已删除、索引目录仍在的"""
+    result = {'removed': 0, 'bytes': 0}
+    root = index_root()
+    for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        if not name.startswith('kb_') or not name[3:].isdigit() or int(name[3:]) in kb_ids:
+            continue
+        result['removed'] += 1
+        result['bytes'] += dir_bytes(os.path.join(root, name))
+        if not dry_run:
+            drop_index(int(name[3:]))
+    return result
+
+
+def _compact_indexes(kbs, dead_ratio, dry_run):
+    result = {'compacted': 0, 'stale_files': 0, 'dead_rows': 0, 'generations': 0, 'bytes': 0}
+    for kb in kbs:
+        try:
+            stats = compact_index(kb.id, kb.files.values_list('id', flat=True), dead_ratio, dry_run)
+        except Exception as e:
+            logger.error(f'[KnowledgeGC] 知识库 {kb.id} 索引整理失败: {str(e)}', exc_info=True)
+            continue
+        for key, value in stats.items():
+            result[key] += value
+    return result
+
+
+def _chroma_dirs(files, references, dry_run):
+    """文件已删除（orphaned），或已进入知识库索引、目录标记已导入过（imported）的旧版 Chroma 目录"""
+    result = {'orphaned': 0, 'imported': 0, 'bytes': 0}
+    for file_id in chroma_file_ids():
+        path = chroma_path(file_id)
+        if file_id in files:
+            indexed, sources, _ = references(files[file_id])
+            stamp = chroma_stamp(path)
+            if str(file_id) not in indexed and (stamp is None or sources.get(str(file_id)) != stamp):
+                # 尚未导入索引，worker 整理索引时会从该目录导入
+                continue
+            result['imported'] += 1
+        else:
+            result['orphaned'] += 1
+        result['bytes'] += dir_bytes(path)
+        if not dry_run:
+            shutil.rmtree(path, ignore_errors=True)
+    return result
+
+
+def _text_artifacts(referenced, dry_run):
+    """没有知识文件或索引引用的提取文本产物，以及中断写入留下的临时文件"""
+    result = {'removed': 0, 'bytes': 0}
+    root = artifact_root()
+    deadline = time.time() - KNOWLEDGE_GC_CONFIG['GRACE_SECONDS']
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if '.tmp' not in name and name.split('.')[0] in referenced:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > deadline:
+                continue
+            result['removed'] += 1
+            result['bytes'] += stat.st_size
+            if not dry_run:
+                os.remove(path)
+    return result
+
+
+def collect_garbage(dry_run=False, kb_ids=None, dead_ratio=None):
+    """回收知识库存储并返回各部分回收的数量、字节数与总耗时；dry_run 时只统计不删除。
+    指定 kb_ids 时只整理这些知识库的索引，不扫描已删除的知识库、旧版目录与提取文本产物"""
+    start = time.monotonic()
+    dead_ratio = KNOWLEDGE_GC_CONFIG['COMPACT_DEAD_RATIO'] if dead_ratio is None else dead_ratio
+    # 本进程空闲的已打开索引也会持有旧代的读者锁
+    release_idle_indexes()
+    kbs = KnowledgeBase.objects.order_by('id')
+    if kb_ids:
+        kbs = kbs.filter(id__in=kb_ids)
+    report = {'dry_run': dry_run, 'indexes': _compact_indexes(kbs, dead_ratio, dry_run)}
+    if not kb_ids:
+        report['orphan_indexes'] = _orphan_indexes(set(KnowledgeBase.objects.values_list('id', flat=True)), dry_run)
+        # 压缩之后读取，索引引用的是整理后的数据代
+        cache = {}
+
+        def references(kb_id):
+            if kb_id not in cache:
+                cache[kb_id] = index_references(kb_id)
+            return cache[kb_id]
+
+        files = dict(KnowledgeFile.objects.values_list('id', 'kb_id'))
+        report['chroma'] = _chroma_dirs(files, references, dry_run)
+        referenced = set(KnowledgeFile.objects.exclude(text_artifact='').values_list('text_artifact', flat=True))
+        for kb_id in set(files.values()):
+            referenced.update(references(kb_id)[2])
+        report['text_artifacts'] = _text_artifacts(referenced, dry_run)
+    report['bytes_reclaimed'] = sum(part['bytes'] for part in report.values() if isinstance(part, dict))
+    report['seconds'] = round(time.monotonic() - start, 3)
+    logger.info(
+        f'[KnowledgeGC] {"预估" if dry_run else "完成"}存储回收: {report["bytes_reclaimed"] / 1024 / 1024:.1f}MB，'
+        f'压缩索引 {report["indexes"]["compacted"]} 个，耗时 {report["seconds"]}s')
+    return report
@@ -0,0 +1,112 @@
+"""
+知识库分段近似去重（按知识库）：字符 k-gram 的 MinHash 签名按 LSH 分带取哈希，带哈希相同的分段为候选，
+再用 k-gram 集合的 Jaccard 相似度确认。重复分段不再向量化，直接复用规范分段的向量；索引中记录每行的规范行，
+规范行可见时重复行不参与检索
+
+每行的规范行与带哈希保存在数据代的 canonical.i64、lsh.u64（count × bands），带哈希同时作为特殊词项写入关键词段，
+查找候选时按带哈希读取倒排表，不扫描整个知识库；带哈希参数记录在 manifest['dedup']，
+同一数据代内（包括压缩出的新一代）保持不变，配置变化在重建索引后生效
+"""
+import unicodedata
+
+import numpy as np
+
+from ..rules import KNOWLEDGE_DEDUP_CONFIG
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+_MASK32 = np.uint64(0xFFFFFFFF)
+_GRAM_BASE = np.uint64(1000003)
+_BAND_BASE = np.uint64(0x9E3779B97F4A7C15)
+
+
+def dedup_params():
+    """影响带哈希取值的参数；与 manifest['dedup'] 不一致时已存储的带哈希不可比较"""
+    config = KNOWLEDGE_DEDUP_CONFIG
+    return {
+        'perms': config['NUM_PERM'],
+        'bands': config['BANDS'],
+        'shingle': config['SHINGLE_CHARS'],
+        'seed': config['SEED'],
+    }
+
+
+def _permutations(params):
+    rng = np.random.default_rng(params['seed'])
+    a = rng.integers(1, 1 << 32, params['perms'], dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, params['perms'], dtype=np.uint64)
+    return a, b
+
+
+def shingle_set(text, k):
+    """去掉空白、统一大小写后的字符 k-gram 集合（32 位多项式哈希，升序去重）"""
+    text = ''.join(unicodedata.normalize('NFKC', text).lower().split())
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if not len(codes):
+        return np.zeros(0, dtype=np.uint64)
+    if len(codes) < k:
+        codes = np.pad(codes, (0, k - len(codes)))
+    grams = np.zeros(len(codes) - k + 1, dtype=np.uint64)
+    for j in range(k):
+        # uint64 乘加自然按 2^64 取模
+        grams = grams * _GRAM_BASE + codes[j:len(codes) - k + 1 + j]
+    return np.unique(grams & _MASK32)
+
+
+def jaccard(a, b):
+    if not len(a) or not len(b):
+        return 0.0
+    return len(np.intersect1d(a, b, assume_unique=True)) / len(np.union1d(a, b))
+
+
+def lsh_bands(shingle_sets, params):
+    """每个分段的 MinHash 签名按带合并为带哈希，返回 n × bands 的 uint64 数组（0 保留表示没有带哈希）"""
+    a, b = _permutations(params)
+    signatures = np.empty((len(shingle_sets), params['perms']), dtype=np.uint64)
+    for i, shingles in enumerate(shingle_sets):
+        if not len(shingles):
+            signatures[i] = _MASK32
+            continue
+        signatures[i] = ((np.outer(a, shingles) + b[:, None]) % _MERSENNE).min(axis=1) & _MASK32
+    rows_per_band = params['perms'] // params['bands']
+    bands = signatures[:, :rows_per_band * params['bands']].reshape(len(shingle_sets), params['bands'], rows_per_band)
+    hashes = np.arange(1, params['bands'] + 1, dtype=np.uint64)[None, :].repeat(len(shingle_sets), axis=0)
+    for r in range(rows_per_band):
+        hashes = hashes * _BAND_BASE + bands[:, :, r]
+    hashes[hashes == 0] = 1
+    return hashes
+
+
+def find_duplicates(chunks, index=None, exclude_file=None, params=None):
+    """找出近似重复的分段，返回 (rows, local, bands)：rows[i] 为 index 中的规范行（-1 表示没有），
+    local[i] 为同一文件中更早出现的规范分段下标（-1 表示没有），bands 为各分段的带哈希。
+    带哈希按 index 的去重参数计算；exclude_file 的旧行视为已移除（该文件正被替换）"""
+    threshold = KNOWLEDGE_DEDUP_CONFIG['THRESHOLD']
+    max_candidates = KNOWLEDGE_DEDUP_CONFIG['MAX_CANDIDATES']
+    if index is not None and index.manifest.get('dedup'):
+        params = index.manifest['dedup']
+    params = params or dedup_params()
+    shingle_sets = [shingle_set(chunk, params['shingle']) for chunk in chunks]
+    bands = lsh_bands(shingle_sets, params)
+    n = len(chunks)
+    rows = np.full(n, -1, dtype=np.int64)
+    local = np.full(n, -1, dtype=np.int64)
+    if index is not None and index.count and index.manifest.get('dedup'):
+        candidates = index.duplicate_candidates(bands, exclude_file)
+        for i in range(n):
+            for row in sorted(candidates[i])[:max_candidates]:
+                if jaccard(shingle_sets[i], shingle_set(index.chunk(row)['content'], params['shingle'])) >= threshold:
+                    rows[i] = row
+                    break
+    buckets = [{} for _ in range(bands.shape[1])]
+    for i in range(n):
+        if rows[i] >= 0:
+            continue
+        earlier = sorted({j for band, value in enumerate(bands[i].tolist()) for j in buckets[band].get(value, ())})
+        for j in earlier[:max_candidates]:
+            if jaccard(shingle_sets[i], shingle_sets[j]) >= threshold:
+                local[i] = j
+                break
+        if local[i] < 0:
+            for band, value in enumerate(bands[i].tolist()):
+                buckets[band].setdefault(value, []).append(i)
+    return rows, local, bands
@@ -0,0 +1,223 @@
+"""
+知识库向量化：分批调用 embedding 模型
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from ..rules import KNOWLEDGE_PROCESS_CONFIG, KNOWLEDGE_EMBEDDING_POOL_CONFIG
+from .reduction import resolve_reduction
+from .registry import embedding_backend_registry, lazy_import
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+
+
+class Embeddings:
+    """向量化模型接口，与 langchain_core 的 Embeddings 相同；计数、缓存、并行等包装类继承它，
+    导入本模块（以及 views 的导入链）不会加载 langchain"""
+
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+
+def resolve_batch_size(embedding_config):
+    """从 embedding_config.batch_size 读取批大小，缺省或非法时使用默认值"""
+    batch_size = (embedding_config or {}).get('batch_size') or KNOWLEDGE_PROCESS_CONFIG['EMBED_BATCH_SIZE']
+    try:
+        batch_size = int(batch_size)
+    except (TypeError, ValueError):
+        raise ValueError(f'非法的批大小: {batch_size}')
+    if batch_size <= 0:
+        raise ValueError('批大小必须大于0')
+    return min(batch_size, KNOWLEDGE_PROCESS_CONFIG['MAX_EMBED_BATCH_SIZE'])
+
+
+def iter_batches(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def embed_in_batches(embedder, chunks, batch_size, before_batch=None):
+    """按固定批大小把分段送入 embedder，返回与 chunks 一一对应的向量列表"""
+    vectors = []
+    for batch in iter_batches(chunks, batch_size):
+        if before_batch:
+            before_batch()
+        vectors.extend(embedder.embed_documents(batch))
+    return vectors
+
+
+class CountingEmbeddings(Embeddings):
+    """包装 embedder，统计每个分段实际送入模型的次数，用于校验单次向量化"""
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.embedded_count = 0
+        self.call_count = 0
+
+    def embed_documents(self, texts):
+        self.call_count += 1
+        self.embedded_count += len(texts)
+        return self.embedder.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embedder.embed_query(text)
+
+
+def local_model_spec(embedding_config):
+    """本地模型在模型池中的键 (type, model, device, normalize)"""
+    embedding_config = embedding_config or {}
+    return (
+        'local',
+        embedding_config.get('model') or DEFAULT_LOCAL_MODEL,
+        embedding_config.get('device') or KNOWLEDGE_EMBEDDING_POOL_CONFIG['DEVICE'],
+        bool(embedding_config.get('normalize', True)),
+    )
+
+
+def embedding_info(embedding_config):
+    """索引中记录的向量化模型信息，检索时用同一模型向量化查询，并按同样的降维设置变换查询向量"""
+    embedding_config = embedding_config or {}
+    info = {
+        'type': embedding_config.get('type', 'local'),
+        'model': embedding_config.get('model') or DEFAULT_LOCAL_MODEL,
+        'normalize': bool(embedding_config.get('normalize', True)),
+    }
+    # 降维设置决定索引中向量所在的空间，未设置时不写入，已有索引的记录保持不变
+    reduction = resolve_reduction(embedding_config, info['model'])
+    if reduction:
+        info.update(dimension=reduction['dim'], reduction=reduction['method'])
+    return info
+
+
+def build_embedder(embedding_config, user=None):
+    """按 embedding_config 构造向量化模型，返回 (embedder, model_name, embedding_type)"""
+    embedding_config = embedding_config or {}
+    embedding_type = embedding_config.get('type', 'local')  # 默认使用本地模型
+    embedding_model = embedding_config.get('model') or DEFAULT_LOCAL_MODEL
+    if embedding_type not in embedding_backend_registry:
+        raise ValueError(f'不支持的嵌入模型类型: {embedding_type}')
+    embedder = embedding_backend_registry.get(embedding_type)(embedding_config, user)
+    return embedder, embedding_model, embedding_type
+
+
+def build_local_embedder(embedding_config, user=None):
+    return embedding_pool.get(*local_model_spec(embedding_config))
+
+
+def build_openai_embedder(embedding_config, user=None):
+    embeddings = lazy_import('langchain_community.embeddings')
+    return embeddings.OpenAIEmbeddings(
+        model=embedding_config.get('model') or DEFAULT_LOCAL_MODEL,
+        openai_api_key=resolve_openai_api_key(user),
+    )
+
+
+def resolve_openai_api_key(user=None):
+    """优先使用 API 管理中最新的 OpenAI Key，其次使用用户个人设置的 Key"""
+    from ..models import ModelApi
+    model_api = ModelApi.objects.filter(model='openai').order_by('-time').first()
+    api_key = model_api.apikey if model_api else getattr(user, 'openai_api_key', None)
+    if not api_key:
+        raise ValueError('请先在个人设置或API管理中设置OpenAI API密钥')
+    return api_key
+
+
+def _model_memory_bytes(embedder):
+    """估算本地模型占用的内存（参数与缓冲区字节数）"""
+    client = getattr(embedder, 'client', None)
+    if client is None or not hasattr(client, 'parameters'):
+        return 0
+    tensors = list(client.parameters()) + list(client.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class EmbeddingModelPool:
+    """进程内常驻的本地向量化模型池，按 (type, model, device, normalize) 复用已加载模型，超出内存预算时按 LRU 淘汰"""
+
+    def __init__(self, memory_budget_mb):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._models = OrderedDict()  # key -> (embedder, 内存字节数)
+        self._lock = threading.Lock()
+        self._load_locks = defaultdict(threading.Lock)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def get(self, embedding_type, model_name, device='cpu', normalize=True):
+        key = (embedding_type, model_name, device, bool(normalize))
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            load_lock = self._load_locks[key]
+        # 同一模型只加载一次，其他线程等待加载完成后直接复用
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    return self._models[key][0]
+                self.misses += 1
+            start = time.monotonic()
+            embedder = self._load(*key)
+            elapsed = time.monotonic() - start
+            size = _model_memory_bytes(embedder)
+            with self._lock:
+                self.load_seconds += elapsed
+                self._models[key] = (embedder, size)
+                self._evict(keep=key)
+        logger.info(f'[EmbeddingPool] 加载模型 {model_name}（{device}）耗时 {elapsed:.2f}s，约 {size / 1024 / 1024:.0f}MB')
+        return embedder
+
+    def _load(self, embedding_type, model_name, device, normalize):
+        if embedding_type != 'local':
+            raise ValueError(f'模型池仅支持本地模型: {embedding_type}')
+        embeddings = lazy_import('langchain_community.embeddings')
+        lazy_import('sentence_transformers')
+        return embeddings.HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={'device': device},
+            encode_kwargs={'normalize_embeddings': normalize}
+        )
+
+    def _evict(self, keep):
+        total = sum(size for _, size in self._models.values())
+        while total > self.memory_budget and len(self._models) > 1:
+            key = next(k for k in self._models if k != keep)
+            _, size = self._models.pop(key)
+            total -= size
+            self.evictions += 1
+            logger.info(f'[EmbeddingPool] 超出内存预算，淘汰模型 {key[1]}（{key[2]}）')
+
+    def preload(self, model_names, device=None):
+        for model_name in model_names:
+            try:
+                self.get('local', model_name, device=device or KNOWLEDGE_EMBEDDING_POOL_CONFIG['DEVICE'])
+            except Exception as e:
+                logger.error(f'[EmbeddingPool] 预加载模型 {model_name} 失败: {str(e)}')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'load_seconds': round(self.load_seconds, 3),
+                'memory_bytes': sum(size for _, size in self._models.values()),
+                'models': [
+                    {'type': key[0], 'model': key[1], 'device': key[2], 'normalize': key[3], 'memory_bytes': size}
+                    for key, (_, size) in self._models.items()
+                ],
+            }
+
+
+embedding_pool = EmbeddingModelPool(KNOWLEDGE_EMBEDDING_POOL_CONFIG['MEMORY_BUDGET_MB'])
@@ -0,0 +1,181 @@
+"""
+分段向量缓存：按 (向量化模型, 规范化文本哈希) 持久化到本地 sqlite，跨文件、跨知识库复用
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from django.conf import settings
+
+from ..rules import KNOWLEDGE_EMBEDDING_CACHE_CONFIG
+from .embedding import Embeddings
+
+logger = logging.getLogger(__name__)
+
+SQLITE_MAX_VARIABLES = 900
+
+
+def normalize_chunk_text(text):
+    """统一 Unicode 形式并折叠空白，空白差异不影响命中"""
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+
+def chunk_text_hash(text):
+    return hashlib.blake2b(normalize_chunk_text(text).encode('utf-8'), digest_size=16).digest()
+
+
+def embedding_cache_key(embedding_type, model_name, normalize=True):
+    return f'{embedding_type}:{model_name}:{int(bool(normalize))}'
+
+
+class EmbeddingCache:
+    """sqlite 存储的 float32 向量缓存，总字节数超过上限时按最近使用时间淘汰"""
+
+    def __init__(self, path, max_bytes):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'model TEXT NOT NULL, hash BLOB NOT NULL, vector BLOB NOT NULL, '
+                'size INTEGER NOT NULL, last_used INTEGER NOT NULL, PRIMARY KEY (model, hash)) WITHOUT ROWID'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('total_bytes', 0)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model, hashes):
+        """返回 {hash: np.ndarray}，只包含命中的条目"""
+        found = {}
+        conn = self._connect()
+        now = int(time.time())
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), SQLITE_MAX_VARIABLES):
+            part = unique[start:start + SQLITE_MAX_VARIABLES]
+            marks = ','.join('?' * len(part))
+            rows = conn.execute(
+                f'SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({marks})', [model, *part]
+            ).fetchall()
+            for key, blob in rows:
+                found[bytes(key)] = np.frombuffer(blob, dtype=np.float32)
+            if rows:
+                with conn:
+                    conn.execute(
+                        f'UPDATE embeddings SET last_used = ? WHERE model = ? AND hash IN ({marks})', [now, model, *part]
+                    )
+        return found
+
+    def put_many(self, model, items):
+        """写入 [(hash, vector)]，已存在的条目保持不变"""
+        conn = self._connect()
+        now = int(time.time())
+        added = 0
+        with conn:
+            for key, vector in items:
+                blob = np.asarray(vector, dtype=np.float32).tobytes()
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO embeddings (model, hash, vector, size, last_used) VALUES (?, ?, ?, ?, ?)',
+                    (model, key, blob, len(blob), now)
+                )
+                added += len(blob) if cursor.rowcount else 0
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'total_bytes'", (added,))
+        self._evict()
+
+    def total_bytes(self):
+        return self._connect().execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+
+    def _evict(self):
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        # 一次淘汰到上限的 90%，避免每次写入都触发
+        target = int(self.max_bytes * 0.9)
+        conn = self._connect()
+        removed = 0
+        with conn:
+            while total - removed > target:
+                rows = conn.execute(
+                    'SELECT model, hash, size FROM embeddings ORDER BY last_used LIMIT 1000'
+                ).fetchall()
+                if not rows:
+                    break
+                conn.executemany('DELETE FROM embeddings WHERE model = ? AND hash = ?', [(m, h) for m, h, _ in rows])
+                removed += sum(size for _, _, size in rows)
+            conn.execute("UPDATE meta SET value = MAX(value - ?, 0) WHERE key = 'total_bytes'", (removed,))
+        logger.info(f'[EmbeddingCache] 超出容量上限，淘汰 {removed / 1024 / 1024:.1f}MB 缓存向量')
+
+
+class CachedEmbeddings(Embeddings):
+    """在 embedder 前加一层分段向量缓存，只把未命中的分段送入模型"""
+
+    def __init__(self, embedder, cache, model_key):
+        self.embedder = embedder
+        self.cache = cache
+        self.model_key = model_key
+        self.hits = 0
+        self.misses = 0
+        self.computed = 0  # 实际送入模型的分段数（批内重复只计一次）
+
+    def embed_documents(self, texts):
+        hashes = [chunk_text_hash(text) for text in texts]
+        found = self.cache.get_many(self.model_key, hashes)
+        # 同一批内重复的分段也只向量化一次
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        hit_count = sum(1 for key in hashes if key in found)
+        self.hits += hit_count
+        self.misses += len(texts) - hit_count
+        self.computed += len(missing)
+        if missing:
+            vectors = self.embedder.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_key, computed.items())
+            found.update({key: np.asarray(vector, dtype=np.float32) for key, vector in computed.items()})
+        return [found[key].tolist() for key in hashes]
+
+    def embed_query(self, text):
+        return self.embedder.embed_query(text)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+            'cache_hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """进程内共享的缓存实例；未启用时返回 None"""
+    global _cache
+    if not KNOWLEDGE_EMBEDDING_CACHE_CONFIG['ENABLED']:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                os.path.join(settings.KNOWLEDGE_DATA_ROOT, 'embedding_cache.sqlite3'),
+                KNOWLEDGE_EMBEDDING_CACHE_CONFIG['MAX_MB'] * 1024 * 1024,
+            )
+        return _cache
@@ -0,0 +1,233 @@
+"""
+知识库文件内容提取：按页/段流式产出文本片段及其元数据；各格式的解析库在首次处理该格式时才导入
+"""
+import csv
+import datetime
+import os
+from collections import deque, namedtuple
+from concurrent.futures.process import BrokenProcessPool
+
+from ..rules import KNOWLEDGE_EXTRACT_CONFIG
+from .process_pool import SharedProcessPool
+from .registry import extractor_registry, lazy_import
+
+UNSUPPORTED_FILE_TYPE = "暂不支持该文件类型"
+
+class UnsupportedFileType(ValueError):
+    pass
+
+
+# 提取出的文本片段，metadata 记录页码等来源信息
+TextSegment = namedtuple('TextSegment', ['text', 'metadata'])
+
+
+def iter_plain_segments(file_path, encoding='utf-8', workers=None):
+    with open(file_path, 'r', encoding=encoding) as f:
+        yield TextSegment(f.read(), {})
+
+
+def iter_markdown_segments(file_path, encoding='utf-8', workers=None):
+    markdown = lazy_import('markdown')
+    with open(file_path, 'r', encoding=encoding) as f:
+        yield TextSegment(markdown.markdown(f.read()), {})
+
+
+def _is_heading(paragraph):
+    style = paragraph.style.name if paragraph.style is not None else ''
+    return style.startswith('Heading') or style.startswith('标题') or style == 'Title'
+
+
+def iter_docx_segments(file_path, encoding='utf-8', workers=None):
+    """按标题样式的段落分节产出，元数据记录所在章节标题"""
+    doc = lazy_import('docx').Document(file_path)
+    lines, section = [], None
+    for p in doc.paragraphs:
+        if _is_heading(p) and p.text.strip():
+            if lines:
+                yield TextSegment('\n'.join(lines), {'section': section} if section else {})
+            lines, section = [], p.text.strip()
+        lines.append(p.text)
+    if lines:
+        yield TextSegment('\n'.join(lines), {'section': section} if section else {})
+
+
+def iter_pptx_segments(file_path, encoding='utf-8', workers=None):
+    """逐页产出幻灯片文本，元数据记录页码与幻灯片标题"""
+    prs = lazy_import('pptx').Presentation(file_path)
+    for index, slide in enumerate(prs.slides):
+        text = [shape.text for shape in slide.shapes if hasattr(shape, "text")]
+        metadata = {'page': index + 1}
+        title = slide.shapes.title
+        if title is not None and title.text.strip():
+            metadata['section'] = title.text.strip()
+        yield TextSegment('\n'.join(text), metadata)
+
+
+def iter_html_segments(file_path, encoding='utf-8', workers=None):
+    bs4 = lazy_import('bs4')
+    with open(file_path, 'r', encoding=encoding) as f:
+        soup = bs4.BeautifulSoup(f, 'html.parser')
+        yield TextSegment(soup.get_text(), {})
+
+
+def iter_epub_segments(file_path, encoding='utf-8', workers=None):
+    epub = lazy_import('ebooklib.epub')
+    ebooklib = lazy_import('ebooklib')
+    bs4 = lazy_import('bs4')
+    book = epub.read_epub(file_path)
+    text = []
+    for item in book.get_items():
+        if item.get_type() == ebooklib.ITEM_DOCUMENT:
+            soup = bs4.BeautifulSoup(item.get_content(), 'html.parser')
+            text.append(soup.get_text())
+    yield TextSegment('\n'.join(text), {})
+
+
+def pdf_page_count(file_path):
+    with lazy_import('pdfplumber').open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def iter_pdf_pages(file_path, start=0, end=None):
+    """逐页提取 [start, end) 范围内的页面文本，页码从 1 开始；处理完的页面立即释放解析缓存"""
+    with lazy_import('pdfplumber').open(file_path) as pdf:
+        end = len(pdf.pages) if end is None else min(end, len(pdf.pages))
+        for index in range(start, end):
+            page = pdf.pages[index]
+            text = page.extract_text() or ""
+            page.close()
+            yield TextSegment(text, {'page': index + 1})
+
+
+def _extract_pdf_range(file_path, start, end):
+    return [tuple(segment) for segment in iter_pdf_pages(file_path, start, end)]
+
+
+# 大 PDF 的页范围提取进程池，worker 内各任务共用
+pdf_process_pool = SharedProcessPool('PDF 提取')
+
+
+def resolve_pdf_workers(workers=None):
+    if workers is None:
+        workers = KNOWLEDGE_EXTRACT_CONFIG['PDF_WORKERS']
+    return int(workers) or os.cpu_count() or 1
+
+
+def iter_pdf_segments(file_path, encoding='utf-8', workers=None):
+    """大文档按页范围分给 worker 内共用的进程池并行提取，按页序产出；同时在途的页范围数有上限，内存占用不随页数增长"""
+    workers = resolve_pdf_workers(workers)
+    page_count = pdf_page_count(file_path)
+    if workers <= 1 or page_count < KNOWLEDGE_EXTRACT_CONFIG['PDF_PARALLEL_MIN_PAGES']:
+        yield from iter_pdf_pages(file_path)
+        return
+    pages_per_task = KNOWLEDGE_EXTRACT_CONFIG['PDF_PAGES_PER_TASK']
+    ranges = deque((start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
+    with pdf_process_pool.acquire(workers) as executor:
+        pending = deque()
+        try:
+            while ranges or pending:
+                while ranges and len(pending) < workers * 2:
+                    start, end = ranges.popleft()
+                    pending.append(executor.submit(_extract_pdf_range, file_path, start, end))
+                for text, metadata in pending.popleft().result():
+                    yield TextSegment(text, metadata)
+        except BrokenProcessPool:
+            pdf_process_pool.discard(executor)
+            raise
+        finally:
+            # 提前结束（出错或调用方不再读取）时不再等待尚未开始的页范围
+            for future in pending:
+                future.cancel()
+
+
+def _format_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat() if value.time() == datetime.time() else value.isoformat(sep=' ')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def iter_row_segments(rows, sheet=None, rows_per_segment=None):
+    """把表格行流式打包成紧凑文本片段：首个非空行作为表头，其余每行渲染为“列名: 值”，空单元格省略"""
+    rows_per_segment = rows_per_segment or KNOWLEDGE_EXTRACT_CONFIG['SHEET_ROWS_PER_SEGMENT']
+    header = None
+    lines = []
+    row_start = None
+    row_number = 0
+    for row_number, row in enumerate(rows, start=1):
+        cells = [_format_cell(value) for value in row]
+        if not any(cells):
+            continue
+        if header is None:
+            header = [cell or f'列{i + 1}' for i, cell in enumerate(cells)]
+            continue
+        names = header + [f'列{i + 1}' for i in range(len(header), len(cells))]
+        lines.append(' | '.join(f'{name}: {cell}' for name, cell in zip(names, cells) if cell))
+        row_start = row_start or row_number
+        if len(lines) >= rows_per_segment:
+            yield TextSegment('\n'.join(lines), _row_metadata(sheet, row_start, row_number))
+            lines, row_start = [], None
+    if lines:
+        yield TextSegment('\n'.join(lines), _row_metadata(sheet, row_start, row_number))
+
+
+def _row_metadata(sheet, row_start, row_end):
+    metadata = {'row_start': row_start, 'row_end': row_end}
+    if sheet is not None:
+        metadata['sheet'] = sheet
+    return metadata
+
+
+def iter_csv_segments(file_path, encoding='utf-8', workers=None):
+    with open(file_path, 'r', encoding=encoding, newline='') as f:
+        yield from iter_row_segments(csv.reader(f))
+
+
+def iter_xlsx_segments(file_path, encoding='utf-8', workers=None):
+    """只读模式逐行遍历所有工作表，不把整张表载入内存"""
+    workbook = lazy_import('openpyxl').load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            yield from iter_row_segments(worksheet.iter_rows(values_only=True), sheet=worksheet.title)
+    finally:
+        workbook.close()
+
+
+def iter_xls_segments(file_path, encoding='utf-8', workers=None):
+    """旧版 .xls 按需加载工作表，处理完一张即释放"""
+    xlrd = lazy_import('xlrd')
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        for index in range(book.nsheets):
+            sheet = book.sheet_by_index(index)
+            rows = (_xls_row(book, sheet, r) for r in range(sheet.nrows))
+            yield from iter_row_segments(rows, sheet=sheet.name)
+            book.unload_sheet(index)
+    finally:
+        book.release_resources()
+
+
+def _xls_row(book, sheet, row_index):
+    xlrd = lazy_import('xlrd')
+    values = []
+    for cell in sheet.row(row_index):
+        if cell.ctype == xlrd.XL_CELL_DATE:
+            values.append(xlrd.xldate.xldate_as_datetime(cell.value, book.datemode))
+        else:
+            values.append(cell.value)
+    return values
+
+
+def iter_text_segments(file_path, ext, encoding='utf-8', workers=None):
+    """按扩展名从注册表取提取器并产出 TextSegment；PDF、幻灯片逐页产出并带页码，Word 按标题分节，表格按行批产出并带工作表/行号，
+    其他格式整体作为一个片段"""
+    ext = ext.lower()
+    if ext not in extractor_registry:
+        raise UnsupportedFileType(UNSUPPORTED_FILE_TYPE)
+    yield from extractor_registry.get(ext)(file_path, encoding=encoding, workers=workers)
+
@@ -0,0 +1,71 @@
+"""
+知识库索引同步：移除已删除文件的行，导入旧版按文件存放的 Chroma 目录（仅首次），并升级旧格式的索引。
+由 worker 在启动、空闲时与处理任务前执行；检索只读取已发布的数据代，不写索引
+"""
+import logging
+
+from ..models import KnowledgeBase
+from .embedding import embedding_info
+from .vector_index import KnowledgeIndexWriter, get_index, index_write_lock
+from .vector_store import chroma_path, chroma_stamp, read_chroma
+
+logger = logging.getLogger(__name__)
+
+
+def _legacy_chroma_files(manifest, file_ids):
+    """尚未进入索引、但有旧版单文件 Chroma 目录的文件"""
+    changed = {}
+    for file_id in file_ids:
+        if str(file_id) in manifest['files']:
+            continue
+        stamp = chroma_stamp(chroma_path(file_id))
+        if stamp is not None and manifest['sources'].get(str(file_id)) != stamp:
+            changed[file_id] = stamp
+    return changed
+
+
+def sync_kb_index(kb):
+    """整理单个知识库的索引，有变化时提交新版本并返回 True"""
+    file_ids = set(kb.files.values_list('id', flat=True))
+    index = get_index(kb.id)
+    manifest = index.manifest if index is not None else None
+    if manifest is not None and all(int(f) in file_ids for f in manifest['files']) \
+            and not _legacy_chroma_files(manifest, file_ids):
+        return False
+    with index_write_lock(kb.id):
+        writer = KnowledgeIndexWriter(kb.id)
+        stale = [file_id for file_id in writer.manifest['files'] if int(file_id) not in file_ids]
+        legacy = _legacy_chroma_files(writer.manifest, file_ids)
+        if not stale and not legacy and not writer.upgraded:
+            return False
+        for file_id in stale:
+            writer.remove_file(file_id)
+        vector_store_config = (kb.embedding_config or {}).get('vector_store_config')
+        info = writer.manifest['embedding'] or embedding_info((kb.embedding_config or {}).get('embedding_config'))
+        for file_id, stamp in sorted(legacy.items()):
+            chunks, embeddings, metadatas = read_chroma(chroma_path(file_id))
+            try:
+                writer.append_file(file_id, chunks, embeddings, metadatas, info)
+            except ValueError as e:
+                logger.warning(f'[KnowledgeIndexSync] 知识库 {kb.id} 文件 {file_id} 未加入索引: {str(e)}')
+            # 记录已导入的目录标记，导入失败或为空的目录不再反复尝试
+            writer.set_source(file_id, stamp)
+        if writer.needs_compaction():
+            writer.compact()
+        if legacy:
+            writer.update_ann(vector_store_config)
+            writer.update_quantization(vector_store_config)
+        version = writer.commit()
+    logger.info(f'[KnowledgeIndexSync] 知识库 {kb.id} 索引已更新到版本 {version}，导入旧版目录 {len(legacy)} 个，移除 {len(stale)} 个文件')
+    return True
+
+
+def sync_indexes():
+    """整理全部知识库的索引，返回有变化的知识库数"""
+    synced = 0
+    for kb in KnowledgeBase.objects.order_by('id'):
+        try:
+            synced += sync_kb_index(kb)
+        except Exception as e:
+            logger.error(f'[KnowledgeIndexSync] 知识库 {kb.id} 索引同步失败: {str(e)}', exc_info=True)
+    return synced
@@ -0,0 +1,255 @@
+"""
+知识库后台处理任务：基于数据库的任务队列与本地 worker，无需额外的消息中间件
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.db import close_old_connections, connection
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from ..models import KnowledgeProcessJob
+from ..rules import KNOWLEDGE_JOB_CONFIG, KNOWLEDGE_EMBEDDING_POOL_CONFIG, KNOWLEDGE_GC_CONFIG
+from .compaction import collect_garbage
+from .embedding import embedding_pool
+from .index_sync import sync_indexes, sync_kb_index
+from .process_pool import shutdown_process_pools
+from .pipeline import process_knowledge_file, KnowledgeProcessError, ProcessCancelled, ProcessContext
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_process_job(kf, params, user=None):
+    """为知识文件创建处理任务；该文件已有排队中的任务时直接更新其参数，避免重复处理"""
+    job = KnowledgeProcessJob.objects.filter(file=kf, status='queued').first()
+    if job:
+        job.params = params
+        job.user = user
+        job.save(update_fields=['params', 'user'])
+        return job
+    return KnowledgeProcessJob.objects.create(
+        kb=kf.kb,
+        file=kf,
+        user=user,
+        params=params,
+        max_attempts=KNOWLEDGE_JOB_CONFIG['MAX_ATTEMPTS'],
+    )
+
+
+def cancel_job(job):
+    """排队中的任务直接取消；运行中的任务打上取消标记，由 worker 在阶段之间终止"""
+    now = timezone.now()
+    if KnowledgeProcessJob.objects.filter(id=job.id, status='queued').update(status='cancelled', finished=now):
+        return True
+    if KnowledgeProcessJob.objects.filter(id=job.id, status='running').update(cancel_requested=True):
+        return True
+    return False
+
+
+def retry_job(job):
+    """失败或已取消的任务重新排队"""
+    return bool(KnowledgeProcessJob.objects.filter(id=job.id, status__in=['failed', 'cancelled']).update(
+        status='queued', stage='', attempts=0, cancel_requested=False, error=None,
+        run_after=None, started=None, finished=None, worker='',
+    ))
+
+
+def requeue_stale_jobs():
+    """心跳超时的运行中任务（worker 异常退出）重新排队，超过最大执行次数的标记为失败"""
+    deadline = timezone.now() - datetime.timedelta(seconds=KNOWLEDGE_JOB_CONFIG['STALE_SECONDS'])
+    stale = KnowledgeProcessJob.objects.filter(status='running', heartbeat__lt=deadline)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', error='worker 心跳超时', finished=timezone.now())
+    requeued = stale.update(status='queued', stage='', worker='', run_after=None)
+    if failed or requeued:
+        logger.warning(f'[KnowledgeJob] 心跳超时任务: 重新排队 {requeued} 个，失败 {failed} 个')
+    return requeued
+
+
+def claim_next_job(worker_id):
+    """领取一个可执行的任务，遵守每个知识库的并发上限；没有可执行任务时返回 None"""
+    now = timezone.now()
+    kb_limit = KNOWLEDGE_JOB_CONFIG['KB_MAX_CONCURRENT_JOBS']
+    running = dict(
+        KnowledgeProcessJob.objects.filter(status='running')
+        .values('kb_id').annotate(n=Count('id')).values_list('kb_id', 'n')
+    )
+    candidates = (
+        KnowledgeProcessJob.objects.filter(status='queued')
+        .filter(Q(run_after__isnull=True) | Q(run_after__lte=now))
+        .order_by('created')
+        .values_list('id', 'kb_id')[:50]
+    )
+    for job_id, kb_id in candidates:
+        if running.get(kb_id, 0) >= kb_limit:
+            continue
+        claimed = KnowledgeProcessJob.objects.filter(id=job_id, status='queued').update(
+            status='running', worker=worker_id, started=now, heartbeat=now, attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            continue
+        # 多个 worker 同时领取时可能超出上限，超出则退回队列
+        if KnowledgeProcessJob.objects.filter(kb_id=kb_id, status='running').count() > kb_limit:
+            KnowledgeProcessJob.objects.filter(id=job_id, status='running').update(
+                status='queued', worker='', started=None, attempts=F('attempts') - 1)
+            running[kb_id] = kb_limit
+            continue
+        return KnowledgeProcessJob.objects.select_related('file', 'kb', 'user').get(id=job_id)
+    return None
+
+
+class JobContext(ProcessContext):
+    """把流水线阶段和心跳写回任务记录，并响应取消请求。执行期间由后台线程按 HEARTBEAT_SECONDS 写心跳，
+    提取大文件、写入索引、构建近似索引等长时间不切换阶段的步骤不会被误判为 worker 异常退出"""
+
+    def __init__(self, job):
+        self.job = job
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._beat, name=f'knowledge-job-{self.job.id}-heartbeat', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _beat(self):
+        try:
+            while not self._stopped.wait(KNOWLEDGE_JOB_CONFIG['HEARTBEAT_SECONDS']):
+                try:
+                    # 只续期仍由本 worker 执行的任务，已被重新排队或已结束的任务不再写回
+                    KnowledgeProcessJob.objects.filter(id=self.job.id, status='running', worker=self.job.worker).update(
+                        heartbeat=timezone.now())
+                except Exception as e:
+                    logger.warning(f'[KnowledgeJob] 任务 {self.job.id} 写心跳失败: {str(e)}')
+        finally:
+            connection.close()
+
+    def set_stage(self, stage):
+        self.job.stage = stage
+        KnowledgeProcessJob.objects.filter(id=self.job.id).update(stage=stage, heartbeat=timezone.now())
+
+    def check(self):
+        KnowledgeProcessJob.objects.filter(id=self.job.id).update(heartbeat=timezone.now())
+        if KnowledgeProcessJob.objects.filter(id=self.job.id, cancel_requested=True).exists():
+            raise ProcessCancelled()
+
+
+def run_job(job):
+    """执行单个任务并记录结果；可重试的失败按退避时间重新排队"""
+    logger.info(f'[KnowledgeJob] 开始处理任务 {job.id}，文件 {job.file_id}，第 {job.attempts} 次执行')
+    jobs = KnowledgeProcessJob.objects.filter(id=job.id)
+    try:
+        sync_kb_index(job.kb)
+    except Exception as e:
+        logger.warning(f'[KnowledgeJob] 任务 {job.id} 处理前整理知识库 {job.kb_id} 索引失败: {str(e)}')
+    try:
+        with JobContext(job) as context:
+            result = process_knowledge_file(job.file, job.params, job.user, context)
+    except ProcessCancelled:
+        logger.info(f'[KnowledgeJob] 任务 {job.id} 已取消')
+        jobs.update(status='cancelled', finished=timezone.now())
+        return
+    except KnowledgeProcessError as e:
+        _fail(job, e.message, e.retryable)
+        return
+    except Exception as e:
+        logger.error(f'[KnowledgeJob] 任务 {job.id} 未知错误: {str(e)}', exc_info=True)
+        _fail(job, f'未知错误: {str(e)}', True)
+        return
+    jobs.update(status='done', result=result, error=None, finished=timezone.now())
+    logger.info(f'[KnowledgeJob] 任务 {job.id} 处理完成: {result}')
+
+
+def _fail(job, message, retryable):
+    jobs = KnowledgeProcessJob.objects.filter(id=job.id)
+    if retryable and job.attempts < job.max_attempts:
+        delay = KNOWLEDGE_JOB_CONFIG['RETRY_BACKOFF'] * job.attempts
+        jobs.update(status='queued', stage='', worker='', error=message,
+                    run_after=timezone.now() + datetime.timedelta(seconds=delay))
+        logger.warning(f'[KnowledgeJob] 任务 {job.id} 失败，{delay} 秒后重试: {message}')
+    else:
+        jobs.update(status='failed', error=message, finished=timezone.now())
+        logger.error(f'[KnowledgeJob] 任务 {job.id} 失败: {message}')
+
+
+class KnowledgeWorker:
+    """本地 worker：多个线程轮询数据库队列并执行任务；空闲时按 KNOWLEDGE_GC_CONFIG 定期回收知识库存储"""
+
+    def __init__(self, concurrency=None, poll_interval=None):
+        self.concurrency = concurrency or KNOWLEDGE_JOB_CONFIG['WORKER_CONCURRENCY']
+        self.poll_interval = poll_interval or KNOWLEDGE_JOB_CONFIG['POLL_INTERVAL']
+        self.stop_event = threading.Event()
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self._gc_lock = threading.Lock()
+        self._next_gc = time.monotonic()
+        self._sync_lock = threading.Lock()
+        self._next_sync = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self, once=False, preload_models=None):
+        """启动 worker 线程并阻塞；once 为 True 时队列清空后退出"""
+        # 预加载常用本地模型，首个任务无需等待模型加载
+        embedding_pool.preload(list(KNOWLEDGE_EMBEDDING_POOL_CONFIG['PRELOAD_MODELS']) + list(preload_models or []))
+        requeue_stale_jobs()
+        self._sync_indexes()
+        threads = [
+            threading.Thread(target=self._loop, args=(f'{self.name}:{i}', once), daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+        shutdown_process_pools()
+        logger.info(f'[KnowledgeJob] worker {self.name} 退出，模型池统计: {embedding_pool.stats()}')
+
+    def _sync_indexes(self):
+        """启动时整理全部知识库索引，之后空闲时按 INDEX_SYNC_INTERVAL 定期执行"""
+        interval = KNOWLEDGE_JOB_CONFIG['INDEX_SYNC_INTERVAL']
+        with self._sync_lock:
+            if self._next_sync is not None and (not interval or time.monotonic() < self._next_sync):
+                return
+            self._next_sync = time.monotonic() + interval
+        synced = sync_indexes()
+        if synced:
+            logger.info(f'[KnowledgeJob] worker {self.name} 整理了 {synced} 个知识库的索引')
+
+    def _collect_garbage(self):
+        interval = KNOWLEDGE_GC_CONFIG['INTERVAL_SECONDS']
+        # 同一进程只由一个空闲线程执行
+        with self._gc_lock:
+            if not interval or time.monotonic() < self._next_gc:
+                return
+            self._next_gc = time.monotonic() + interval
+        try:
+            collect_garbage()
+        except Exception as e:
+            logger.error(f'[KnowledgeJob] worker {self.name} 定期回收存储失败: {str(e)}', exc_info=True)
+
+    def _loop(self, worker_id, once):
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                job = claim_next_job(worker_id)
+                if job is None:
+                    if once:
+                        return
+                    requeue_stale_jobs()
+                    self._sync_indexes()
+                    self._collect_garbage()
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+                run_job(job)
+        finally:
+            connection.close()
@@ -0,0 +1,146 @@
+"""
+知识库关键词倒排索引：中日韩文本按字二元组切分，英文、数字、课程编号、公式按词切分；倒排表按段存储，BM25 打分
+
+每个段是一组 .npy 文件（可内存映射）：
+    <seg>.terms.npy     升序排列的词项哈希（uint64）
+    <seg>.offsets.npy   每个词项在倒排表中的起止位置（int64，长度为词项数 + 1）
+    <seg>.rows.npy      倒排表中的行号（uint32）
+    <seg>.tfs.npy       行内词频（uint16）
+"""
+import hashlib
+import os
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from ..rules import KNOWLEDGE_SEARCH_CONFIG
+
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+# 中日韩连续字符；或由字母数字组成、可用 . _ - + ^ / 连接的词（如 CS-101、3.14、x^2+y^2）
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|[0-9a-z]+(?:[._\-+^/=][0-9a-z]+)*')
+_WORD_PART_RE = re.compile(r'[0-9a-z]+')
+SEGMENT_FILES = ('terms', 'offsets', 'rows', 'tfs')
+
+
+def tokenize(text):
+    """返回词项列表：中日韩字符串切成相邻二字组（单字保留单字），组合词同时保留整体与各组成部分"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(unicodedata.normalize('NFKC', text).lower()):
+        token = match.group()
+        if not token[0].isascii():
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+            continue
+        tokens.append(token)
+        parts = _WORD_PART_RE.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def analyze(texts):
+    """把多个分段转成 (词项哈希, 相对行号, 词频) 三元组数组及每行的词项总数"""
+    terms, rows, tfs, doc_lens = [], [], [], []
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        doc_lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            terms.append(term_hash(term))
+            rows.append(row)
+            tfs.append(min(tf, 65535))
+    return (
+        np.array(terms, dtype=np.uint64),
+        np.array(rows, dtype=np.uint32),
+        np.array(tfs, dtype=np.uint16),
+        np.array(doc_lens, dtype=np.uint32),
+    )
+
+
+def write_segment(directory, name, terms, rows, tfs):
+    """按 (词项, 行号) 排序三元组并写成一个段"""
+    order = np.lexsort((rows, terms))
+    terms, rows, tfs = terms[order], rows[order], tfs[order]
+    unique_terms, starts = np.unique(terms, return_index=True)
+    offsets = np.append(starts, len(terms)).astype(np.int64)
+    os.makedirs(directory, exist_ok=True)
+    for suffix, array in zip(SEGMENT_FILES, (unique_terms, offsets, rows, tfs)):
+        np.save(os.path.join(directory, f'{name}.{suffix}.npy'), array)
+
+
+def segment_paths(directory, name):
+    return [os.path.join(directory, f'{name}.{suffix}.npy') for suffix in SEGMENT_FILES]
+
+
+class KeywordSegment:
+    def __init__(self, directory, name):
+        self.name = name
+        self.terms, self.offsets, self.rows, self.tfs = [
+            np.load(path, mmap_mode='r') for path in segment_paths(directory, name)
+        ]
+
+    def postings(self, term):
+        """返回 (rows, tfs)；词项不存在时返回 None"""
+        position = int(np.searchsorted(self.terms, term))
+        if position >= len(self.terms) or int(self.terms[position]) != term:
+            return None
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        return self.rows[start:end], self.tfs[start:end]
+
+    def triplets(self):
+        """展开为 (terms, rows, tfs)，用于合并段"""
+        counts = np.diff(self.offsets)
+        return np.repeat(np.asarray(self.terms), counts), np.asarray(self.rows), np.asarray(self.tfs)
+
+
+def merge_segments(directory, segments, name, row_map=None):
+    """把多个段合并为一个新段；row_map 给出旧行号到新行号的映射，映射为 -1 的行被丢弃"""
+    parts = [segment.triplets() for segment in segments]
+    terms = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0, dtype=np.uint64)
+    rows = np.concatenate([p[1] for p in parts]).astype(np.int64) if parts else np.zeros(0, dtype=np.int64)
+    tfs = np.concatenate([p[2] for p in parts]) if parts else np.zeros(0, dtype=np.uint16)
+    if row_map is not None:
+        rows = row_map[rows]
+        keep = rows >= 0
+        terms, rows, tfs = terms[keep], rows[keep], tfs[keep]
+    write_segment(directory, name, terms, rows.astype(np.uint32), tfs)
+
+
+def bm25_search(segments, query, doc_lens, live, top_k, avg_doc_len):
+    """在各段倒排表中查找查询词项并按 BM25 累加得分，不扫描全部行；返回按得分降序的 (rows, scores)。
+    top_k 为 None 时返回全部命中行，按行号升序"""
+    k1, b = KNOWLEDGE_SEARCH_CONFIG['BM25_K1'], KNOWLEDGE_SEARCH_CONFIG['BM25_B']
+    total = len(doc_lens)
+    hit_rows, hit_scores = [], []
+    for term in {term_hash(token) for token in tokenize(query)}:
+        postings = [p for p in (segment.postings(term) for segment in segments) if p is not None]
+        df = sum(len(rows) for rows, _ in postings)
+        if not df:
+            continue
+        idf = np.log(1 + (total - df + 0.5) / (df + 0.5))
+        for rows, tfs in postings:
+            rows = np.asarray(rows, dtype=np.int64)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            norm = k1 * (1 - b + b * doc_lens[rows] / max(avg_doc_len, 1e-9))
+            hit_rows.append(rows)
+            hit_scores.append(idf * tfs * (k1 + 1) / (tfs + norm))
+    if not hit_rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    rows, inverse = np.unique(np.concatenate(hit_rows), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(hit_scores)).astype(np.float32)
+    keep = live[rows]
+    rows, scores = rows[keep], scores[keep]
+    if top_k is None:
+        return rows, scores
+    if len(rows) > top_k:
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        rows, scores = rows[top], scores[top]
+    order = np.argsort(-scores, kind='stable')
+    return rows[order], scores[order]
@@ -0,0 +1,133 @@
+"""
+分段元数据过滤：检索前按文件、页码、章节、工作表、上传日期筛选行，只在筛选出的行上计算向量相似度
+
+按行的字段（页码、章节、工作表）以特殊词项写入关键词倒排表（与正文词项共用段文件，随段合并与压缩一起维护），
+各字段出现过的取值记录在 manifest['metadata'] 中，用于范围与包含匹配；按文件的字段（文件、文件名、上传日期）
+由知识文件表解析为文件 id，再由 manifest 中各文件的行范围得到行
+"""
+import datetime
+
+import numpy as np
+from django.db.models import Q
+
+from .keyword_index import term_hash
+
+ROW_FIELDS = ('page', 'section', 'sheet')
+FILE_FIELDS = ('file_id', 'source', 'uploaded')
+FILTER_FIELDS = FILE_FIELDS + ROW_FIELDS
+
+
+class FilterError(ValueError):
+    pass
+
+
+def field_term(field, value):
+    # 正文分词不会产生以 \x00 开头的词项，不会与关键词检索冲突
+    return term_hash(f'\x00{field}:{value}')
+
+
+def metadata_terms(metadatas):
+    """把分段元数据转成 (词项哈希, 相对行号, 词频) 三元组数组及各字段出现的取值"""
+    terms, rows, values = [], [], {}
+    for row, metadata in enumerate(metadatas):
+        for field in ROW_FIELDS:
+            value = metadata.get(field)
+            if value is None or value == '':
+                continue
+            terms.append(field_term(field, value))
+            rows.append(row)
+            values.setdefault(field, set()).add(value)
+    return (
+        np.array(terms, dtype=np.uint64),
+        np.array(rows, dtype=np.uint32),
+        np.ones(len(terms), dtype=np.uint16),
+        values,
+    )
+
+
+def merge_values(known, values):
+    """把新出现的取值并入 manifest['metadata']（有序去重）"""
+    for field, new in values.items():
+        known[field] = sorted(set(known.get(field, [])) | new, key=lambda v: (isinstance(v, str), v))
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _parse_range(field, value, convert):
+    try:
+        if isinstance(value, dict):
+            unknown = set(value) - {'gte', 'lte'}
+            if unknown:
+                raise FilterError(f'过滤条件 {field} 只支持 gte、lte: {sorted(unknown)}')
+            return {key: convert(v) for key, v in value.items() if v not in (None, '')}
+        return [convert(v) for v in _as_list(value)]
+    except (TypeError, ValueError) as e:
+        if isinstance(e, FilterError):
+            raise
+        raise FilterError(f'过滤条件 {field} 的取值无效: {value}')
+
+
+def parse_filters(filters):
+    """校验检索请求的 filters，返回 {字段: 条件}。条件为取值列表（任一匹配）或 {'gte', 'lte'} 范围：
+        file_id   文件 id
+        source    文件名包含的文字
+        uploaded  上传日期 YYYY-MM-DD，可用范围
+        page      页码（PDF 页、幻灯片序号），可用范围
+        section   章节标题包含的文字（Word 标题、幻灯片标题）
+        sheet     工作表名称"""
+    if not filters:
+        return {}
+    if not isinstance(filters, dict):
+        raise FilterError('filters 必须为对象')
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise FilterError(f'不支持的过滤字段: {sorted(unknown)}，可用字段: {list(FILTER_FIELDS)}')
+    parsed = {}
+    for field, value in filters.items():
+        if value is None or value == '' or value == []:
+            continue
+        if field == 'file_id':
+            parsed[field] = _parse_range(field, _as_list(value), int)
+        elif field == 'page':
+            parsed[field] = _parse_range(field, value, int)
+        elif field == 'uploaded':
+            parsed[field] = _parse_range(field, value, datetime.date.fromisoformat)
+        else:
+            parsed[field] = [str(v) for v in _as_list(value) if str(v).strip()]
+    return parsed
+
+
+def match_values(field, condition, known):
+    """在该字段出现过的取值中找出满足条件的取值"""
+    if isinstance(condition, dict):
+        return [v for v in known if ('gte' not in condition or v >= condition['gte'])
+                and ('lte' not in condition or v <= condition['lte'])]
+    if field == 'section':
+        needles = [c.lower() for c in condition]
+        return [v for v in known if any(needle in v.lower() for needle in needles)]
+    known = set(known)
+    return [v for v in condition if v in known]
+
+
+def filter_files(files, filters):
+    """按文件字段筛选知识文件查询集，返回文件 id 集合；没有文件字段条件时返回 None"""
+    if not any(field in filters for field in FILE_FIELDS):
+        return None
+    if 'file_id' in filters:
+        files = files.filter(id__in=filters['file_id'])
+    if 'source' in filters:
+        condition = Q()
+        for text in filters['source']:
+            condition |= Q(filename__icontains=text)
+        files = files.filter(condition)
+    uploaded = filters.get('uploaded')
+    if isinstance(uploaded, dict):
+        if 'gte' in uploaded:
+            files = files.filter(created__date__gte=uploaded['gte'])
+        if 'lte' in uploaded:
+            files = files.filter(created__date__lte=uploaded['lte'])
+    elif uploaded:
+        files = files.filter(created__date__in=uploaded)
+    return set(files.values_list('id', flat=True))
@@ -0,0 +1,73 @@
+"""
+本地模型多进程并行向量化：分段批次分发到 worker 进程内共用的常驻进程池（见 process_pool），子进程按模型配置从各自的模型池
+加载并复用模型
+"""
+import os
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+import numpy as np
+
+from ..rules import KNOWLEDGE_PROCESS_CONFIG
+from .embedding import Embeddings, embedding_pool, iter_batches
+from .process_pool import SharedProcessPool
+
+
+def resolve_parallel_workers(embedding_config, embedding_type, chunk_count):
+    """计算本次向量化使用的进程数，返回 1 表示不并行"""
+    if embedding_type != 'local':
+        return 1
+    workers = (embedding_config or {}).get('parallel_workers')
+    if workers is None:
+        workers = KNOWLEDGE_PROCESS_CONFIG['EMBED_WORKERS']
+    workers = int(workers) or os.cpu_count() or 1
+    if workers <= 1 or chunk_count < KNOWLEDGE_PROCESS_CONFIG['PARALLEL_MIN_CHUNKS']:
+        return 1
+    return workers
+
+
+def _init_worker(threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _embed_batch(spec, texts):
+    # 子进程的模型池按 (type, model, device, normalize) 缓存模型，不同配置的任务共用同一进程池
+    return np.asarray(embedding_pool.get(*spec).embed_documents(texts), dtype=np.float32)
+
+
+# 模型在每个子进程中只加载一次；需要的进程数超过现有进程池时换用更大的进程池
+embedding_process_pool = SharedProcessPool('向量化', _init_worker, (KNOWLEDGE_PROCESS_CONFIG['EMBED_THREADS_PER_WORKER'],))
+
+
+class ParallelEmbeddings(Embeddings):
+    """把一次 embed_documents 的分段按 batch_size 切成子批，交给进程池并行计算，结果保持原顺序；
+    每次最多同时提交 workers 个子批，多个任务共用进程池时各自的并行度不超过其配置"""
+
+    def __init__(self, embedder, spec, workers, batch_size):
+        self.embedder = embedder
+        self.spec = spec
+        self.workers = workers
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts):
+        batches = list(iter_batches(list(texts), self.batch_size))
+        if len(batches) <= 1:
+            return self.embedder.embed_documents(texts)
+        vectors = []
+        with embedding_process_pool.acquire(self.workers) as executor:
+            try:
+                for start in range(0, len(batches), self.workers):
+                    window = batches[start:start + self.workers]
+                    for result in executor.map(_embed_batch, repeat(self.spec, len(window)), window):
+                        vectors.extend(result.tolist())
+            except BrokenProcessPool:
+                embedding_process_pool.discard(executor)
+                raise
+        return vectors
+
+    def embed_query(self, text):
+        return self.embedder.embed_query(text)
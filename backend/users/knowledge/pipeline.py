@@ -0,0 +1,279 @@
+"""
+知识库文件处理流水线：提取 → 清洗 → 分段 → 近似去重 → 向量化 → 存储
+
+每个文件写入索引时记录各阶段的配置指纹；整体重新处理（incremental）时从第一个指纹变化的阶段开始，
+之前阶段的结果直接复用：提取文本来自提取文本产物，分段来自索引中已存储的行，未变化分段的向量来自向量缓存
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+
+import numpy as np
+
+from .extractors import TextSegment, UnsupportedFileType
+from .text_artifact import ARTIFACT_VERSION, ensure_text_artifact
+from .splitter import split_segments, split_with_parents, resolve_parent_config
+from .embedding import resolve_batch_size, embed_in_batches, build_embedder, local_model_spec, embedding_info, CountingEmbeddings
+from .parallel_embedding import resolve_parallel_workers, ParallelEmbeddings
+from .embedding_cache import get_embedding_cache, embedding_cache_key, CachedEmbeddings
+from .vector_index import get_index, read_file_chunks, replace_file_rows, stored_file_stages
+from .dedup import find_duplicates
+from ..rules import KNOWLEDGE_DEDUP_CONFIG
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('extract', 'split', 'embed')
+
+
+class KnowledgeProcessError(Exception):
+    """流水线可预期的失败；retryable 表示后台任务是否值得重试"""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.message = message
+        self.retryable = retryable
+
+
+class ProcessCancelled(Exception):
+    """处理过程中收到取消请求"""
+
+
+class ProcessContext:
+    """流水线运行上下文：记录当前阶段，并在各阶段之间检查是否被取消"""
+
+    def set_stage(self, stage):
+        pass
+
+    def check(self):
+        pass
+
+
+def clean_text(text, clean_config):
+    clean_config = clean_config or {}
+    if clean_config.get('clean_text'):
+        text = re.sub(r'[ \t\r\f\v]+', ' ', text)
+    if clean_config.get('remove_urls'):
+        text = re.sub(r'https?://\S+', '', text)
+    if clean_config.get('remove_emails'):
+        text = re.sub(r'\S+@\S+', '', text)
+    if clean_config.get('remove_extra_whitespace'):
+        text = ' '.join(text.split())
+    if clean_config.get('remove_special_chars'):
+        text = re.sub(r'[^\w\s]', '', text)
+    return text
+
+
+def _clean(text, clean_config):
+    try:
+        return clean_text(text, clean_config)
+    except Exception as e:
+        logger.error(f'[KnowledgeFileProcess] 文本清洗失败: {str(e)}')
+        raise KnowledgeProcessError(f"文本清洗失败: {str(e)}")
+
+
+def _iter_clean_segments(segments, clean_config):
+    for segment in segments:
+        yield TextSegment(_clean(segment.text, clean_config), segment.metadata)
+
+
+def _fingerprint(*parts):
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def stage_fingerprints(params):
+    """各阶段输出所依赖配置的指纹，后一阶段的指纹包含前一阶段；只影响速度的配置（批大小、并行进程数等）不计入"""
+    encoding = (params.get('loader_config') or {}).get('encoding', 'utf-8')
+    extract = _fingerprint('extract', encoding, ARTIFACT_VERSION)
+    split = _fingerprint(extract, params.get('clean_config') or {}, params.get('splitter_config') or {})
+    embed = _fingerprint(split, embedding_info(params.get('embedding_config')))
+    return {'extract': extract, 'split': split, 'embed': embed}
+
+
+def resume_stage(previous, current):
+    """需要重新开始的阶段，None 表示各阶段的结果都可以复用"""
+    for stage in STAGES:
+        if not previous or previous.get(stage) != current[stage]:
+            return stage
+    return None
+
+
+def _extract_and_split(kf, params, context):
+    """提取文件内容并清洗、分段，返回 (chunks, chunk_metadatas, artifact, artifact_reused)"""
+    file_id = kf.id
+
+    # 1. 文件内容提取：同一文件内容只解析一次，之后直接读取已持久化的提取文本
+    context.set_stage('extract')
+    loader_config = params.get("loader_config", {})
+    encoding = loader_config.get("encoding", "utf-8")
+    try:
+        artifact, artifact_reused = ensure_text_artifact(kf, encoding, workers=loader_config.get('workers'))
+    except UnsupportedFileType as e:
+        raise KnowledgeProcessError(str(e))
+    except Exception as e:
+        logger.error(f'[KnowledgeFileProcess] 读取文件内容失败: {str(e)}')
+        raise KnowledgeProcessError(f"读取文件内容失败: {str(e)}")
+
+    # 2-3. 清洗 → 分段：片段逐个从提取文本中读出，分段继承片段的页码等元数据；
+    # 父子分段时先在原文上切父块，子块只记录父块在提取文本中的偏移
+    context.set_stage('split')
+    splitter_config = params.get('splitter_config', {})
+    clean_config = params.get('clean_config', {})
+    try:
+        parent_config = resolve_parent_config(splitter_config)
+        if parent_config:
+            segments = zip((start for start, _, _ in artifact.segments), artifact.iter_segments())
+            chunks, chunk_metadatas = split_with_parents(
+                segments, splitter_config, parent_config, lambda text: _clean(text, clean_config))
+        else:
+            chunks, chunk_metadatas = split_segments(_iter_clean_segments(artifact.iter_segments(), clean_config), splitter_config)
+    except ValueError as e:
+        raise KnowledgeProcessError(f"分段参数错误: {str(e)}")
+    if not chunks:
+        raise KnowledgeProcessError("文件内容为空，无法分段")
+    logger.info(f'[KnowledgeFileProcess] 文件 {file_id} 分段完成，共 {len(chunks)} 段')
+    return chunks, chunk_metadatas, artifact, artifact_reused
+
+
+def process_knowledge_file(kf, params, user=None, context=None):
+    """按 params（即知识库 embedding_config）处理单个知识文件，返回处理结果。
+    params['incremental'] 为真时只重做配置变化影响到的阶段，各阶段都未变化时直接跳过"""
+    context = context or ProcessContext()
+    file_id = kf.id
+    try:
+        stages = stage_fingerprints(params)
+    except ValueError as e:
+        raise KnowledgeProcessError(str(e))
+    resume = 'extract'
+    if params.get('incremental'):
+        resume = resume_stage(stored_file_stages(kf.kb_id).get(str(file_id)), stages)
+        if resume is None:
+            logger.info(f'[KnowledgeFileProcess] 文件 {file_id} 各阶段配置未变化，跳过处理')
+            return {'file_id': file_id, 'resume_stage': None, 'skipped': True}
+
+    # 1-3. 提取 → 清洗 → 分段；只有向量化配置变化时直接使用索引中已存储的分段
+    reused = read_file_chunks(kf.kb_id, file_id, stages['split']) if resume == 'embed' else None
+    if reused:
+        chunks, chunk_metadatas, text_artifact = reused
+        text_artifact = text_artifact or kf.text_artifact
+        char_count, artifact_reused = kf.char_count, True
+        logger.info(f'[KnowledgeFileProcess] 文件 {file_id} 复用已存储的 {len(chunks)} 个分段，跳过提取与分段')
+    else:
+        chunks, chunk_metadatas, artifact, artifact_reused = _extract_and_split(kf, params, context)
+        char_count, text_artifact = artifact.char_count, artifact.key
+
+    # 4. 近似去重：与知识库已有分段（同一向量化模型）及本文件更早的分段比较，重复分段复用规范分段的向量，不再向量化
+    context.set_stage('dedup')
+    embedding_config = params.get('embedding_config', {})
+    dedup = (params.get('dedup_config') or {}).get('enabled', KNOWLEDGE_DEDUP_CONFIG['ENABLED'])
+    index_rows = np.full(len(chunks), -1, dtype=np.int64)
+    local_rows = np.full(len(chunks), -1, dtype=np.int64)
+    if dedup:
+        index = get_index(kf.kb_id)
+        if index is not None and index.embedding != embedding_info(embedding_config):
+            index = None
+        index_rows, local_rows, _ = find_duplicates(chunks, index, exclude_file=file_id)
+    unique = [i for i in range(len(chunks)) if index_rows[i] < 0 and local_rows[i] < 0]
+    duplicate_count = len(chunks) - len(unique)
+    if duplicate_count:
+        logger.info(f'[KnowledgeFileProcess] 文件 {file_id} 近似重复分段 {duplicate_count} 个，直接复用已有向量')
+
+    # 5. 初始化向量化模型
+    context.set_stage('embed')
+    init_start = time.monotonic()
+    try:
+        batch_size = resolve_batch_size(embedding_config)
+        embedder, model_name, embedding_type = build_embedder(embedding_config, user)
+    except ValueError as e:
+        raise KnowledgeProcessError(str(e))
+    except Exception as e:
+        logger.error(f'[KnowledgeFileProcess] 初始化向量化模型失败: {str(e)}')
+        raise KnowledgeProcessError(f"初始化向量化模型失败: {str(e)}", retryable=True)
+
+    model_init_seconds = time.monotonic() - init_start
+
+    # 6. 生成嵌入向量（按批送入模型，每个分段只向量化一次；命中缓存的分段与近似重复的分段不再送入模型）
+    unique_chunks = [chunks[i] for i in unique]
+    parallel_workers = resolve_parallel_workers(embedding_config, embedding_type, len(unique_chunks))
+    model_embedder = embedder
+    if parallel_workers > 1:
+        # 大文档按进程数放大每次提交的分段数，由进程池切回 batch_size 的子批并行计算
+        model_embedder = ParallelEmbeddings(embedder, local_model_spec(embedding_config), parallel_workers, batch_size)
+    counter = CountingEmbeddings(model_embedder)
+    embedder = counter
+    cache = get_embedding_cache() if embedding_config.get('use_cache', True) else None
+    if cache is not None:
+        embedder = CachedEmbeddings(
+            counter, cache, embedding_cache_key(embedding_type, model_name, embedding_config.get('normalize', True)))
+    embed_start = time.monotonic()
+    try:
+        unique_embeddings = embed_in_batches(embedder, unique_chunks, batch_size * parallel_workers, before_batch=context.check)
+    except (KnowledgeProcessError, ProcessCancelled):
+        raise
+    except Exception as e:
+        if 'RateLimitError' in str(e):
+            logger.error('[KnowledgeFileProcess] 调用 API 被限流，请稍后重试或更换 API Key')
+            raise KnowledgeProcessError("API 调用频率超限，请稍后重试或更换 API Key", retryable=True)
+        logger.error(f'[KnowledgeFileProcess] 生成嵌入向量失败: {str(e)}')
+        raise KnowledgeProcessError(f"生成嵌入向量失败: {str(e)}", retryable=True)
+    embed_seconds = time.monotonic() - embed_start
+    expected_count = embedder.computed if cache is not None else len(unique_chunks)
+    if counter.embedded_count != expected_count:
+        logger.error(f'[KnowledgeFileProcess] 向量化次数异常: 应送入模型 {expected_count} 个分段，实际 {counter.embedded_count} 个')
+    cache_stats = embedder.stats() if cache is not None else {}
+    if cache_stats:
+        logger.info(f'[KnowledgeFileProcess] 文件 {file_id} 向量缓存命中率 {cache_stats["cache_hit_ratio"]:.2%}')
+
+    embeddings = [None] * len(chunks)
+    for i, vector in zip(unique, unique_embeddings):
+        embeddings[i] = vector
+    # 与已有规范行重复的分段留空，写入时复用规范行已存储（可能已降维）的向量
+    for i in range(len(chunks)):
+        if local_rows[i] >= 0:
+            embeddings[i] = embeddings[local_rows[i]]
+
+    # 7. 写入知识库索引：替换该文件原有的行，存储层不再调用 embedder
+    context.set_stage('store')
+    context.check()
+    # 分段元数据：文件、文件名、上传日期，以及片段的页码、章节、工作表等，检索时可按这些字段过滤
+    file_metadata = {"file_id": file_id, "source": kf.filename, "uploaded": kf.created.date().isoformat()}
+    try:
+        index_result = replace_file_rows(
+            kf.kb_id,
+            file_id,
+            chunks,
+            embeddings,
+            [{**file_metadata, "chunk_index": i, **chunk_metadatas[i]} for i in range(len(chunks))],
+            embedding_info(embedding_config),
+            params.get('vector_store_config'),
+            text_artifact,
+            dedup,
+            stages,
+        )
+    except Exception as e:
+        logger.error(f'[KnowledgeFileProcess] 写入知识库索引失败: {str(e)}')
+        raise KnowledgeProcessError(f"写入知识库索引失败: {str(e)}", retryable=True)
+
+    return {
+        'file_id': file_id,
+        'resume_stage': resume,
+        'char_count': char_count,
+        'text_artifact': text_artifact,
+        'text_artifact_reused': artifact_reused,
+        'chunk_count': len(chunks),
+        'duplicate_chunks': duplicate_count,
+        'dedup_ratio': round(duplicate_count / len(chunks), 4),
+        'batch_size': batch_size,
+        'embedded_count': counter.embedded_count,
+        'embed_calls': counter.call_count,
+        **cache_stats,
+        'parallel_workers': parallel_workers,
+        'embed_seconds': round(embed_seconds, 3),
+        'chunks_per_second': round(len(unique_chunks) / embed_seconds, 1) if embed_seconds > 0 else None,
+        'embedding_model': model_name,
+        'embedding_type': embedding_type,
+        'model_init_seconds': round(model_init_seconds, 3),
+        **index_result
+    }
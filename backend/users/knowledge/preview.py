@@ -0,0 +1,225 @@
+"""
+分段预览：只对文件的一部分（开头、全文均匀抽样或页码范围）执行 提取 → 清洗 → 分段，不向量化；
+提取文本来自提取文本产物，只解压抽样范围所在的块，返回分段边界、长度分布以及按抽样比例推算的全文分段数与向量化 token / 费用
+"""
+import functools
+import logging
+import math
+import time
+
+import numpy as np
+
+from ..rules import KNOWLEDGE_PREVIEW_CONFIG, KNOWLEDGE_PROCESS_CONFIG
+from .embedding import embedding_info, resolve_batch_size
+from .extractors import TextSegment
+from .pipeline import clean_text
+from .registry import lazy_import
+from .splitter import build_text_splitter, resolve_parent_config, split_with_parents
+from .text_artifact import ensure_text_artifact
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_MODES = ('head', 'spread')
+
+
+class PreviewError(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=1)
+def _token_encoding():
+    try:
+        return lazy_import('tiktoken').get_encoding(KNOWLEDGE_PROCESS_CONFIG['TOKEN_ENCODING'])
+    except Exception as e:
+        logger.warning(f'[KnowledgePreview] 无法加载 token 编码，按字符数估算 token: {str(e)}')
+        return None
+
+
+def count_tokens(text):
+    """OpenAI 向量化模型的 token 数；没有编码表时按 ASCII 4 字符 / 其他字符 1 字符一个 token 估算"""
+    encoding = _token_encoding()
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4) + len(text) - ascii_chars
+
+
+def parse_sample(sample):
+    """校验抽样参数：mode 为 head（从开头连续抽样）或 spread（全文均匀抽样），chars 为抽样字符数，pages 为 [起始页, 结束页]"""
+    sample = sample or {}
+    if not isinstance(sample, dict):
+        raise PreviewError('sample 必须为对象')
+    mode = sample.get('mode') or 'head'
+    if mode not in SAMPLE_MODES:
+        raise PreviewError(f'不支持的抽样方式: {mode}，可用: {list(SAMPLE_MODES)}')
+    try:
+        chars = int(sample.get('chars') or KNOWLEDGE_PREVIEW_CONFIG['SAMPLE_CHARS'])
+        pages = sample.get('pages')
+        pages = [int(page) for page in pages] if pages else None
+    except (TypeError, ValueError):
+        raise PreviewError('抽样字符数与页码必须为整数')
+    if chars <= 0:
+        raise PreviewError('抽样字符数必须大于0')
+    if pages is not None and (len(pages) != 2 or pages[0] > pages[1]):
+        raise PreviewError('pages 必须为 [起始页, 结束页]')
+    return {'mode': mode, 'chars': min(chars, KNOWLEDGE_PREVIEW_CONFIG['MAX_SAMPLE_CHARS']), 'pages': pages}
+
+
+def _snap(text, start, end, cut_start, cut_end):
+    """窗口从片段中间截断时，把截断处移到相邻的换行，避免预览出人为的断句"""
+    if cut_start:
+        position = text.find('\n', 0, len(text) // 2)
+        if position >= 0:
+            start += position + 1
+            text = text[position + 1:]
+    if cut_end:
+        position = text.rfind('\n', len(text) // 2)
+        if position >= 0:
+            end -= len(text) - position
+            text = text[:position]
+    return text, start, end
+
+
+def _take(segments, index, offset, size):
+    """从第 index 个片段的 offset 起连续取 size 个字符，跨越片段时每个片段一个窗口"""
+    spans = []
+    for segment in segments[index:]:
+        start = max(offset, segment[0])
+        take = min(segment[1] - start, size)
+        spans.append((start, start + take, segment))
+        size -= take
+        if size <= 0:
+            break
+    return spans
+
+
+def sample_windows(artifact, sample):
+    """按抽样参数选出提取文本中的窗口，返回 ([(起始偏移, TextSegment)], 抽样范围的总字符数)"""
+    segments = artifact.segments
+    if sample['pages']:
+        first, last = sample['pages']
+        segments = [s for s in segments if isinstance(s[2].get('page'), int) and first <= s[2]['page'] <= last]
+        if not segments:
+            raise PreviewError(f'文件中没有第 {first}-{last} 页的内容')
+    total = sum(end - start for start, end, _ in segments)
+    budget = sample['chars']
+    if total <= budget:
+        spans = [(segment[0], segment[1], segment) for segment in segments]
+    elif sample['mode'] == 'head':
+        spans = _take(segments, 0, segments[0][0], budget)
+    else:
+        count = KNOWLEDGE_PREVIEW_CONFIG['SAMPLE_WINDOWS']
+        size = budget // count
+        lengths = np.cumsum([end - start for start, end, _ in segments])
+        spans = []
+        for i in range(count):
+            # 在所有片段首尾相接的坐标中均匀取点，再换算回片段内的偏移
+            position = (total - size) * i // max(count - 1, 1)
+            index = int(np.searchsorted(lengths, position, side='right'))
+            offset = segments[index][0] + position - (int(lengths[index - 1]) if index else 0)
+            if spans and (spans[-1][2][0], spans[-1][1]) > (segments[index][0], offset):
+                continue
+            spans.extend(_take(segments, index, offset, size))
+    windows = []
+    for start, end, (segment_start, segment_end, metadata) in spans:
+        text, start, end = _snap(artifact.read(start, end), start, end, start > segment_start, end < segment_end)
+        if text.strip():
+            windows.append((start, TextSegment(text, metadata)))
+    return windows, total
+
+
+def _split_windows(windows, params):
+    """按处理参数清洗、分段，返回 [(分段, 元数据)]；元数据记录分段在抽样窗口中的位置，父子分段时记录父块偏移"""
+    splitter_config = params.get('splitter_config') or {}
+    clean_config = params.get('clean_config') or {}
+    parent_config = resolve_parent_config(splitter_config)
+    splitter = build_text_splitter(splitter_config)
+    chunks = []
+    for window, (offset, segment) in enumerate(windows):
+        if parent_config:
+            for chunk, metadata in zip(*split_with_parents(
+                    [(offset, segment)], splitter_config, parent_config, lambda text: clean_text(text, clean_config))):
+                chunks.append((chunk, dict(metadata, window=window)))
+            continue
+        text = clean_text(segment.text, clean_config)
+        cursor = 0
+        for chunk in splitter.split_text(text):
+            if not chunk.strip():
+                continue
+            # 分段是清洗后文本的子串，相邻分段可能重叠，从上一个分段起点之后查找
+            position = text.find(chunk, cursor)
+            metadata = dict(segment.metadata, window=window)
+            if position >= 0:
+                metadata.update(start=position, end=position + len(chunk))
+                cursor = position + 1
+            chunks.append((chunk, metadata))
+    return chunks
+
+
+def _histogram(values, upper):
+    counts, edges = np.histogram(values, bins=KNOWLEDGE_PREVIEW_CONFIG['HISTOGRAM_BINS'], range=(0, max(upper, 1)))
+    return {
+        'edges': [int(round(edge)) for edge in edges],
+        'counts': counts.tolist(),
+        'min': int(np.min(values)),
+        'max': int(np.max(values)),
+        'mean': round(float(np.mean(values)), 1),
+        'p50': int(np.percentile(values, 50)),
+        'p90': int(np.percentile(values, 90)),
+    }
+
+
+def embedding_cost(embedding_config, tokens):
+    """估算向量化费用（美元）；本地模型不计费"""
+    info = embedding_info(embedding_config)
+    if info['type'] != 'openai':
+        return 0.0
+    prices = KNOWLEDGE_PREVIEW_CONFIG['EMBEDDING_PRICES']
+    return round(tokens / 1_000_000 * prices.get(info['model'], prices['DEFAULT']), 6)
+
+
+def preview_knowledge_file(kf, params, sample=None):
+    """按处理参数预览知识文件的分段结果，不调用向量化模型"""
+    started = time.monotonic()
+    sample = parse_sample(sample)
+    encoding = (params.get('loader_config') or {}).get('encoding', 'utf-8')
+    artifact, artifact_reused = ensure_text_artifact(kf, encoding)
+    windows, scope_chars = sample_windows(artifact, sample)
+    try:
+        chunks = _split_windows(windows, params)
+    except ValueError as e:
+        raise PreviewError(f'分段参数错误: {str(e)}')
+    sampled_chars = sum(len(segment.text) for _, segment in windows)
+    lengths = np.array([len(chunk) for chunk, _ in chunks], dtype=np.int64)
+    tokens = np.array([count_tokens(chunk) for chunk, _ in chunks], dtype=np.int64)
+    # 抽样之外的部分按相同的分段密度推算
+    scale = scope_chars / sampled_chars if sampled_chars else 0
+    estimated_chunks = int(round(len(chunks) * scale))
+    estimated_tokens = int(round(int(tokens.sum()) * scale))
+    embedding_config = params.get('embedding_config') or {}
+    chunk_size = int((params.get('splitter_config') or {}).get('chunk_size') or 1000)
+    max_chunks = KNOWLEDGE_PREVIEW_CONFIG['MAX_CHUNKS']
+    return {
+        'file_id': kf.id,
+        'text_artifact_reused': artifact_reused,
+        'char_count': artifact.char_count,
+        'sample': dict(sample, windows=len(windows), chars_sampled=sampled_chars, scope_chars=scope_chars,
+                       ratio=round(sampled_chars / scope_chars, 4) if scope_chars else 0.0),
+        'chunks': [{'content': chunk, 'metadata': dict(metadata, chars=len(chunk), tokens=int(tokens[i]))}
+                   for i, (chunk, metadata) in enumerate(chunks[:max_chunks])],
+        'chunk_count': len(chunks),
+        'truncated': len(chunks) > max_chunks,
+        'histogram': {
+            'chars': _histogram(lengths, max(chunk_size, int(lengths.max()))) if len(chunks) else None,
+            'tokens': _histogram(tokens, int(tokens.max())) if len(chunks) else None,
+        },
+        'estimate': {
+            'chunks': estimated_chunks,
+            'tokens': estimated_tokens,
+            'token_method': 'tiktoken' if _token_encoding() is not None else 'chars',
+            'embedding_model': embedding_info(embedding_config)['model'],
+            'embed_calls': math.ceil(estimated_chunks / resolve_batch_size(embedding_config)),
+            'cost_usd': embedding_cost(embedding_config, estimated_tokens),
+        },
+        'took_ms': round((time.monotonic() - started) * 1000, 1),
+    }
@@ -0,0 +1,86 @@
+"""
+worker 进程内共用的常驻进程池（向量化、PDF 页范围提取）：首次使用时启动，之后各任务复用。
+子进程以 spawn 方式启动：worker 以多线程执行任务且已加载 torch，fork 出的子进程可能继承其他线程持有的锁而死锁
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_pools = []
+
+
+class SharedProcessPool:
+    """按需要的进程数扩容的共享进程池。使用方在 acquire 期间持有同一个进程池；扩容时换用更大的进程池，
+    旧进程池在最后一个使用方释放后才关闭，进行中的任务可以继续向其提交批次"""
+
+    def __init__(self, name, initializer=None, initargs=()):
+        self.name = name
+        self.initializer = initializer
+        self.initargs = initargs
+        self._lock = threading.Lock()
+        self._current = None  # (进程数, ProcessPoolExecutor)
+        self._users = {}  # ProcessPoolExecutor -> 使用方个数
+        _pools.append(self)
+
+    @contextmanager
+    def acquire(self, workers):
+        retired = None
+        with self._lock:
+            if self._current is None or self._current[0] < workers:
+                retired = self._retire()
+                executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=self.initializer,
+                    initargs=self.initargs,
+                )
+                self._current = (workers, executor)
+                self._users[executor] = 0
+                logger.info(f'[ProcessPool] 启动 {workers} 个{self.name}进程（spawn）')
+            executor = self._current[1]
+            self._users[executor] += 1
+        if retired is not None:
+            retired.shutdown(wait=False)
+        try:
+            yield executor
+        finally:
+            with self._lock:
+                self._users[executor] -= 1
+                retired = None
+                if not self._users[executor] and (self._current is None or self._current[1] is not executor):
+                    del self._users[executor]
+                    retired = executor
+            if retired is not None:
+                retired.shutdown(wait=False)
+
+    def _retire(self):
+        """换下当前进程池，没有使用方时返回它由调用方关闭；调用方持有 _lock"""
+        current, self._current = self._current, None
+        if current is None or self._users[current[1]]:
+            return None
+        del self._users[current[1]]
+        return current[1]
+
+    def discard(self, executor):
+        """子进程异常退出后进程池不可再用，下次使用时重新启动"""
+        with self._lock:
+            if self._current is not None and self._current[1] is executor:
+                self._current = None
+                if not self._users[executor]:
+                    del self._users[executor]
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._retire()
+        if executor is not None:
+            executor.shutdown()
+
+
+def shutdown_process_pools():
+    """worker 退出时关闭全部进程池"""
+    for pool in _pools:
+        pool.shutdown()
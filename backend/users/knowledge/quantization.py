@@ -0,0 +1,55 @@
+"""
+知识库向量的紧凑存储：float16 或按维度缩放的 int8 标量量化。检索时扫描紧凑副本（常驻内存的部分缩小 2–4 倍），
+原始 float32 矩阵仍保存在磁盘上，只用于对前若干候选精确重排与构建近似索引
+
+量化副本与其它数据文件一起按行追加，文件名为 <name>.f16 或 <name>.i8，描述保存在 manifest['quantized']：
+    {'dtype': 'int8', 'name': 'q_3', 'scales': [...每维缩放系数...], 'clipped': 超出缩放范围被截断的行数}
+"""
+import numpy as np
+
+STORAGE_TYPES = ('float32', 'float16', 'int8')
+_STORAGE_FILES = {
+    'float16': ('f16', np.float16),
+    'int8': ('i8', np.int8),
+}
+
+
+def quantized_filename(info):
+    return f"{info['name']}.{_STORAGE_FILES[info['dtype']][0]}"
+
+
+def quantized_dtype(info):
+    return _STORAGE_FILES[info['dtype']][1]
+
+
+def resolve_storage(vector_store_config):
+    storage = (vector_store_config or {}).get('storage') or 'float32'
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f'不支持的向量存储精度: {storage}')
+    return storage
+
+
+def compute_scales(blocks):
+    """int8 对称量化的每维缩放系数：各维绝对值最大值 / 127"""
+    peak = None
+    for block in blocks:
+        block_peak = np.abs(block).max(axis=0)
+        peak = block_peak if peak is None else np.maximum(peak, block_peak)
+    return np.maximum(peak, 1e-12) / 127
+
+
+def quantize(vectors, info):
+    """把 float32 向量转成紧凑形式，返回 (数组, 被截断的行数)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if info['dtype'] == 'float16':
+        return vectors.astype(np.float16), 0
+    scaled = np.rint(vectors / np.asarray(info['scales'], dtype=np.float32))
+    clipped = int((np.abs(scaled) > 127).any(axis=1).sum())
+    return np.clip(scaled, -127, 127).astype(np.int8), clipped
+
+
+def compact_dot(block, query, info):
+    """紧凑矩阵与查询向量的内积；int8 把缩放系数乘到查询上，不还原整个矩阵"""
+    if info['dtype'] == 'int8':
+        query = query * np.asarray(info['scales'], dtype=np.float32)
+    return block.astype(np.float32) @ query
@@ -0,0 +1,86 @@
+"""
+知识库向量降维：embedding_config.dimension 小于模型输出维度时，索引按降维后的向量存储与扫描，内存占用与扫描耗时随维度按比例下降。
+支持截断前缀维度的模型（Matryoshka）直接截断；其他模型按知识库拟合 PCA，投影矩阵随索引数据代保存在 projection.f32
+（第一行为均值，其余各行为主成分）。两种方式降维后都重新归一化，查询向量做同样的变换
+
+描述保存在 manifest['projection']，None 表示按模型原始维度存储：
+    {'method': 'truncate' | 'pca', 'input_dim': 模型输出维度, 'dim': 降维后维度, 'fitted_rows': 拟合行数, 'explained_variance': 保留方差比例}
+PCA 需要足够多的行才能拟合，索引行数达到 PCA_MIN_ROWS 之前按模型原始维度存储，达到后投影已有行并写入新一代
+"""
+import os
+
+import numpy as np
+
+from ..rules import KNOWLEDGE_REDUCTION_CONFIG
+
+REDUCTION_METHODS = ('auto', 'truncate', 'pca')
+PROJECTION_FILE = 'projection.f32'
+
+
+def resolve_reduction(embedding_config, model=None):
+    """从 embedding_config.dimension / reduction 得到 {'method', 'dim'}，未设置 dimension 时返回 None；
+    reduction 为 auto（默认）时，Matryoshka 模型截断，其他模型使用 PCA"""
+    embedding_config = embedding_config or {}
+    dimension = embedding_config.get('dimension')
+    if dimension in (None, ''):
+        return None
+    try:
+        dimension = int(dimension)
+    except (TypeError, ValueError):
+        raise ValueError(f'非法的向量维度: {dimension}')
+    if dimension < KNOWLEDGE_REDUCTION_CONFIG['MIN_DIMENSION']:
+        raise ValueError(f'向量维度不能小于 {KNOWLEDGE_REDUCTION_CONFIG["MIN_DIMENSION"]}')
+    method = embedding_config.get('reduction') or 'auto'
+    if method not in REDUCTION_METHODS:
+        raise ValueError(f'不支持的降维方式: {method}，可用: {list(REDUCTION_METHODS)}')
+    if method == 'auto':
+        model = model or embedding_config.get('model')
+        method = 'truncate' if model in KNOWLEDGE_REDUCTION_CONFIG['MATRYOSHKA_MODELS'] else 'pca'
+    return {'method': method, 'dim': dimension}
+
+
+def new_projection(reduction, input_dim):
+    """模型输出维度已知后的降维描述；目标维度不小于输出维度时不降维，返回 None"""
+    if reduction is None or reduction['dim'] >= input_dim:
+        return None
+    return {'method': reduction['method'], 'input_dim': int(input_dim), 'dim': reduction['dim']}
+
+
+def fit_pca(vectors, dim):
+    """按抽取的行拟合 PCA，返回 ((dim + 1) × input_dim 的投影矩阵, 保留方差比例)"""
+    vectors = np.asarray(vectors, dtype=np.float64)
+    mean = vectors.mean(axis=0)
+    centered = vectors - mean
+    covariance = centered.T @ centered / max(len(vectors) - 1, 1)
+    values, components = np.linalg.eigh(covariance)
+    order = np.argsort(values)[::-1][:dim]
+    explained = float(values[order].sum() / max(values.sum(), 1e-12))
+    return np.vstack([mean, components[:, order].T]).astype(np.float32), explained
+
+
+def project(vectors, projection, matrix=None):
+    """把模型输出的向量（n × input_dim 或单个向量）变换到索引空间；projection 为 None 时原样返回"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if projection is None:
+        return vectors
+    if projection['method'] == 'truncate':
+        reduced = vectors[..., :projection['dim']]
+    else:
+        reduced = (vectors - matrix[0]) @ matrix[1:].T
+    norms = np.linalg.norm(reduced, axis=-1, keepdims=True)
+    return (reduced / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def write_projection(directory, matrix):
+    with open(os.path.join(directory, PROJECTION_FILE), 'wb') as f:
+        f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_projection(directory, projection):
+    """读取数据代中的 PCA 投影矩阵；截断或不降维时返回 None"""
+    if not projection or projection['method'] != 'pca':
+        return None
+    matrix = np.fromfile(os.path.join(directory, PROJECTION_FILE), dtype=np.float32)
+    return matrix.reshape(projection['dim'] + 1, projection['input_dim'])
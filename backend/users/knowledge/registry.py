@@ -0,0 +1,109 @@
+"""
+知识库插件注册表：文件格式提取器与向量化后端按名称注册为 'module:attr'，首次使用时才导入对应的重量级依赖
+"""
+import importlib
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 模块名 -> 首次导入耗时（秒），用于排查冷启动耗时
+IMPORT_TIMINGS = {}
+_import_lock = threading.Lock()
+
+
+def lazy_import(module_name):
+    """导入模块并记录首次导入耗时；已导入的模块直接返回"""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    with _import_lock:
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        elapsed = time.perf_counter() - start
+        if module_name not in IMPORT_TIMINGS:
+            IMPORT_TIMINGS[module_name] = elapsed
+            logger.info(f'[KnowledgeRegistry] 首次导入 {module_name} 耗时 {elapsed:.2f}s')
+    return module
+
+
+class PluginRegistry:
+    """名称 -> 'module:attr' 目标的注册表，取用时才导入目标模块"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._targets = {}
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def register(self, names, target, requires=()):
+        """requires 为该插件依赖的重量级模块，首次取用插件时一并导入"""
+        if isinstance(names, str):
+            names = [names]
+        with self._lock:
+            for name in names:
+                self._targets[name.lower()] = (target, tuple(requires))
+                self._loaded.pop(name.lower(), None)
+
+    def names(self):
+        return sorted(self._targets)
+
+    def __contains__(self, name):
+        return name.lower() in self._targets
+
+    def get(self, name):
+        name = name.lower()
+        plugin = self._loaded.get(name)
+        if plugin is not None:
+            return plugin
+        if name not in self._targets:
+            raise KeyError(name)
+        target, requires = self._targets[name]
+        for module_name in requires:
+            lazy_import(module_name)
+        module_name, attr = target.split(':')
+        plugin = getattr(lazy_import(module_name), attr)
+        with self._lock:
+            self._loaded[name] = plugin
+        return plugin
+
+    def load_all(self):
+        """导入全部已注册插件（预热或测量导入耗时用），返回 {名称: 错误信息或 None}"""
+        errors = {}
+        for name in self.names():
+            try:
+                self.get(name)
+                errors[name] = None
+            except Exception as e:
+                errors[name] = str(e)
+        return errors
+
+
+def import_timings():
+    return dict(sorted(IMPORT_TIMINGS.items(), key=lambda item: -item[1]))
+
+
+# 文件扩展名 -> 产出 TextSegment 的提取函数 (file_path, encoding, workers)
+extractor_registry = PluginRegistry('extractor')
+# 向量化类型 -> 构造 embedder 的函数 (embedding_config, user)
+embedding_backend_registry = PluginRegistry('embedding')
+
+_EXTRACTORS = 'users.knowledge.extractors'
+extractor_registry.register(['.txt', '.vtt', '.properties'], f'{_EXTRACTORS}:iter_plain_segments')
+extractor_registry.register(['.md', '.markdown', '.mdx'], f'{_EXTRACTORS}:iter_markdown_segments', ['markdown'])
+extractor_registry.register('.docx', f'{_EXTRACTORS}:iter_docx_segments', ['docx'])
+extractor_registry.register('.pdf', f'{_EXTRACTORS}:iter_pdf_segments', ['pdfplumber'])
+extractor_registry.register('.csv', f'{_EXTRACTORS}:iter_csv_segments')
+extractor_registry.register('.xlsx', f'{_EXTRACTORS}:iter_xlsx_segments', ['openpyxl'])
+extractor_registry.register('.xls', f'{_EXTRACTORS}:iter_xls_segments', ['xlrd'])
+extractor_registry.register(['.pptx', '.ppt'], f'{_EXTRACTORS}:iter_pptx_segments', ['pptx'])
+extractor_registry.register(['.html', '.htm', '.xml'], f'{_EXTRACTORS}:iter_html_segments', ['bs4'])
+extractor_registry.register('.epub', f'{_EXTRACTORS}:iter_epub_segments', ['ebooklib', 'ebooklib.epub', 'bs4'])
+
+_EMBEDDING = 'users.knowledge.embedding'
+embedding_backend_registry.register(
+    'local', f'{_EMBEDDING}:build_local_embedder', ['langchain_community.embeddings', 'sentence_transformers'])
+embedding_backend_registry.register(
+    'openai', f'{_EMBEDDING}:build_openai_embedder', ['langchain_community.embeddings', 'openai'])
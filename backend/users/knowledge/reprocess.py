@@ -0,0 +1,50 @@
+"""
+知识库整体重新处理：比较新配置与各文件写入索引时的阶段指纹，只为需要重做的文件创建处理任务，
+任务从第一个受影响的阶段开始（提取 → 分段 → 向量化），由 worker 按知识库并发上限并行执行。
+只有检索配置变化时不需要任何处理；只有向量存储配置变化时直接按新配置重建近似索引与紧凑副本
+"""
+import logging
+
+from .jobs import enqueue_process_job
+from .pipeline import STAGES, resume_stage, stage_fingerprints
+from .vector_index import apply_vector_store_config, stored_file_stages
+
+logger = logging.getLogger(__name__)
+
+
+def plan_reprocess(kb, params):
+    """返回 {文件 id: 需要重新开始的阶段}，None 表示该文件各阶段结果都可以复用"""
+    stored = stored_file_stages(kb.id)
+    current = stage_fingerprints(params)
+    return {file_id: resume_stage(stored.get(str(file_id)), current)
+            for file_id in kb.files.order_by('id').values_list('id', flat=True)}
+
+
+def reprocess_knowledge_base(kb, params, user=None, dry_run=False):
+    """按新配置重新处理知识库的全部文件，返回各阶段的文件数与创建的任务；dry_run 时只返回计划"""
+    plan = plan_reprocess(kb, params)
+    stages = {stage: [file_id for file_id, resume in plan.items() if resume == stage] for stage in STAGES}
+    result = {
+        'files': len(plan),
+        'unchanged': [file_id for file_id, resume in plan.items() if resume is None],
+        'stages': stages,
+        'jobs': [],
+        'index_version': None,
+    }
+    if dry_run:
+        return result
+    vector_store_changed = (kb.embedding_config or {}).get('vector_store_config') != params.get('vector_store_config')
+    kb.embedding_config = params
+    kb.save(update_fields=['embedding_config'])
+    files = {kf.id: kf for kf in kb.files.filter(id__in=[file_id for file_id, resume in plan.items() if resume])}
+    for file_id in sorted(files):
+        job = enqueue_process_job(files[file_id], {**params, 'incremental': True}, user)
+        result['jobs'].append(job.id)
+    if vector_store_changed and not files:
+        # 有任务时由写入索引的任务按新配置更新
+        result['index_version'] = apply_vector_store_config(kb.id, params.get('vector_store_config'))
+    logger.info(
+        f'[KnowledgeReprocess] 知识库 {kb.id} 重新处理: {len(plan)} 个文件，'
+        + '，'.join(f'从{stage}开始 {len(ids)} 个' for stage, ids in stages.items())
+        + f'，无需处理 {len(result["unchanged"])} 个，创建任务 {len(result["jobs"])} 个')
+    return result
@@ -0,0 +1,134 @@
+"""
+知识库检索缓存（进程内，两级）：
+    查询向量：(向量化模型, 规范化查询文本) -> 查询向量
+    检索结果：(知识库 id, 索引版本, 查询哈希, 检索参数) -> 结果列表
+两级都有过期时间和条目数、字节数上限，按最近使用淘汰。索引每次提交都会递增版本，文件重新处理或删除后
+旧版本的结果不会再被命中；本进程内的写入还会立即清掉该知识库的结果缓存
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from ..rules import KNOWLEDGE_RETRIEVAL_CACHE_CONFIG
+
+
+def normalize_query(text):
+    """统一 Unicode 形式并折叠空白；缓存键与实际向量化的文本都使用规范化结果"""
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+
+def query_hash(text):
+    return hashlib.blake2b(normalize_query(text).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class TTLCache:
+    """线程安全的 LRU 缓存，条目超过 ttl 秒后失效，条目数或总字节数超限时淘汰最久未使用的条目"""
+
+    def __init__(self, ttl, max_entries, max_bytes):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # key -> (过期时间, 值, 字节数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+
+    def _remove(self, key):
+        _, _, size = self._items.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, predicate):
+        """删除键满足 predicate 的条目，返回删除数"""
+        with self._lock:
+            keys = [key for key in self._items if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._items),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_config = KNOWLEDGE_RETRIEVAL_CACHE_CONFIG
+query_vector_cache = TTLCache(
+    _config['QUERY_VECTOR_TTL'], _config['QUERY_VECTOR_MAX_ENTRIES'], _config['QUERY_VECTOR_MAX_MB'] * 1024 * 1024)
+result_cache = TTLCache(_config['RESULT_TTL'], _config['RESULT_MAX_ENTRIES'], _config['RESULT_MAX_MB'] * 1024 * 1024)
+
+
+def get_query_vector(model_key, query):
+    if not _config['ENABLED']:
+        return None
+    return query_vector_cache.get((model_key, query_hash(query)))
+
+
+def put_query_vector(model_key, query, vector):
+    if _config['ENABLED']:
+        query_vector_cache.put((model_key, query_hash(query)), vector, vector.nbytes)
+
+
+def result_key(kb_id, index_version, query, params):
+    """params 为影响结果的全部检索参数（策略、top_k、阈值、度量、近似检索参数等）"""
+    return kb_id, index_version, query_hash(query), json.dumps(params, sort_keys=True, default=str)
+
+
+def get_results(key):
+    if not _config['ENABLED']:
+        return None
+    results = result_cache.get(key)
+    # 返回副本，调用方修改结果不影响缓存
+    return copy.deepcopy(results) if results is not None else None
+
+
+def put_results(key, results):
+    if _config['ENABLED']:
+        size = len(json.dumps(results, ensure_ascii=False, default=str).encode('utf-8'))
+        result_cache.put(key, copy.deepcopy(results), size)
+
+
+def invalidate_kb_results(kb_id):
+    """知识库索引更新后清掉该知识库的结果缓存（其他进程依靠索引版本失效）"""
+    return result_cache.invalidate(lambda key: key[0] == kb_id)
+
+
+def retrieval_cache_stats():
+    return {'query_vectors': query_vector_cache.stats(), 'results': result_cache.stats()}
@@ -0,0 +1,271 @@
+"""
+知识库检索：把查询向量化后在知识库索引中检索，按 retrieval_config 的策略与数量返回分段
+"""
+import logging
+import time
+
+import numpy as np
+
+from ..rules import KNOWLEDGE_SEARCH_CONFIG
+from .embedding import build_embedder, embedding_info
+from .embedding_cache import embedding_cache_key
+from .retrieval_cache import get_query_vector, put_query_vector, result_key, get_results, put_results, normalize_query
+from .ann_index import AnnConfigError, resolve_ann_config, resolve_search_params
+from .metadata_filter import FilterError, parse_filters, filter_files
+from .text_artifact import TextArtifact
+from .vector_index import get_index, METRICS
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_STRATEGIES = ('similarity', 'mmr', 'hybrid')
+
+
+class KnowledgeSearchError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def mmr_select(query, vectors, k, lambda_mult):
+    """最大边际相关：在候选中依次选出与查询相关且彼此差异大的 k 个，返回候选下标"""
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    while len(selected) < min(k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+def _min_max(scores):
+    if not len(scores):
+        return scores
+    low, high = float(scores.min()), float(scores.max())
+    if high - low < 1e-12:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+def hybrid_search(index, query, query_vector, top_k, metric, keyword_weight, ann_params, mask=None):
+    """混合检索：向量近邻与 BM25 关键词结果取并集，只对候选行计算两种得分，归一化后加权融合。
+    返回 (rows, scores, vector_scores, keyword_scores)"""
+    fetch = top_k * KNOWLEDGE_SEARCH_CONFIG['HYBRID_FETCH_FACTOR']
+    vector_rows, _ = index.search(query_vector, fetch, metric, mask=mask, **ann_params)
+    # 全部命中行的 BM25 得分（只读查询词项的倒排表），向量候选也能拿到准确的关键词得分
+    hit_rows, hit_scores = index.keyword_search(query, None, mask)
+    keyword_rows = hit_rows[np.argsort(-hit_scores, kind='stable')[:fetch]]
+    rows = np.union1d(vector_rows, keyword_rows).astype(np.int64)
+    vector_scores = index.score_rows(query_vector, rows, metric)
+    keyword_scores = np.zeros(len(rows), dtype=np.float32)
+    positions = np.searchsorted(hit_rows, rows)
+    found = positions < len(hit_rows)
+    found[found] = hit_rows[positions[found]] == rows[found]
+    keyword_scores[found] = hit_scores[positions[found]]
+    fused = (1 - keyword_weight) * _min_max(vector_scores) + keyword_weight * _min_max(keyword_scores)
+    top = np.argsort(-fused, kind='stable')[:top_k]
+    return rows[top], fused[top], vector_scores[top], keyword_scores[top]
+
+
+def resolve_retrieval_params(kb, top_k=None, strategy=None, similarity_threshold=None):
+    config = kb.embedding_config or {}
+    retrieval_config = config.get('retrieval_config') or {}
+    strategy = strategy or retrieval_config.get('strategy') or 'similarity'
+    if strategy not in RETRIEVAL_STRATEGIES:
+        raise KnowledgeSearchError(f'不支持的检索策略: {strategy}')
+    try:
+        top_k = int(top_k or retrieval_config.get('top_k') or KNOWLEDGE_SEARCH_CONFIG['DEFAULT_TOP_K'])
+        if similarity_threshold is None:
+            similarity_threshold = retrieval_config.get('similarity_threshold')
+        similarity_threshold = None if similarity_threshold in (None, '') else float(similarity_threshold)
+    except (TypeError, ValueError):
+        raise KnowledgeSearchError('top_k 和 similarity_threshold 必须为数字')
+    if top_k <= 0:
+        raise KnowledgeSearchError('top_k 必须大于0')
+    top_k = min(top_k, KNOWLEDGE_SEARCH_CONFIG['MAX_TOP_K'])
+    metric = (config.get('vector_store_config') or {}).get('similarity_metric') or 'cosine'
+    if metric not in METRICS:
+        raise KnowledgeSearchError(f'不支持的相似度计算方式: {metric}')
+    return strategy, top_k, similarity_threshold, metric
+
+
+def resolve_ann_params(kb):
+    """查询时的近似检索与重排参数；知识库配置为精确检索时即使已有近似索引也逐行扫描"""
+    vector_store_config = (kb.embedding_config or {}).get('vector_store_config') or {}
+    rescore = vector_store_config.get('rescore', True) not in (False, 'false', 0)
+    try:
+        if resolve_ann_config(vector_store_config) is None:
+            return {'use_ann': False, 'rescore': rescore}
+        return dict(resolve_search_params(vector_store_config), rescore=rescore)
+    except AnnConfigError as e:
+        raise KnowledgeSearchError(str(e))
+
+
+def uses_parent_document(kb):
+    splitter_config = (kb.embedding_config or {}).get('splitter_config') or {}
+    return bool(splitter_config.get('use_parent_document'))
+
+
+def collapse_to_parents(index, results, top_k):
+    """父子分段：同一父块的子块只保留得分最高的一个，content 换成父块文本（按偏移从提取文本产物读取，
+    只解压覆盖该范围的块），命中的子块文本放在 child_content"""
+    collapsed, seen, artifacts = [], set(), {}
+    text_artifacts = index.manifest.get('text_artifacts', {})
+    for result in results:
+        span = result['metadata'].get('parent')
+        if span is not None:
+            parent = (result['file_id'], tuple(span))
+            if parent in seen:
+                continue
+            seen.add(parent)
+            key = text_artifacts.get(str(result['file_id']))
+            if key not in artifacts:
+                artifacts[key] = TextArtifact.open(key) if key else None
+            if artifacts[key] is not None:
+                result['child_content'] = result['content']
+                result['content'] = artifacts[key].read(*span)
+        collapsed.append(result)
+        if len(collapsed) >= top_k:
+            break
+    return collapsed
+
+
+def resolve_keyword_weight(kb):
+    retrieval_config = (kb.embedding_config or {}).get('retrieval_config') or {}
+    weight = retrieval_config.get('keyword_weight')
+    try:
+        weight = KNOWLEDGE_SEARCH_CONFIG['HYBRID_KEYWORD_WEIGHT'] if weight in (None, '') else float(weight)
+    except (TypeError, ValueError):
+        raise KnowledgeSearchError('keyword_weight 必须为数字')
+    if not 0 <= weight <= 1:
+        raise KnowledgeSearchError('keyword_weight 必须在0到1之间')
+    return weight
+
+
+def embed_query(kb, index, query, user=None):
+    """返回 (查询向量, 是否命中查询向量缓存)"""
+    embedding_config = dict((kb.embedding_config or {}).get('embedding_config') or {})
+    # 以索引记录的模型为准，保证查询与分段向量处于同一空间
+    embedding_config.update(index.embedding or {})
+    info = embedding_info(embedding_config)
+    model_key = embedding_cache_key(info['type'], info['model'], info['normalize'])
+    vector = get_query_vector(model_key, query)
+    # 缓存的是模型输出的向量，按索引的降维设置变换；同一模型重建为不同维度后，旧维度的缓存向量不再可用
+    if vector is not None and len(vector) == index.input_dim:
+        return index.project(vector), True
+    try:
+        embedder, _, _ = build_embedder(embedding_config, user)
+    except ValueError as e:
+        raise KnowledgeSearchError(str(e))
+    vector = np.asarray(embedder.embed_query(query), dtype=np.float32)
+    put_query_vector(model_key, query, vector)
+    return index.project(vector), False
+
+
+def search_knowledge_base(kb, query, user=None, top_k=None, strategy=None, similarity_threshold=None, filters=None):
+    """在知识库中检索与 query 最相关的分段；filters 为元数据过滤条件，见 metadata_filter.parse_filters"""
+    query = normalize_query(query or '')
+    if not query:
+        raise KnowledgeSearchError('查询内容不能为空')
+    strategy, top_k, similarity_threshold, metric = resolve_retrieval_params(kb, top_k, strategy, similarity_threshold)
+    try:
+        filters = parse_filters(filters)
+    except FilterError as e:
+        raise KnowledgeSearchError(str(e))
+    ann_params = resolve_ann_params(kb)
+    keyword_weight = resolve_keyword_weight(kb) if strategy == 'hybrid' else None
+    parent_document = uses_parent_document(kb)
+    # 父子分段时多取子块，合并到父块后仍有 top_k 个结果
+    fetch_k = top_k * KNOWLEDGE_SEARCH_CONFIG['PARENT_FETCH_FACTOR'] if parent_document else top_k
+    start = time.monotonic()
+    # 只读取已发布的数据代；旧版目录导入与已删除文件的整理由 worker 执行（index_sync）
+    index = get_index(kb.id)
+    response = {
+        'query': query,
+        'strategy': strategy,
+        'top_k': top_k,
+        'similarity_threshold': similarity_threshold,
+        'metric': metric,
+        'index_version': index.version if index else 0,
+        'index_generation': index.generation if index else 0,
+        'index_type': 'flat' if index is None or not ann_params.get('use_ann', True) else index.index_type,
+        'storage': index.storage if index else 'float32',
+        'parent_document': parent_document,
+        'cache': None,
+        'results': [],
+    }
+    if keyword_weight is not None:
+        response['keyword_weight'] = keyword_weight
+    mask = None
+    if filters and index is not None:
+        mask = index.filter_mask(filters, filter_files(kb.files.all(), filters))
+        response['filters'] = filters
+        response['filtered_rows'] = int(np.count_nonzero(mask & index.live_mask()))
+    if index is None or index.live_count() == 0 or response.get('filtered_rows') == 0:
+        response['took_ms'] = round((time.monotonic() - start) * 1000, 1)
+        return response
+
+    cache_key = result_key(kb.id, index.version, query, {
+        'strategy': strategy,
+        'top_k': top_k,
+        'similarity_threshold': similarity_threshold,
+        'metric': metric,
+        'ann': ann_params,
+        'keyword_weight': keyword_weight,
+        'filters': filters,
+        'parent_document': parent_document,
+    })
+    results = get_results(cache_key)
+    if results is not None:
+        response.update(cache='result', results=results)
+        response['took_ms'] = round((time.monotonic() - start) * 1000, 1)
+        return response
+
+    embed_start = time.monotonic()
+    query_vector, vector_cached = embed_query(kb, index, query, user)
+    if vector_cached:
+        response['cache'] = 'query_vector'
+    search_start = time.monotonic()
+    extra = {}
+    if strategy == 'hybrid':
+        rows, scores, vector_scores, keyword_scores = hybrid_search(
+            index, query, query_vector, fetch_k, metric, keyword_weight, ann_params, mask)
+        extra = {'vector_score': vector_scores, 'keyword_score': keyword_scores}
+    elif strategy == 'mmr':
+        rows, scores = index.search(
+            query_vector, fetch_k * KNOWLEDGE_SEARCH_CONFIG['MMR_FETCH_FACTOR'], metric, mask=mask, **ann_params)
+        if len(rows):
+            picked = mmr_select(query_vector, np.asarray(index.vectors[rows]), fetch_k, KNOWLEDGE_SEARCH_CONFIG['MMR_LAMBDA'])
+            rows, scores = rows[picked], scores[picked]
+    else:
+        rows, scores = index.search(query_vector, fetch_k, metric, mask=mask, **ann_params)
+    # 混合检索的融合分数是相对值，不适用相似度阈值
+    if similarity_threshold is not None and metric != 'euclidean' and strategy != 'hybrid':
+        keep = scores >= similarity_threshold
+        rows, scores = rows[keep], scores[keep]
+    search_end = time.monotonic()
+
+    file_ids = index.file_ids
+    for i, (row, score, chunk) in enumerate(zip(rows, scores, index.chunks(rows))):
+        result = {
+            'score': round(float(score), 6),
+            'file_id': int(file_ids[row]),
+            'content': chunk['content'],
+            'metadata': chunk['metadata'],
+        }
+        for key, values in extra.items():
+            result[key] = round(float(values[i]), 6)
+        response['results'].append(result)
+    if parent_document:
+        response['results'] = collapse_to_parents(index, response['results'], top_k)
+    put_results(cache_key, response['results'])
+    response['embed_ms'] = round((search_start - embed_start) * 1000, 1)
+    response['search_ms'] = round((search_end - search_start) * 1000, 1)
+    response['took_ms'] = round((time.monotonic() - start) * 1000, 1)
+    return response
@@ -0,0 +1,398 @@
+"""
+知识库快照：把知识库的配置、文件记录、分段与向量导出为一个 zip 归档，用于迁移到其他节点或在磁盘故障后恢复。
+归档与 npz 兼容（列数据为 .npy 成员，可直接用 numpy.load 读取），导出边读边输出、不落临时文件；
+导入按块批量写入新知识库的索引，不调用向量化模型
+
+归档成员：
+    snapshot.json            格式版本、知识库名称/类型/描述/embedding_config、索引的向量化模型/降维/去重参数、各文件记录
+    vectors.npy              行 × 维度，索引空间中的向量（降维时为降维后的向量），不压缩
+    file_ids.npy             每行所属的文件（导出时的文件 id）
+    canonical.npy            近似重复行的规范行（导出后的行号），-1 表示规范行
+    lsh.npy                  行 × 带数的 LSH 带哈希
+    chunks.jsonl             每行一个 {"content", "metadata"}
+    projection.npy           PCA 降维时的投影矩阵
+    text/<key>.blocks|.json  提取文本产物（父子分段检索读取父块、预览与重新处理复用）
+    files/<id>/<文件名>       上传的原始文件（可选）
+只导出数据库中仍存在的文件的存活行；近似索引与 int8 紧凑副本不导出，导入时按 embedding_config 重建。
+归档来自外部，导入时文本产物只接受 40 位十六进制的键，原始文件只从归档成员写出，不沿用记录中的路径
+"""
+import io
+import json
+import logging
+import os
+import re
+import time
+import zipfile
+
+import numpy as np
+from django.core.files import File
+from django.utils.dateparse import parse_datetime
+
+from ..models import KnowledgeBase, KnowledgeFile
+from ..rules import KNOWLEDGE_SNAPSHOT_CONFIG
+from .text_artifact import TextArtifact, restore_text_artifact
+from .vector_index import drop_index, export_layout, get_index, import_index
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_FILE = 'snapshot.json'
+COLUMNS = ('vectors', 'file_ids', 'canonical', 'lsh')
+COPY_BYTES = 1024 * 1024
+ARTIFACT_KEY = re.compile(r'[0-9a-f]{40}')
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class _StreamBuffer:
+    """zipfile 的输出目标：不可 seek（zipfile 改用数据描述符），已写出的字节由生成器取走"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _stored(name):
+    """不压缩的成员：向量与哈希近似随机，deflate 几乎没有收益"""
+    info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return info
+
+
+def _read_npy_header(f):
+    """读取 .npy 头，返回 (行数, 行形状, dtype)"""
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        raise SnapshotError(f'不支持的 npy 版本: {version}')
+    if fortran_order or not shape:
+        raise SnapshotError('快照中的列数据必须为按行存储的数组')
+    return shape[0], tuple(shape[1:]), dtype
+
+
+class _ColumnReader:
+    """按块顺序读取快照中的 .npy 成员，不把整列读入内存"""
+
+    def __init__(self, zf, name):
+        try:
+            self._file = zf.open(name)
+        except KeyError:
+            raise SnapshotError(f'快照缺少 {name}')
+        self.rows, self.shape, self.dtype = _read_npy_header(self._file)
+        self._row_bytes = self.dtype.itemsize * int(np.prod(self.shape, dtype=np.int64))
+
+    def read(self, count):
+        data = self._file.read(count * self._row_bytes)
+        if len(data) != count * self._row_bytes:
+            raise SnapshotError('快照数据不完整')
+        return np.frombuffer(data, dtype=self.dtype).reshape((count,) + self.shape)
+
+    def close(self):
+        self._file.close()
+
+
+def _file_member(kf):
+    return f'files/{kf.id}/{os.path.basename(kf.file.name)}'
+
+
+def _snapshot_info(kb, files, index, layout, rows, include_files):
+    ranges = {int(file_id): [start, end] for file_id, start, end in layout}
+    manifest = index.manifest if index else {}
+    included = {kf.id: bool(include_files and kf.file and os.path.exists(kf.file.path)) for kf in files}
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'exported': time.time(),
+        'kb': {'name': kb.name, 'type': kb.type, 'description': kb.description, 'embedding_config': kb.embedding_config},
+        'index': {
+            'rows': rows,
+            'dim': index.dim,
+            'embedding': index.embedding,
+            'projection': index.projection,
+            'dedup': manifest['dedup'],
+        } if rows else None,
+        'files': [{
+            'id': kf.id,
+            'filename': kf.filename,
+            'file': kf.file.name,
+            'member': _file_member(kf) if included[kf.id] else None,
+            'created': kf.created.isoformat(),
+            'char_count': kf.char_count,
+            'content_hash': kf.content_hash,
+            'text_artifact': kf.text_artifact,
+            'rows': ranges.get(kf.id),
+            'stages': manifest.get('stages', {}).get(str(kf.id)),
+            'index_artifact': manifest.get('text_artifacts', {}).get(str(kf.id)),
+        } for kf in files],
+    }
+
+
+def _row_blocks(layout):
+    block_rows = KNOWLEDGE_SNAPSHOT_CONFIG['BLOCK_ROWS']
+    for _, start, end in layout:
+        for block_start in range(start, end, block_rows):
+            yield block_start, min(block_start + block_rows, end)
+
+
+def iter_snapshot(kb, include_files=None):
+    """逐块生成知识库快照归档的字节，用于写入文件或流式下载；导出期间持有索引当前代的只读视图，该代不会被回收"""
+    include_files = KNOWLEDGE_SNAPSHOT_CONFIG['INCLUDE_FILES'] if include_files is None else include_files
+    files = list(kb.files.order_by('id'))
+    index = get_index(kb.id)
+    layout, canonical = export_layout(index, [kf.id for kf in files]) if index else ([], np.empty(0, dtype=np.int64))
+    rows = len(canonical)
+    info = _snapshot_info(kb, files, index, layout, rows, include_files)
+    stream = _StreamBuffer()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED,
+                         compresslevel=KNOWLEDGE_SNAPSHOT_CONFIG['COMPRESS_LEVEL']) as zf:
+        zf.writestr(SNAPSHOT_FILE, json.dumps(info, ensure_ascii=False))
+        yield stream.drain()
+        if rows:
+            for name in COLUMNS:
+                column = getattr(index, name)
+                with zf.open(_stored(f'{name}.npy'), 'w', force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(f, {
+                        'descr': np.lib.format.dtype_to_descr(column.dtype),
+                        'fortran_order': False,
+                        'shape': (rows,) + tuple(column.shape[1:]),
+                    })
+                    if name == 'canonical':
+                        # 规范行已按导出后的行号重排
+                        column = canonical
+                        blocks = ((start, min(start + KNOWLEDGE_SNAPSHOT_CONFIG['BLOCK_ROWS'], rows))
+                                  for start in range(0, rows, KNOWLEDGE_SNAPSHOT_CONFIG['BLOCK_ROWS']))
+                    else:
+                        blocks = _row_blocks(layout)
+                    for start, end in blocks:
+                        f.write(np.ascontiguousarray(column[start:end]).tobytes())
+                        yield stream.drain()
+            with zf.open('chunks.jsonl', 'w', force_zip64=True) as f:
+                for start, end in _row_blocks(layout):
+                    f.write(index.chunk_lines(start, end))
+                    yield stream.drain()
+            if index.projection_matrix is not None:
+                with zf.open('projection.npy', 'w') as f:
+                    np.lib.format.write_array(f, np.asarray(index.projection_matrix))
+        artifacts = set()
+        for record in info['files']:
+            artifacts.update(key for key in (record['text_artifact'], record['index_artifact']) if key)
+        for key in sorted(artifacts):
+            artifact = TextArtifact.open(key)
+            if artifact is None:
+                logger.warning(f'[KnowledgeSnapshot] 提取文本产物 {key} 不存在，跳过')
+                continue
+            zf.write(artifact.data_path, f'text/{key}.blocks', compress_type=zipfile.ZIP_STORED)
+            zf.write(artifact.meta_path, f'text/{key}.json')
+            yield stream.drain()
+        for kf, record in zip(files, info['files']):
+            if not record['member']:
+                continue
+            with open(kf.file.path, 'rb') as source, zf.open(record['member'], 'w', force_zip64=True) as f:
+                while True:
+                    data = source.read(COPY_BYTES)
+                    if not data:
+                        break
+                    f.write(data)
+                    yield stream.drain()
+    yield stream.drain()
+
+
+def export_knowledge_base(kb, path, include_files=None):
+    """把知识库快照写入 path（先写临时文件再替换），返回行数、文件数、字节数与耗时"""
+    start = time.monotonic()
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    try:
+        with open(tmp_path, 'wb') as f:
+            for data in iter_snapshot(kb, include_files):
+                f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with zipfile.ZipFile(path) as zf:
+        info = _read_info(zf)
+    result = {
+        'kb_id': kb.id,
+        'files': len(info['files']),
+        'rows': info['index']['rows'] if info['index'] else 0,
+        'bytes': os.path.getsize(path),
+        'seconds': round(time.monotonic() - start, 3),
+    }
+    logger.info(f'[KnowledgeSnapshot] 导出知识库 {kb.id}: {result["rows"]} 行，'
+                f'{result["bytes"] / 1024 / 1024:.1f}MB，耗时 {result["seconds"]}s')
+    return result
+
+
+def _read_info(zf):
+    try:
+        info = json.loads(zf.read(SNAPSHOT_FILE))
+    except KeyError:
+        raise SnapshotError(f'不是知识库快照: 缺少 {SNAPSHOT_FILE}')
+    except ValueError:
+        raise SnapshotError(f'{SNAPSHOT_FILE} 不是合法的 JSON')
+    if info.get('format') != SNAPSHOT_FORMAT:
+        raise SnapshotError(f'不支持的快照格式: {info.get("format")}，当前支持: {SNAPSHOT_FORMAT}')
+    return info
+
+
+def _artifact_key(key):
+    if key and not ARTIFACT_KEY.fullmatch(key):
+        raise SnapshotError(f'快照中有非法的文本产物键: {key!r}')
+    return key
+
+
+def _restore_files(zf, kb, records, saved):
+    """创建知识文件记录，返回 {导出时的文件 id: 新文件 id}；快照不含原始文件时文件字段留空（只能复用文本产物），
+    从快照写出的原始文件记入 saved，导入失败时删除"""
+    id_map = {}
+    members = set(zf.namelist())
+    for record in records:
+        _artifact_key(record['index_artifact'])
+        kf = KnowledgeFile(kb=kb, filename=record['filename'], char_count=record['char_count'],
+                           content_hash=record['content_hash'], text_artifact=_artifact_key(record['text_artifact']))
+        if record['member']:
+            member = record['member']
+            name = os.path.basename(member)
+            if not member.startswith('files/') or name in ('', '.', '..') or member not in members:
+                raise SnapshotError(f'快照中缺少原始文件成员: {member!r}')
+            with zf.open(member) as source:
+                kf.file.save(name, File(source, name=name), save=False)
+            saved.append(kf.file.name)
+        kf.save()
+        created = parse_datetime(record['created'] or '')
+        if created:
+            KnowledgeFile.objects.filter(id=kf.id).update(created=created)
+        id_map[record['id']] = kf.id
+    return id_map
+
+
+def _restore_artifacts(zf):
+    restored = 0
+    members = set(zf.namelist())
+    for name in sorted(members):
+        if not name.startswith('text/'):
+            continue
+        key, ext = os.path.splitext(name[len('text/'):])
+        if ext not in ('.blocks', '.json') or not ARTIFACT_KEY.fullmatch(key):
+            raise SnapshotError(f'快照中有非法的文本产物成员: {name!r}')
+        if ext == '.blocks':
+            continue
+        if f'text/{key}.blocks' not in members:
+            raise SnapshotError(f'快照数据不完整: 缺少 text/{key}.blocks')
+        with zf.open(f'text/{key}.blocks') as data_file, zf.open(name) as meta_file:
+            restored += restore_text_artifact(key, data_file, meta_file)
+    return restored
+
+
+def _index_blocks(zf, rows, id_map):
+    """按块读取列数据与分段，文件 id 换成新 id"""
+    readers = {name: _ColumnReader(zf, f'{name}.npy') for name in COLUMNS}
+    try:
+        for name, reader in readers.items():
+            if reader.rows != rows:
+                raise SnapshotError(f'{name}.npy 的行数 {reader.rows} 与快照记录的 {rows} 不一致')
+        old_ids = np.array(sorted(id_map), dtype=np.int64)
+        new_ids = np.array([id_map[file_id] for file_id in old_ids.tolist()], dtype=np.int64)
+        block_rows = KNOWLEDGE_SNAPSHOT_CONFIG['BLOCK_ROWS']
+        with zf.open('chunks.jsonl') as chunks_file:
+            for start in range(0, rows, block_rows):
+                count = min(block_rows, rows - start)
+                file_ids = readers['file_ids'].read(count).astype(np.int64)
+                positions = np.minimum(np.searchsorted(old_ids, file_ids), len(old_ids) - 1)
+                if len(old_ids) == 0 or np.any(old_ids[positions] != file_ids):
+                    raise SnapshotError('快照中有行不属于任何导出的文件')
+                file_ids = new_ids[positions]
+                contents, metadatas = [], []
+                for file_id in file_ids.tolist():
+                    line = chunks_file.readline()
+                    if not line:
+                        raise SnapshotError('chunks.jsonl 的行数与向量不一致')
+                    row = json.loads(line)
+                    metadata = row['metadata']
+                    if 'file_id' in metadata:
+                        metadata['file_id'] = file_id
+                    contents.append(row['content'])
+                    metadatas.append(metadata)
+                canonical = readers['canonical'].read(count)
+                if np.any((canonical < -1) | (canonical >= rows)):
+                    raise SnapshotError('canonical.npy 中有越界的行号')
+                yield (file_ids, contents, metadatas, readers['vectors'].read(count),
+                       canonical, readers['lsh'].read(count))
+    finally:
+        for reader in readers.values():
+            reader.close()
+
+
+def _restore_index(zf, kb, info, id_map):
+    index_info = info['index']
+    if not index_info:
+        return None, 0
+    records = [record for record in info['files'] if record['rows']]
+    matrix = None
+    if 'projection.npy' in zf.namelist():
+        with zf.open('projection.npy') as f:
+            matrix = np.load(io.BytesIO(f.read()))
+    vector_store_config = (kb.embedding_config or {}).get('vector_store_config')
+    version = import_index(kb.id, {
+        'embedding': index_info['embedding'],
+        'projection': index_info['projection'],
+        'dedup': index_info['dedup'],
+        'stages': {str(id_map[r['id']]): r['stages'] for r in records if r['stages']},
+        'text_artifacts': {str(id_map[r['id']]): r['index_artifact'] for r in records if r['index_artifact']},
+    }, _index_blocks(zf, index_info['rows'], id_map), vector_store_config, matrix)
+    return version, index_info['rows']
+
+
+def import_knowledge_base(source, name=None):
+    """从快照归档（路径或可 seek 的文件对象）创建新知识库，name 为空时沿用快照中的名称；
+    返回 (知识库, 统计)。失败时删除已创建的知识库与索引"""
+    start = time.monotonic()
+    try:
+        zf = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        raise SnapshotError('快照文件不是合法的 zip 归档')
+    with zf:
+        info = _read_info(zf)
+        name = name or info['kb']['name']
+        if KnowledgeBase.objects.filter(name=name).exists():
+            raise SnapshotError(f'知识库名称已存在: {name}')
+        kb = KnowledgeBase.objects.create(name=name, type=info['kb']['type'], description=info['kb']['description'],
+                                          embedding_config=info['kb']['embedding_config'])
+        kb_id, saved = kb.id, []
+        try:
+            id_map = _restore_files(zf, kb, info['files'], saved)
+            artifacts = _restore_artifacts(zf)
+            version, rows = _restore_index(zf, kb, info, id_map)
+        except BaseException:
+            kb.delete()
+            drop_index(kb_id)
+            storage = KnowledgeFile._meta.get_field('file').storage
+            for file_name in saved:
+                storage.delete(file_name)
+            raise
+    result = {
+        'kb_id': kb.id,
+        'files': len(id_map),
+        'rows': rows,
+        'text_artifacts': artifacts,
+        'index_version': version,
+        'seconds': round(time.monotonic() - start, 3),
+    }
+    logger.info(f'[KnowledgeSnapshot] 导入知识库 {kb.id}（{name}）: {len(id_map)} 个文件，{rows} 行，'
+                f'耗时 {result["seconds"]}s')
+    return kb, result
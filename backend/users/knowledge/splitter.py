@@ -0,0 +1,109 @@
+"""
+知识库文本分段：按前端 splitter_config 构造分割器
+"""
+from ..rules import KNOWLEDGE_PROCESS_CONFIG
+from .registry import lazy_import
+
+SPLITTER_TYPES = ('recursive', 'character', 'token')
+DEFAULT_SEPARATORS = ['\n\n', '\n', '。', '！', '？', '.', '!', '?']
+
+
+def build_text_splitter(splitter_config):
+    """根据 splitter_config（text_splitter/chunk_size/chunk_overlap/separators）构造分割器"""
+    splitter_config = splitter_config or {}
+    split_method = splitter_config.get('text_splitter') or 'recursive'
+    chunk_size = int(splitter_config.get('chunk_size') or 1000)
+    chunk_overlap = splitter_config.get('chunk_overlap')
+    chunk_overlap = 200 if chunk_overlap is None else int(chunk_overlap)
+    separators = [s for s in (splitter_config.get('separators') or DEFAULT_SEPARATORS) if s]
+
+    if split_method not in SPLITTER_TYPES:
+        raise ValueError(f'不支持的分割方式: {split_method}')
+    if chunk_size <= 0:
+        raise ValueError('块大小必须大于0')
+    if chunk_overlap < 0 or chunk_overlap >= chunk_size:
+        raise ValueError('重叠大小必须大于等于0且小于块大小')
+
+    text_splitter = lazy_import('langchain.text_splitter')
+    if split_method == 'recursive':
+        # 末尾追加空串，保证找不到分隔符时也会按字符切到 chunk_size 以内
+        return text_splitter.RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=separators + [''],
+        )
+    if split_method == 'character':
+        return text_splitter.CharacterTextSplitter(
+            separator=separators[0] if separators else '\n\n',
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+        )
+    return text_splitter.TokenTextSplitter(
+        encoding_name=KNOWLEDGE_PROCESS_CONFIG['TOKEN_ENCODING'],
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+
+
+def split_text(text, splitter_config):
+    """切分文本，丢弃空白分段"""
+    splitter = build_text_splitter(splitter_config)
+    return [chunk for chunk in splitter.split_text(text) if chunk.strip()]
+
+
+def split_segments(segments, splitter_config):
+    """逐个片段切分，返回 (chunks, metadatas)，分段继承所在片段的元数据（如页码）"""
+    splitter = build_text_splitter(splitter_config)
+    chunks = []
+    metadatas = []
+    for segment in segments:
+        for chunk in splitter.split_text(segment.text):
+            if chunk.strip():
+                chunks.append(chunk)
+                metadatas.append(dict(segment.metadata))
+    return chunks, metadatas
+
+
+def resolve_parent_config(splitter_config):
+    """父子分段参数：未启用 use_parent_document 时返回 None，否则返回父块的分割配置（父块总是按字符递归分割）"""
+    splitter_config = splitter_config or {}
+    if not splitter_config.get('use_parent_document'):
+        return None
+    try:
+        parent_size = int(splitter_config.get('parent_chunk_size') or 2000)
+        parent_overlap = splitter_config.get('parent_chunk_overlap')
+        parent_overlap = 400 if parent_overlap is None else int(parent_overlap)
+    except (TypeError, ValueError):
+        raise ValueError('父块大小和父块重叠必须为整数')
+    if parent_size <= int(splitter_config.get('chunk_size') or 1000):
+        raise ValueError('父块大小必须大于块大小')
+    return {
+        'text_splitter': 'recursive',
+        'chunk_size': parent_size,
+        'chunk_overlap': parent_overlap,
+        'separators': splitter_config.get('separators'),
+    }
+
+
+def split_with_parents(segments, splitter_config, parent_config, clean):
+    """父子分段：每个片段先切成父块并记录父块在提取文本中的字符偏移，父块清洗后再切成子块。
+    segments 为 (片段起始偏移, TextSegment)；返回 (chunks, metadatas)，子块元数据的 parent 为 [起始偏移, 结束偏移]，
+    父块文本不另外保存，检索时按偏移从提取文本读取"""
+    parent_splitter = build_text_splitter(parent_config)
+    child_splitter = build_text_splitter(splitter_config)
+    chunks = []
+    metadatas = []
+    for offset, segment in segments:
+        cursor = 0
+        for parent in parent_splitter.split_text(segment.text):
+            # 父块是片段文本的子串（去掉首尾空白），相邻父块有重叠，从上一个父块起点之后查找
+            position = segment.text.find(parent, cursor)
+            if position < 0:
+                position = min(cursor, len(segment.text))
+            cursor = position + 1
+            span = [offset + position, offset + position + len(parent)]
+            for chunk in child_splitter.split_text(clean(parent)):
+                if chunk.strip():
+                    chunks.append(chunk)
+                    metadatas.append(dict(segment.metadata, parent=span))
+    return chunks, metadatas
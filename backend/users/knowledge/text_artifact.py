@@ -0,0 +1,236 @@
+"""
+提取文本产物：同一份文件内容只解析一次，提取结果按块压缩保存，并记录每个片段（页/工作表行段等）的字符偏移
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import zlib
+
+from django.conf import settings
+
+from ..rules import KNOWLEDGE_EXTRACT_CONFIG
+from .extractors import iter_text_segments, TextSegment, UnsupportedFileType, UNSUPPORTED_FILE_TYPE
+from .registry import extractor_registry
+
+# 提取逻辑变化导致结果不同时递增，旧产物自动失效
+ARTIFACT_VERSION = 2
+SEGMENT_SEPARATOR = '\n'
+
+
+def file_content_hash(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def artifact_key(content_hash, ext, encoding):
+    """产物键：文件内容哈希 + 扩展名 + 编码 + 产物版本，内容相同的文件共享同一产物"""
+    raw = f'{content_hash}:{ext.lower()}:{encoding}:{ARTIFACT_VERSION}'
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=20).hexdigest()
+
+
+def artifact_root():
+    return os.path.join(settings.KNOWLEDGE_DATA_ROOT, 'text')
+
+
+def _artifact_paths(key):
+    base = os.path.join(artifact_root(), key[:2], key)
+    return base + '.blocks', base + '.json'
+
+
+class TextArtifactWriter:
+    """流式写入片段：文本按固定字符数切块压缩，片段之间以换行分隔，内存占用不随文件大小增长"""
+
+    def __init__(self, key):
+        self.key = key
+        self.data_path, self.meta_path = _artifact_paths(key)
+        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+        suffix = f'.tmp{os.getpid()}-{threading.get_ident()}'
+        self._tmp_data = self.data_path + suffix
+        self._tmp_meta = self.meta_path + suffix
+        self._file = open(self._tmp_data, 'wb')
+        self.block_chars = KNOWLEDGE_EXTRACT_CONFIG['ARTIFACT_BLOCK_CHARS']
+        self.level = KNOWLEDGE_EXTRACT_CONFIG['ARTIFACT_COMPRESS_LEVEL']
+        self._buffer = []
+        self._buffered = 0
+        self.blocks = []  # [字节偏移, 字节长度]
+        self.segments = []  # [起始字符偏移, 结束字符偏移, 元数据]
+        self.length = 0
+        self.char_count = 0
+
+    def add(self, segment):
+        if self.segments:
+            self._write(SEGMENT_SEPARATOR)
+        start = self.length
+        self._write(segment.text)
+        self.segments.append([start, self.length, segment.metadata])
+        self.char_count += len(segment.text)
+
+    def _write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        self.length += len(text)
+        if self._buffered >= self.block_chars:
+            self._flush(final=False)
+
+    def _flush(self, final):
+        text = ''.join(self._buffer)
+        while len(text) >= self.block_chars or (final and text):
+            block, text = text[:self.block_chars], text[self.block_chars:]
+            data = zlib.compress(block.encode('utf-8'), self.level)
+            self.blocks.append([self._file.tell(), len(data)])
+            self._file.write(data)
+        self._buffer = [text] if text else []
+        self._buffered = len(text)
+
+    def commit(self, content_hash, ext, encoding):
+        self._flush(final=True)
+        self._file.close()
+        meta = {
+            'version': ARTIFACT_VERSION,
+            'content_hash': content_hash,
+            'ext': ext,
+            'encoding': encoding,
+            'char_count': self.char_count,
+            'length': self.length,
+            'block_chars': self.block_chars,
+            'blocks': self.blocks,
+            'segments': self.segments,
+        }
+        with open(self._tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        # 先替换数据再替换元数据，元数据文件存在即表示产物完整
+        os.replace(self._tmp_data, self.data_path)
+        os.replace(self._tmp_meta, self.meta_path)
+        return TextArtifact(self.key, meta)
+
+    def abort(self):
+        self._file.close()
+        for path in (self._tmp_data, self._tmp_meta):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class TextArtifact:
+    """已持久化的提取文本，支持按字符偏移随机读取和按片段顺序读取"""
+
+    def __init__(self, key, meta):
+        self.key = key
+        self.meta = meta
+        self.data_path, self.meta_path = _artifact_paths(key)
+
+    @classmethod
+    def open(cls, key):
+        _, meta_path = _artifact_paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if meta.get('version') != ARTIFACT_VERSION:
+            return None
+        return cls(key, meta)
+
+    @property
+    def char_count(self):
+        return self.meta['char_count']
+
+    @property
+    def length(self):
+        return self.meta['length']
+
+    @property
+    def segments(self):
+        return self.meta['segments']
+
+    def _read_blocks(self, f, first, last):
+        parts = []
+        for offset, size in self.meta['blocks'][first:last + 1]:
+            f.seek(offset)
+            parts.append(zlib.decompress(f.read(size)).decode('utf-8'))
+        return ''.join(parts)
+
+    def read(self, start=0, end=None):
+        """读取 [start, end) 字符范围，只解压覆盖该范围的块"""
+        end = self.length if end is None else min(end, self.length)
+        start = max(start, 0)
+        if start >= end:
+            return ''
+        block_chars = self.meta['block_chars']
+        first, last = start // block_chars, (end - 1) // block_chars
+        with open(self.data_path, 'rb') as f:
+            text = self._read_blocks(f, first, last)
+        return text[start - first * block_chars:end - first * block_chars]
+
+    def iter_segments(self):
+        """按顺序逐块解压并产出 TextSegment，同一时刻只保留当前片段所需的块"""
+        block_chars = self.meta['block_chars']
+        buffer, buffer_start, next_block = '', 0, 0
+        with open(self.data_path, 'rb') as f:
+            for start, end, metadata in self.segments:
+                while buffer_start + len(buffer) < end:
+                    buffer += self._read_blocks(f, next_block, next_block)
+                    next_block += 1
+                yield TextSegment(buffer[start - buffer_start:end - buffer_start], metadata)
+                # 丢弃已读完的整块
+                drop = (end - buffer_start) // block_chars * block_chars
+                buffer, buffer_start = buffer[drop:], buffer_start + drop
+
+    def size_bytes(self):
+        return os.path.getsize(self.data_path) + os.path.getsize(self.meta_path)
+
+
+def restore_text_artifact(key, data_file, meta_file):
+    """从快照恢复提取文本产物（已存在时跳过）；与写入时相同，先替换数据再替换元数据"""
+    data_path, meta_path = _artifact_paths(key)
+    if TextArtifact.open(key) is not None:
+        return False
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    suffix = f'.tmp{os.getpid()}-{threading.get_ident()}'
+    for source, path in ((data_file, data_path), (meta_file, meta_path)):
+        with open(path + suffix, 'wb') as f:
+            shutil.copyfileobj(source, f)
+    os.replace(data_path + suffix, data_path)
+    os.replace(meta_path + suffix, meta_path)
+    return True
+
+
+def build_text_artifact(key, file_path, ext, encoding, content_hash, workers=None):
+    writer = TextArtifactWriter(key)
+    try:
+        for segment in iter_text_segments(file_path, ext, encoding, workers=workers):
+            writer.add(segment)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit(content_hash, ext, encoding)
+
+
+def ensure_text_artifact(kf, encoding='utf-8', workers=None):
+    """返回知识文件的提取文本产物，不存在时解析原文件生成；同时更新文件的内容哈希与字符数。
+    返回 (artifact, reused)，reused 表示是否复用了已有产物。没有原始文件（快照导入时未包含）时只能复用已有产物"""
+    if not kf.file:
+        artifact = TextArtifact.open(kf.text_artifact) if kf.text_artifact else None
+        if artifact is None:
+            raise FileNotFoundError(f'知识文件 {kf.id} 没有原始文件，也没有可复用的提取文本')
+        return artifact, True
+    file_path = kf.file.path
+    ext = os.path.splitext(file_path)[-1].lower()
+    if ext not in extractor_registry:
+        raise UnsupportedFileType(UNSUPPORTED_FILE_TYPE)
+    content_hash = kf.content_hash or file_content_hash(file_path)
+    key = artifact_key(content_hash, ext, encoding)
+    artifact = TextArtifact.open(key)
+    reused = artifact is not None
+    if artifact is None:
+        artifact = build_text_artifact(key, file_path, ext, encoding, content_hash, workers)
+    if (kf.content_hash, kf.text_artifact, kf.char_count) != (content_hash, key, artifact.char_count):
+        kf.content_hash = content_hash
+        kf.text_artifact = key
+        kf.char_count = artifact.char_count
+        kf.save(update_fields=['content_hash', 'text_artifact', 'char_count'])
+    return artifact, reused
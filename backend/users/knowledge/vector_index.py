@@ -0,0 +1,1470 @@
+"""
+知识库向量索引：每个知识库一个索引，文件按 file_id 增量追加与移除；向量以 float32 原始矩阵存储并通过内存映射读取，多个进程共享操作系统页缓存
+
+目录结构（KNOWLEDGE_DATA_ROOT/indexes/kb_<id>/）：
+    write.lock          写入方的跨进程文件锁
+    gen_<n>/            数据代目录；重建或压缩时写入新一代，提交后把 KnowledgeBase.index_generation 指向新一代
+        manifest.json   该代已提交的行数、维度、各文件的行范围等，写入方以原子替换方式更新
+        reader.lock     读者持有共享锁；不再被引用且没有读者的旧代在下次提交时删除
+        vectors.f32     count × dim 的 float32 矩阵；设置了降维时为降维后的向量，见 reduction
+        norms.f32       每行向量的 L2 范数
+        file_ids.i64    每行所属的知识文件 id
+        offsets.i64     每行在 chunks.jsonl 中的起始字节偏移
+        doclens.u32     每行的关键词词项数（BM25 文档长度）
+        canonical.i64   近似重复行所链接的规范行，-1 表示该行本身是规范行；规范行可见时重复行不参与检索，见 dedup
+        lsh.u64         count × bands 的 MinHash LSH 带哈希，新写入的文件据此查找近似重复的已有行；
+                        带哈希同时以特殊词项写入关键词段，查找时只读取对应的倒排表，不扫描本列
+        chunks.jsonl    每行一个 {"content", "metadata"}
+        keyword/        关键词倒排表的各个段，见 keyword_index；页码、章节等元数据也以特殊词项写入，见 metadata_filter
+        ann/            可选的近似最近邻索引（IVF / IVF-PQ），见 ann_index；构建之后追加的行按精确方式扫描
+        q_<n>.f16/.i8   可选的紧凑向量副本（float16 / int8），检索时扫描该副本，见 quantization
+        projection.f32  可选的 PCA 投影矩阵，写入的分段向量与查询向量都按它降维
+
+向量化模型或维度变化时，新向量写入暂存代（KnowledgeBase.index_staging_generation），查询继续使用当前代；
+暂存代包含当前代的全部文件后一次性切换，之前的数据代在读者释放后回收
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from ..models import KnowledgeBase, KnowledgeFile
+from ..rules import KNOWLEDGE_SEARCH_CONFIG, KNOWLEDGE_INDEX_CONFIG, KNOWLEDGE_REDUCTION_CONFIG
+from .ann_index import ANN_DIR, AnnConfigError, AnnIndex, build_ann, remap_ann, resolve_ann_config, ann_paths
+from .quantization import compact_dot, compute_scales, quantize, quantized_dtype, quantized_filename, resolve_storage
+from .retrieval_cache import invalidate_kb_results
+from .keyword_index import KeywordSegment, analyze, bm25_search, merge_segments, write_segment, SEGMENT_FILES
+from .metadata_filter import ROW_FIELDS, field_term, match_values, merge_values, metadata_terms
+from .dedup import dedup_params, find_duplicates, lsh_bands, shingle_set
+from .reduction import fit_pca, new_projection, project, read_projection, resolve_reduction, write_projection
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = 5
+# 可以原地升级的旧格式：2 没有关键词倒排表，3 没有元数据过滤词项，4 没有近似去重的规范行与带哈希
+UPGRADABLE_FORMATS = (2, 3, 4)
+METRICS = ('cosine', 'dot', 'euclidean')
+
+_DATA_FILES = {
+    'vectors': ('vectors.f32', np.float32),
+    'norms': ('norms.f32', np.float32),
+    'file_ids': ('file_ids.i64', np.int64),
+    'offsets': ('offsets.i64', np.int64),
+    'doc_lens': ('doclens.u32', np.uint32),
+    'canonical': ('canonical.i64', np.int64),
+    'lsh': ('lsh.u64', np.uint64),
+}
+CHUNKS_FILE = 'chunks.jsonl'
+KEYWORD_DIR = 'keyword'
+MANIFEST_FILE = 'manifest.json'
+READER_LOCK = 'reader.lock'
+
+
+def index_root():
+    return os.path.join(settings.KNOWLEDGE_DATA_ROOT, 'indexes')
+
+
+def index_dir(kb_id):
+    return os.path.join(index_root(), f'kb_{kb_id}')
+
+
+def dir_bytes(path):
+    """目录（或文件）占用的字节数；遍历期间被删除的文件忽略"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _generation_dir(path, generation):
+    return os.path.join(path, f'gen_{generation}')
+
+
+def _read_manifest(path, formats=(INDEX_FORMAT,)):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return manifest if manifest.get('format') in formats else None
+
+
+def _write_manifest(path, manifest):
+    tmp_path = os.path.join(path, f'{MANIFEST_FILE}.tmp{os.getpid()}')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, MANIFEST_FILE))
+
+
+def _read_pointers(kb_id):
+    """(当前数据代, 暂存数据代)，0 表示没有"""
+    return KnowledgeBase.objects.filter(id=kb_id).values_list('index_generation', 'index_staging_generation').first() or (0, 0)
+
+
+def _set_pointers(kb_id, **pointers):
+    KnowledgeBase.objects.filter(id=kb_id).update(**pointers)
+
+
+def _migrate_legacy_manifest(kb_id):
+    """旧版索引的 manifest 在知识库目录下：移入所属数据代并写入指针，返回该数据代（没有则为 0）"""
+    path = index_dir(kb_id)
+    if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        return 0
+    manifest = _read_manifest(path, (INDEX_FORMAT,) + UPGRADABLE_FORMATS)
+    generation = manifest['generation'] if manifest else 0
+    if generation and os.path.isdir(_generation_dir(path, generation)):
+        _write_manifest(_generation_dir(path, generation), manifest)
+        _set_pointers(kb_id, index_generation=generation)
+    else:
+        generation = 0
+    # 旧格式或损坏的索引：清掉残留文件后从空索引开始
+    for name in os.listdir(path):
+        if name != 'write.lock' and not name.startswith('gen_'):
+            os.remove(os.path.join(path, name))
+    return generation
+
+
+def _lock_generation(directory):
+    """读者对数据代加共享锁，返回锁文件描述符；该代正在被回收时视为不存在"""
+    fd = os.open(os.path.join(directory, READER_LOCK), os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        raise FileNotFoundError(directory)
+    if not os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        os.close(fd)
+        raise FileNotFoundError(directory)
+    return fd
+
+
+def _collect_generations(kb_id, keep):
+    """删除 keep 之外、没有读者持有的数据代，返回 (删除的代, 仍被读者持有的代)；调用方需持有写锁"""
+    path = index_dir(kb_id)
+    removed, busy = [], []
+    for name in sorted(os.listdir(path)) if os.path.isdir(path) else []:
+        if not name.startswith('gen_') or not name[4:].isdigit() or int(name[4:]) in keep:
+            continue
+        directory = os.path.join(path, name)
+        try:
+            fd = os.open(os.path.join(directory, READER_LOCK), os.O_RDWR | os.O_CREAT)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            busy.append(int(name[4:]))
+            continue
+        else:
+            # 先删除 manifest，等待加锁的读者随即发现该代已不存在
+            if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+                os.remove(os.path.join(directory, MANIFEST_FILE))
+            shutil.rmtree(directory, ignore_errors=True)
+            removed.append(int(name[4:]))
+        finally:
+            os.close(fd)
+    if busy:
+        logger.info(f'[KnowledgeIndex] 知识库 {kb_id} 数据代 {busy} 仍有读者，暂不回收')
+    return removed, busy
+
+
+def _row_shape(name, count, manifest):
+    if name == 'vectors':
+        return count, manifest['dim']
+    if name == 'lsh':
+        return count, manifest['dedup']['bands']
+    return count,
+
+
+def _empty_keyword():
+    # lsh：各段是否已包含全部行的带哈希词项，旧索引由写入方打开时补建
+    return {'segments': [], 'next_segment': 1, 'token_total': 0, 'lsh': True}
+
+
+def _empty_manifest(generation=1, version=0):
+    return {
+        'format': INDEX_FORMAT,
+        'version': version,
+        'generation': generation,
+        'dim': 0,
+        'count': 0,
+        'chunks_bytes': 0,
+        'embedding': {},
+        'files': {},
+        'sources': {},
+        'keyword': _empty_keyword(),
+        'ann': None,
+        'quantized': None,
+        'projection': None,
+        'metadata': {},
+        'text_artifacts': {},
+        'stages': {},
+        'dedup': dedup_params(),
+        'updated': 0,
+    }
+
+
+class KnowledgeIndex:
+    """已提交索引的只读视图；构造时对数据代加共享锁并映射数据文件，存活期间该代不会被回收"""
+
+    def __init__(self, path, manifest, lock=True):
+        self.path = path
+        self.manifest = manifest
+        self.count = manifest['count']
+        self.dim = manifest['dim']
+        self.data_path = _generation_dir(path, manifest['generation'])
+        self._live_mask = None
+        self._visible_mask = None
+        self._arrays = {}
+        self._chunks_fd = None
+        # 写入方持有写锁时该代不会被回收，且所写的新代在提交前还没有 manifest，不加读者锁
+        self._lock_fd = _lock_generation(self.data_path) if lock else None
+        if self.count:
+            for name, (filename, dtype) in _DATA_FILES.items():
+                self._arrays[name] = np.memmap(
+                    os.path.join(self.data_path, filename), dtype=dtype, mode='r', shape=_row_shape(name, self.count, manifest))
+            self._chunks_fd = os.open(os.path.join(self.data_path, CHUNKS_FILE), os.O_RDONLY)
+        else:
+            for name, (_, dtype) in _DATA_FILES.items():
+                self._arrays[name] = np.zeros(_row_shape(name, 0, manifest), dtype=dtype)
+        keyword_path = os.path.join(self.data_path, KEYWORD_DIR)
+        self.keyword_segments = [KeywordSegment(keyword_path, name) for name in manifest['keyword']['segments']]
+        ann_info = manifest.get('ann')
+        self.ann = AnnIndex(os.path.join(self.data_path, ANN_DIR), ann_info) if ann_info else None
+        self.quantized = manifest.get('quantized')
+        self.projection = manifest.get('projection')
+        self._projection_matrix = read_projection(self.data_path, self.projection)
+        self._compact = None
+        if self.quantized:
+            dtype = quantized_dtype(self.quantized)
+            self._compact = np.memmap(
+                os.path.join(self.data_path, quantized_filename(self.quantized)), dtype=dtype, mode='r', shape=(self.count, self.dim)
+            ) if self.count else np.zeros((0, self.dim), dtype=dtype)
+
+    def __del__(self):
+        if getattr(self, '_chunks_fd', None) is not None:
+            os.close(self._chunks_fd)
+        # 关闭描述符即释放共享锁
+        if getattr(self, '_lock_fd', None) is not None:
+            os.close(self._lock_fd)
+
+    @classmethod
+    def open(cls, kb_id, generation):
+        path = index_dir(kb_id)
+        manifest = _read_manifest(_generation_dir(path, generation))
+        if manifest is None:
+            raise FileNotFoundError(_generation_dir(path, generation))
+        return cls(path, manifest)
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    @property
+    def generation(self):
+        return self.manifest['generation']
+
+    @property
+    def embedding(self):
+        return self.manifest['embedding']
+
+    @property
+    def input_dim(self):
+        """向量化模型输出的维度；降维时大于索引维度"""
+        return self.projection['input_dim'] if self.projection else self.dim
+
+    @property
+    def projection_matrix(self):
+        return self._projection_matrix
+
+    def project(self, vectors):
+        """把模型输出的向量变换到索引空间（查询向量检索前调用）"""
+        return project(vectors, self.projection, self._projection_matrix)
+
+    @property
+    def vectors(self):
+        return self._arrays['vectors']
+
+    @property
+    def norms(self):
+        return self._arrays['norms']
+
+    @property
+    def file_ids(self):
+        return self._arrays['file_ids']
+
+    @property
+    def doc_lens(self):
+        return self._arrays['doc_lens']
+
+    @property
+    def canonical(self):
+        return self._arrays['canonical']
+
+    @property
+    def lsh(self):
+        return self._arrays['lsh']
+
+    def live_mask(self):
+        """仍属于当前文件行范围的行；文件被移除或重新写入后旧行不再参与检索"""
+        if self._live_mask is None:
+            mask = np.zeros(self.count, dtype=bool)
+            for start, end in self.manifest['files'].values():
+                mask[start:end] = True
+            self._live_mask = mask
+        return self._live_mask
+
+    def live_count(self):
+        return int(sum(end - start for start, end in self.manifest['files'].values()))
+
+    def visible_mask(self, mask=None):
+        """参与检索的行：存活行（给出 mask 时再与之相与）去掉规范行同样在其中的近似重复行；
+        规范行已移除或不在其中时，链接到它的重复行中第一行代替它参与检索"""
+        if mask is None and self._visible_mask is not None:
+            return self._visible_mask
+        base = self.live_mask() if mask is None else self.live_mask() & mask
+        visible = base
+        linked = np.flatnonzero(base & (np.asarray(self.canonical) >= 0))
+        if len(linked):
+            visible = base.copy()
+            roots = np.asarray(self.canonical[linked])
+            covered = base[roots]
+            visible[linked[covered]] = False
+            orphans, orphan_roots = linked[~covered], roots[~covered]
+            _, first = np.unique(orphan_roots, return_index=True)
+            hidden = np.ones(len(orphans), dtype=bool)
+            hidden[first] = False
+            visible[orphans[hidden]] = False
+        if mask is None:
+            self._visible_mask = visible
+        return visible
+
+    def duplicate_candidates(self, bands, exclude_file=None):
+        """与 bands 各分段有相同带哈希、且参与检索的行，返回每个分段的候选行集合；exclude_file 的旧行视为已移除。
+        关键词段包含带哈希词项时只读取这些词项的倒排表并逐行判断可见性，否则扫描 lsh 列"""
+        if not self.manifest['keyword'].get('lsh'):
+            return self._scan_duplicate_candidates(bands, exclude_file)
+        files, excluded = self.manifest['files'], str(exclude_file)
+
+        def in_base(row):
+            file_id = str(int(self.file_ids[row]))
+            span = files.get(file_id)
+            return file_id != excluded and span is not None and span[0] <= row < span[1]
+
+        postings = {}
+        for value in np.unique(bands[bands != 0]).tolist():
+            hits = [segment.postings(value) for segment in self.keyword_segments]
+            hits = [rows for rows, _ in filter(None, hits)]
+            if hits:
+                postings[value] = np.unique(np.concatenate(hits)).tolist()
+        visible = {}
+        candidates = []
+        for values in bands.tolist():
+            rows = set()
+            for value in values:
+                for row in postings.get(value, ()):
+                    if row not in visible:
+                        # 规范行同样参与检索时重复行被隐藏；规范行已移除的重复行都保留为候选
+                        root = int(self.canonical[row])
+                        visible[row] = in_base(row) and not (root >= 0 and in_base(root))
+                    if visible[row]:
+                        rows.add(row)
+            candidates.append(rows)
+        return candidates
+
+    def _scan_duplicate_candidates(self, bands, exclude_file):
+        mask = None
+        if str(exclude_file) in self.manifest['files']:
+            start, end = self.manifest['files'][str(exclude_file)]
+            mask = np.ones(self.count, dtype=bool)
+            mask[start:end] = False
+        visible = self.visible_mask(mask)
+        candidates = [set() for _ in range(len(bands))]
+        for band in range(bands.shape[1]):
+            column = np.asarray(self.lsh[:, band])
+            hits = np.flatnonzero(np.isin(column, bands[:, band]) & visible)
+            if not len(hits):
+                continue
+            lookup = {}
+            for i, value in enumerate(bands[:, band].tolist()):
+                lookup.setdefault(value, []).append(i)
+            for row, value in zip(hits.tolist(), column[hits].tolist()):
+                for i in lookup[value]:
+                    candidates[i].add(row)
+        return candidates
+
+    def dedup_stats(self):
+        """存活行中因规范行可见而不参与检索的近似重复行数及其比例"""
+        rows = int(np.count_nonzero(self.live_mask()))
+        visible = int(np.count_nonzero(self.visible_mask()))
+        return {
+            'rows': rows,
+            'duplicate_rows': rows - visible,
+            'visible_rows': visible,
+            'dedup_ratio': round((rows - visible) / rows, 4) if rows else 0.0,
+        }
+
+    def filter_mask(self, filters, file_ids=None):
+        """按元数据条件得到行掩码：file_ids 由各文件的行范围得到，页码、章节等按行字段读取对应取值的倒排表；
+        不同字段之间为且，同一字段的多个取值为或。没有条件时返回 None"""
+        mask = None
+        if file_ids is not None:
+            mask = np.zeros(self.count, dtype=bool)
+            for file_id in file_ids:
+                start, end = self.manifest['files'].get(str(file_id), (0, 0))
+                mask[start:end] = True
+        for field in ROW_FIELDS:
+            if field not in filters:
+                continue
+            field_mask = np.zeros(self.count, dtype=bool)
+            for value in match_values(field, filters[field], self.manifest['metadata'].get(field, [])):
+                term = field_term(field, value)
+                for segment in self.keyword_segments:
+                    postings = segment.postings(term)
+                    if postings is not None:
+                        field_mask[postings[0]] = True
+            mask = field_mask if mask is None else mask & field_mask
+        return mask
+
+    def _chunk_range(self, row):
+        offsets = self._arrays['offsets']
+        start = int(offsets[row])
+        end = int(offsets[row + 1]) if row + 1 < self.count else self.manifest['chunks_bytes']
+        return start, end
+
+    def chunk(self, row):
+        start, end = self._chunk_range(row)
+        return json.loads(os.pread(self._chunks_fd, end - start, start))
+
+    def chunks(self, rows):
+        return [self.chunk(int(row)) for row in rows]
+
+    def chunk_lines(self, start, end):
+        """[start, end) 行在 chunks.jsonl 中的原始字节（每行一个 JSON，以换行结尾）"""
+        first, _ = self._chunk_range(start)
+        _, last = self._chunk_range(end - 1)
+        return os.pread(self._chunks_fd, last - first, first)
+
+    @property
+    def storage(self):
+        return self.quantized['dtype'] if self.quantized else 'float32'
+
+    def memory_bytes(self):
+        """检索时需要扫描的向量数据大小：有紧凑副本时为副本大小，否则为 float32 矩阵大小"""
+        float32_bytes = self.count * self.dim * 4
+        return {'float32': float32_bytes, 'scan': self._compact.nbytes if self._compact is not None else float32_bytes}
+
+    def _dots(self, query, rows_or_slice, compact):
+        if compact:
+            return compact_dot(self._compact[rows_or_slice], query, self.quantized)
+        return self.vectors[rows_or_slice] @ query
+
+    def score_block(self, query, start, end, metric='cosine', compact=False):
+        """计算 [start, end) 行与查询向量的相似度，分数越大越相似；compact 时使用紧凑副本"""
+        return _similarity(self._dots(query, slice(start, end), compact), self.norms[start:end], query, metric)
+
+    def score_rows(self, query, rows, metric='cosine', compact=False):
+        """只计算指定行的相似度（按行号顺序读取映射页），用于融合与重排候选，不扫描全部行"""
+        rows = np.asarray(rows, dtype=np.int64)
+        query = np.asarray(query, dtype=np.float32)
+        order = np.argsort(rows)
+        scores = np.empty(len(rows), dtype=np.float32)
+        sorted_rows = rows[order]
+        scores[order] = _similarity(self._dots(query, sorted_rows, compact), self.norms[sorted_rows], query, metric)
+        return scores
+
+    def keyword_search(self, query, top_k, mask=None):
+        """BM25 关键词检索，只读取查询词项的倒排表"""
+        live = self.visible_mask(mask)
+        avg_doc_len = self.manifest['keyword']['token_total'] / max(self.count, 1)
+        return bm25_search(self.keyword_segments, query, self.doc_lens, live, top_k, avg_doc_len)
+
+    @property
+    def index_type(self):
+        return self.ann.type if self.ann else 'flat'
+
+    def search(self, query, top_k, metric='cosine', mask=None, nprobe=None, rerank=None, use_ann=True, rescore=True,
+               exact=False):
+        """返回按分数降序的 (rows, scores)。有近似最近邻索引且度量一致时只访问 nprobe 个列表，否则分块扫描全部存活行；
+        有紧凑副本时在副本上打分，rescore 时再用 float32 向量对前 top_k × QUANTIZED_RESCORE_FACTOR 个候选重排。
+        mask 为元数据过滤掩码，筛选出的行较少时只计算这些行；exact 表示直接扫描 float32 矩阵（基准结果）。
+        规范行可见的近似重复行不参与检索"""
+        if metric not in METRICS:
+            raise ValueError(f'不支持的相似度计算方式: {metric}')
+        query = np.asarray(query, dtype=np.float32)
+        if self.count == 0 or top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if query.shape != (self.dim,):
+            raise ValueError(f'查询向量维度 {query.shape[0]} 与索引维度 {self.dim} 不一致')
+        live = self.visible_mask(mask)
+        compact = self._compact is not None and not exact
+        fetch = top_k * KNOWLEDGE_SEARCH_CONFIG['QUANTIZED_RESCORE_FACTOR'] if compact and rescore else top_k
+        selected = np.flatnonzero(live) if mask is not None else None
+        if selected is not None and len(selected) <= self.count * KNOWLEDGE_SEARCH_CONFIG['PREFILTER_MAX_RATIO']:
+            # 过滤条件足够严格时只读取筛选出的行，扫描量与筛选结果成正比
+            rows, scores = self._scan_rows(query, fetch, metric, selected, compact)
+        elif not exact and use_ann and self.ann is not None and self.ann.metric == metric:
+            nprobe = nprobe or KNOWLEDGE_SEARCH_CONFIG['ANN_NPROBE']
+            rerank = rerank or KNOWLEDGE_SEARCH_CONFIG['ANN_RERANK_FACTOR']
+            rows, estimates = self.ann.candidates(query, nprobe)
+            keep = live[rows]
+            rows = rows[keep]
+            if estimates is not None and len(rows) > top_k * rerank:
+                estimates = estimates[keep]
+                rows = rows[np.argpartition(-estimates, top_k * rerank - 1)[:top_k * rerank]]
+            scores = self.score_rows(query, rows, metric, compact) if len(rows) else np.zeros(0, dtype=np.float32)
+            # 构建之后追加的行不在近似索引中，逐行扫描
+            tail_rows, tail_scores = self._scan(query, fetch, metric, live, self.ann.rows_covered, self.count, compact)
+            rows = np.concatenate([rows, tail_rows])
+            scores = np.concatenate([scores, tail_scores])
+            if selected is not None and len(rows) < min(top_k, len(selected)):
+                # 访问的列表中满足过滤条件的行不足 top_k，改为扫描全部筛选出的行
+                rows, scores = self._scan_rows(query, fetch, metric, selected, compact)
+        else:
+            rows, scores = self._scan(query, fetch, metric, live, 0, self.count, compact)
+        if compact and rescore and len(rows):
+            if len(rows) > fetch:
+                top = np.argpartition(-scores, fetch - 1)[:fetch]
+                rows = rows[top]
+            scores = self.score_rows(query, rows, metric)
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        return rows[order], scores[order]
+
+    def _scan_rows(self, query, top_k, metric, rows, compact=False):
+        """分块计算指定行（升序）的相似度，每块只保留前 top_k"""
+        block_rows = KNOWLEDGE_SEARCH_CONFIG['COMPACT_SCAN_BLOCK_ROWS' if compact else 'SCAN_BLOCK_ROWS']
+        best_rows, best_scores = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.float32)]
+        for start in range(0, len(rows), block_rows):
+            block = rows[start:start + block_rows]
+            scores = _similarity(self._dots(query, block, compact), self.norms[block], query, metric)
+            if len(block) > top_k:
+                top = np.argpartition(-scores, top_k - 1)[:top_k]
+                block, scores = block[top], scores[top]
+            best_rows.append(block)
+            best_scores.append(scores)
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        return rows[order], scores[order]
+
+    def _scan(self, query, top_k, metric, live, first, last, compact=False):
+        """分块扫描 [first, last) 行，每块只保留前 top_k，内存占用与索引大小无关。
+        紧凑副本每块需转换为 float32，用较小的块让临时矩阵留在 CPU 缓存中"""
+        block_rows = KNOWLEDGE_SEARCH_CONFIG['COMPACT_SCAN_BLOCK_ROWS' if compact else 'SCAN_BLOCK_ROWS']
+        best_rows, best_scores = [], []
+        for start in range(first, last, block_rows):
+            end = min(start + block_rows, last)
+            block_live = live[start:end]
+            if not block_live.any():
+                continue
+            scores = self.score_block(query, start, end, metric, compact)
+            scores[~block_live] = -np.inf
+            k = min(top_k, end - start)
+            top = np.argpartition(-scores, k - 1)[:k]
+            best_rows.append(top + start)
+            best_scores.append(scores[top])
+        if not best_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows = np.concatenate(best_rows)
+        scores = np.concatenate(best_scores)
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        rows, scores = rows[order], scores[order]
+        keep = np.isfinite(scores)
+        return rows[keep], scores[keep]
+
+
+def _live_row_map(manifest):
+    """存活行按文件顺序排列后的新行号，已移除或被替换的行为 -1"""
+    row_map = np.full(manifest['count'], -1, dtype=np.int64)
+    new_start = 0
+    for start, end in sorted(manifest['files'].values()):
+        row_map[start:end] = np.arange(new_start, new_start + end - start)
+        new_start += end - start
+    return row_map
+
+
+def _similarity(dots, norms, query, metric):
+    """由内积与行向量范数得到相似度"""
+    scores = dots
+    if metric == 'cosine':
+        scores /= np.maximum(norms * np.linalg.norm(query), 1e-12)
+    elif metric == 'euclidean':
+        squared = norms ** 2 + float(query @ query) - 2 * scores
+        scores = -np.sqrt(np.maximum(squared, 0))
+    return scores
+
+
+_open_indexes = {}  # kb_id -> (generation, manifest mtime, KnowledgeIndex, 最近使用时间)
+_open_lock = threading.Lock()
+_reaper = None
+
+
+def release_idle_indexes(idle_seconds=None):
+    """关闭超过 READER_IDLE_SECONDS 未使用的已打开索引；索引不再被引用时释放数据代的读者锁，
+    空闲的 web / worker 进程不会一直持有已被替换的旧代而阻塞回收。返回关闭的个数"""
+    idle_seconds = KNOWLEDGE_INDEX_CONFIG['READER_IDLE_SECONDS'] if idle_seconds is None else idle_seconds
+    deadline = time.monotonic() - idle_seconds
+    with _open_lock:
+        expired = [kb_id for kb_id, entry in _open_indexes.items() if entry[3] <= deadline]
+        for kb_id in expired:
+            del _open_indexes[kb_id]
+    return len(expired)
+
+
+def _reap_idle_indexes():
+    while True:
+        time.sleep(max(KNOWLEDGE_INDEX_CONFIG['READER_IDLE_SECONDS'] / 2, 1))
+        release_idle_indexes()
+
+
+def _start_reaper():
+    """首次打开索引时启动后台线程，定期关闭空闲的索引；调用方持有 _open_lock"""
+    global _reaper
+    if _reaper is None:
+        _reaper = threading.Thread(target=_reap_idle_indexes, name='knowledge-index-reaper', daemon=True)
+        _reaper.start()
+
+
+def get_index(kb_id, generation=None):
+    """打开知识库当前数据代（generation 为调用方已读到的指针，省去一次查询）；进程内复用已打开的索引，
+    manifest 更新后重新打开。指针切换后旧代随时可能被回收，打开失败时重新读取指针"""
+    for attempt in range(3):
+        if generation is None or attempt:
+            generation = _read_pointers(kb_id)[0] or _migrate_legacy_index(kb_id)
+        if not generation:
+            return None
+        try:
+            mtime = os.stat(os.path.join(_generation_dir(index_dir(kb_id), generation), MANIFEST_FILE)).st_mtime_ns
+            with _open_lock:
+                cached = _open_indexes.get(kb_id)
+                if cached and cached[:2] == (generation, mtime):
+                    _open_indexes[kb_id] = cached[:3] + (time.monotonic(),)
+                    return cached[2]
+            index = KnowledgeIndex.open(kb_id, generation)
+        except FileNotFoundError:
+            continue
+        with _open_lock:
+            # 替换掉的旧索引不再被引用后即释放其共享锁
+            _open_indexes[kb_id] = (generation, mtime, index, time.monotonic())
+            _start_reaper()
+        return index
+    return None
+
+
+def _migrate_legacy_index(kb_id):
+    if not os.path.exists(os.path.join(index_dir(kb_id), MANIFEST_FILE)):
+        return 0
+    with index_write_lock(kb_id):
+        return _read_pointers(kb_id)[0] or _migrate_legacy_manifest(kb_id)
+
+
+@contextmanager
+def index_write_lock(kb_id):
+    """同一知识库同时只允许一个写入方（跨进程文件锁）"""
+    path = index_dir(kb_id)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'write.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class KnowledgeIndexWriter:
+    """在写锁内使用：按文件追加或移除行，commit 时原子替换所写数据代的 manifest 并更新知识库的数据代指针。
+    staging=True 时写入暂存代（没有则新建），当前代继续服务查询"""
+
+    def __init__(self, kb_id, staging=False):
+        self.kb_id = kb_id
+        self.path = index_dir(kb_id)
+        os.makedirs(self.path, exist_ok=True)
+        self.published, self.staging = _read_pointers(kb_id)
+        if not self.published:
+            self.published = _migrate_legacy_manifest(kb_id)
+        self.is_staging = staging
+        formats = (INDEX_FORMAT,) + UPGRADABLE_FORMATS
+        published = _read_manifest(_generation_dir(self.path, self.published), formats) if self.published else None
+        self.published_version = published['version'] if published else 0
+        manifest = published
+        if staging:
+            manifest = _read_manifest(_generation_dir(self.path, self.staging), formats) if self.staging else None
+        if manifest is None:
+            manifest = _empty_manifest(generation=self._start_generation(), version=self.published_version)
+            if published:
+                # 保留已导入旧版目录的记录，避免旧向量被重新导入
+                manifest['sources'] = dict(published['sources'])
+        self.manifest = manifest
+        from_format = manifest['format']
+        self.upgraded = from_format != INDEX_FORMAT
+        rebuild_text = from_format == 2
+        if self.upgraded:
+            manifest['format'] = INDEX_FORMAT
+            manifest['dedup'] = dedup_params()
+            if from_format < 4:
+                manifest['metadata'] = {}
+            if rebuild_text:
+                manifest['keyword'] = _empty_keyword()
+            manifest['keyword']['lsh'] = False
+        self._truncate_uncommitted(keyword_rows=0 if rebuild_text else manifest['count'],
+                                   dedup_rows=0 if self.upgraded else manifest['count'])
+        if self.upgraded:
+            if from_format < 4:
+                self._build_keyword_index(rebuild_text)
+            self._build_dedup_columns()
+        if not manifest['keyword'].get('lsh'):
+            self._build_band_terms()
+
+    @property
+    def data_path(self):
+        return _generation_dir(self.path, self.manifest['generation'])
+
+    def _view(self):
+        """所写数据代（含未提交的行）的只读视图"""
+        return KnowledgeIndex(self.path, self.manifest, lock=False)
+
+    def _next_generation(self):
+        generations = [
+            int(name[4:]) for name in os.listdir(self.path) if name.startswith('gen_') and name[4:].isdigit()
+        ] if os.path.isdir(self.path) else []
+        return max(generations, default=0) + 1
+
+    @property
+    def keyword_path(self):
+        return os.path.join(self.data_path, KEYWORD_DIR)
+
+    @property
+    def ann_path(self):
+        return os.path.join(self.data_path, ANN_DIR)
+
+    def _truncate_uncommitted(self, keyword_rows, dedup_rows):
+        # 上次写入中断时，丢弃 manifest 之后的残留数据
+        count, dim = self.manifest['count'], self.manifest['dim']
+        sizes = {
+            'vectors': count * dim * 4,
+            'norms': count * 4,
+            'file_ids': count * 8,
+            'offsets': count * 8,
+            'doc_lens': keyword_rows * 4,
+            'canonical': dedup_rows * 8,
+            'lsh': dedup_rows * self.manifest['dedup']['bands'] * 8,
+        }
+        for name, (filename, _) in _DATA_FILES.items():
+            self._truncate(filename, sizes[name])
+        self._truncate(CHUNKS_FILE, self.manifest['chunks_bytes'])
+        quantized = self.manifest.get('quantized')
+        if quantized:
+            self._truncate(quantized_filename(quantized), count * dim * np.dtype(quantized_dtype(quantized)).itemsize)
+
+    def _truncate(self, filename, size):
+        file_path = os.path.join(self.data_path, filename)
+        if os.path.exists(file_path) and os.path.getsize(file_path) != size:
+            with open(file_path, 'r+b') as f:
+                f.truncate(size)
+
+    def _start_generation(self):
+        generation = self._next_generation()
+        os.makedirs(_generation_dir(self.path, generation))
+        return generation
+
+    def reset(self):
+        """清空暂存代（重建中途向量模型或维度再次变化），新数据写入新一代目录"""
+        sources = self.manifest['sources']
+        self.manifest = _empty_manifest(generation=self._start_generation(), version=self.manifest['version'])
+        self.manifest['sources'] = sources
+
+    def missing_files(self, published_files):
+        """当前代中仍存在于知识库、但暂存代还没有的文件；为空时暂存代可以切换为当前代"""
+        existing = set(KnowledgeFile.objects.filter(kb_id=self.kb_id).values_list('id', flat=True))
+        return [f for f in published_files if f not in self.manifest['files'] and int(f) in existing]
+
+    def has_file(self, file_id):
+        return str(file_id) in self.manifest['files']
+
+    @property
+    def input_dim(self):
+        projection = self.manifest.get('projection')
+        return projection['input_dim'] if projection else self.manifest['dim']
+
+    def matches(self, embedding, dim):
+        """索引为空或向量化模型与模型输出维度都一致时返回 True"""
+        if not self.manifest['count']:
+            return True
+        return self.manifest['embedding'] == embedding and self.input_dim == dim
+
+    def append_file(self, file_id, chunks, embeddings, metadatas, embedding=None, dedup=True):
+        """追加一个文件的全部分段；该文件已有的行被替换（旧行不再存活）。dedup 时把近似重复的分段链接到
+        已有的规范行或本文件中更早的分段，返回链接的行数。embeddings 为模型输出的向量，按索引的降维设置写入；
+        链接到已有规范行的分段可以为 None，直接复用规范行已存储的向量"""
+        if not (len(chunks) == len(embeddings) == len(metadatas)):
+            raise ValueError('分段、向量、元数据数量不一致')
+        if not len(chunks):
+            self.remove_file(file_id)
+            return 0
+        if embedding is not None and self.manifest['count'] and embedding != self.manifest['embedding']:
+            raise ValueError('向量化模型与索引不一致')
+        start = self.manifest['count']
+        canonical, bands = self._link_duplicates(file_id, chunks, start, dedup)
+        vectors = self._index_vectors(embeddings, canonical, start, embedding or self.manifest['embedding'])
+        terms, rows, tfs, doc_lens = analyze(chunks)
+        self._write_rows(np.full(len(vectors), int(file_id), dtype=np.int64), vectors, doc_lens, [
+            (json.dumps({'content': chunk, 'metadata': metadata}, ensure_ascii=False) + '\n').encode('utf-8')
+            for chunk, metadata in zip(chunks, metadatas)
+        ], canonical, bands)
+        terms, rows, tfs = self._with_band_terms(*self._with_metadata_terms(terms, rows, tfs, metadatas), bands)
+        self._add_keyword_segment(terms, rows, tfs, start=start)
+        if embedding is not None:
+            self.manifest['embedding'] = embedding
+        self.manifest['files'][str(file_id)] = [self.manifest['count'] - len(vectors), self.manifest['count']]
+        return int(np.count_nonzero(canonical >= 0))
+
+    def append_rows(self, file_ids, chunks, metadatas, vectors, canonical, lsh):
+        """批量导入已在索引空间中的行（快照导入）：不做去重查找与降维，关键词段在导入结束后由 merge_keyword_segments 一次合并"""
+        start = self.manifest['count']
+        terms, rows, tfs, doc_lens = analyze(chunks)
+        self._write_rows(np.asarray(file_ids, dtype=np.int64), np.asarray(vectors, dtype=np.float32), doc_lens, [
+            (json.dumps({'content': chunk, 'metadata': metadata}, ensure_ascii=False) + '\n').encode('utf-8')
+            for chunk, metadata in zip(chunks, metadatas)
+        ], canonical, lsh)
+        terms, rows, tfs = self._with_band_terms(*self._with_metadata_terms(terms, rows, tfs, metadatas), lsh)
+        name = self._new_segment_name()
+        write_segment(self.keyword_path, name, terms, (rows.astype(np.int64) + start).astype(np.uint32), tfs)
+        self.manifest['keyword']['segments'].append(name)
+
+    def merge_keyword_segments(self):
+        if len(self.manifest['keyword']['segments']) > 1:
+            self._merge_keyword_segments(self.keyword_path, self.manifest['keyword']['segments'])
+
+    def _index_vectors(self, embeddings, canonical, start, embedding):
+        """把模型输出的向量变换到索引空间；为 None 的分段取其规范行的向量"""
+        present = [i for i, vector in enumerate(embeddings) if vector is not None]
+        projection = self.manifest.get('projection')
+        dim = self.manifest['dim']
+        if present:
+            vectors = np.asarray([embeddings[i] for i in present], dtype=np.float32)
+            if vectors.ndim != 2:
+                raise ValueError('向量格式错误')
+            if (self.manifest['count'] or projection) and vectors.shape[1] != self.input_dim:
+                raise ValueError(f'向量维度 {vectors.shape[1]} 与索引维度 {self.input_dim} 不一致')
+            if not self.manifest['count'] and projection is None:
+                # 新数据代：截断在写入第一个文件时确定；PCA 在行数足够后由 update_projection 拟合
+                projection = new_projection(resolve_reduction(embedding), vectors.shape[1])
+                projection = projection if projection and projection['method'] == 'truncate' else None
+                self.manifest['projection'] = projection
+            vectors = project(vectors, projection, read_projection(self.data_path, projection))
+            dim = vectors.shape[1]
+        result = np.empty((len(embeddings), dim), dtype=np.float32)
+        if present:
+            result[present] = vectors
+        stored = None
+        for i in range(len(embeddings)):
+            if embeddings[i] is not None:
+                continue
+            root = int(canonical[i])
+            if root < 0:
+                raise ValueError('近似重复分段的规范行已不存在，需要重新向量化')
+            if root >= start:
+                result[i] = result[root - start]
+                continue
+            if stored is None:
+                stored = self._view()
+            result[i] = stored.vectors[root]
+        return result
+
+    def _link_duplicates(self, file_id, chunks, start, dedup):
+        """在写锁内按本数据代的已有行查找近似重复（调用方在写锁外的判断可能已过期），返回 (规范行, 带哈希)"""
+        params = self.manifest['dedup']
+        if not dedup:
+            return np.full(len(chunks), -1, dtype=np.int64), np.zeros((len(chunks), params['bands']), dtype=np.uint64)
+        index = None
+        if self.manifest['count']:
+            try:
+                index = self._view()
+            except FileNotFoundError:
+                # 本次写入新建、尚未提交的数据代，只在文件内去重
+                index = None
+        rows, local, bands = find_duplicates(chunks, index, exclude_file=file_id, params=params)
+        return np.where(local >= 0, local + start, rows), bands
+
+    def _write_rows(self, file_ids, vectors, doc_lens, lines, canonical, lsh):
+        lengths = np.array([len(line) for line in lines], dtype=np.int64)
+        offsets = self.manifest['chunks_bytes'] + np.concatenate([[0], np.cumsum(lengths[:-1])])
+        self._append('vectors', vectors)
+        self._append('norms', np.linalg.norm(vectors, axis=1))
+        self._append('file_ids', file_ids)
+        self._append('offsets', offsets)
+        self._append('doc_lens', doc_lens)
+        self._append('canonical', canonical)
+        self._append('lsh', lsh)
+        quantized = self.manifest.get('quantized')
+        if quantized:
+            compact, clipped = quantize(vectors, quantized)
+            self._append_file(quantized_filename(quantized), compact)
+            quantized['clipped'] += clipped
+        with open(os.path.join(self.data_path, CHUNKS_FILE), 'ab') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self.manifest['dim'] = int(vectors.shape[1])
+        self.manifest['count'] += len(vectors)
+        self.manifest['chunks_bytes'] += int(lengths.sum())
+        self.manifest['keyword']['token_total'] += int(np.sum(doc_lens, dtype=np.int64))
+
+    def _new_segment_name(self):
+        keyword = self.manifest['keyword']
+        name = f'seg_{keyword["next_segment"]}'
+        keyword['next_segment'] += 1
+        return name
+
+    def _with_metadata_terms(self, terms, rows, tfs, metadatas):
+        """在正文词项之后追加元数据过滤词项，并记录各字段出现的取值"""
+        meta_terms, meta_rows, meta_tfs, values = metadata_terms(metadatas)
+        merge_values(self.manifest.setdefault('metadata', {}), values)
+        return np.concatenate([terms, meta_terms]), np.concatenate([rows, meta_rows]), np.concatenate([tfs, meta_tfs])
+
+    @staticmethod
+    def _with_band_terms(terms, rows, tfs, bands):
+        """追加带哈希词项（词频 1），近似去重按倒排表查找候选行；0 表示没有带哈希，不写入"""
+        bands = np.asarray(bands, dtype=np.uint64)
+        band_rows, _ = np.nonzero(bands)
+        band_terms = bands[bands != 0]
+        return (np.concatenate([terms, band_terms]), np.concatenate([rows, band_rows.astype(rows.dtype)]),
+                np.concatenate([tfs, np.ones(len(band_terms), dtype=tfs.dtype)]))
+
+    def _add_keyword_segment(self, terms, rows, tfs, start=0):
+        """每次追加写一个小段；段数超过上限时合并为一个段，查询时每个词项只需查少量段"""
+        name = self._new_segment_name()
+        write_segment(self.keyword_path, name, terms, (rows.astype(np.int64) + start).astype(np.uint32), tfs)
+        segments = self.manifest['keyword']['segments']
+        segments.append(name)
+        if len(segments) > KNOWLEDGE_INDEX_CONFIG['KEYWORD_MAX_SEGMENTS']:
+            self._merge_keyword_segments(self.keyword_path, segments)
+
+    def _merge_keyword_segments(self, source_path, segments, row_map=None):
+        name = self._new_segment_name()
+        merge_segments(self.keyword_path, [KeywordSegment(source_path, n) for n in segments], name, row_map)
+        self.manifest['keyword']['segments'] = [name]
+
+    def _build_keyword_index(self, text=True):
+        """旧格式索引升级：从已存储的分段补建元数据过滤词项，text 时同时补建正文关键词倒排表"""
+        count = self.manifest['count']
+        block_rows = KNOWLEDGE_SEARCH_CONFIG['SCAN_BLOCK_ROWS']
+        row = 0
+        empty = (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint16))
+        with open(os.path.join(self.data_path, CHUNKS_FILE), 'rb') as f:
+            while row < count:
+                chunks = [json.loads(f.readline()) for _ in range(min(block_rows, count - row))]
+                terms, rows, tfs = empty
+                if text:
+                    terms, rows, tfs, doc_lens = analyze([chunk['content'] for chunk in chunks])
+                    self._append('doc_lens', doc_lens)
+                    self.manifest['keyword']['token_total'] += int(np.sum(doc_lens, dtype=np.int64))
+                metadatas = [chunk['metadata'] for chunk in chunks]
+                self._add_keyword_segment(*self._with_metadata_terms(terms, rows, tfs, metadatas), start=row)
+                row += len(chunks)
+        logger.info(f'[KnowledgeIndex] 知识库 {self.kb_id} 索引已升级，补建 {count} 行{"关键词与" if text else ""}元数据索引')
+
+    def _build_dedup_columns(self):
+        """旧格式索引升级：已有行都作为规范行，按已存储的分段补建带哈希，之后写入的文件可以链接到这些行"""
+        count = self.manifest['count']
+        params = self.manifest['dedup']
+        block_rows = KNOWLEDGE_SEARCH_CONFIG['SCAN_BLOCK_ROWS']
+        row = 0
+        with open(os.path.join(self.data_path, CHUNKS_FILE), 'rb') as f:
+            while row < count:
+                chunks = [json.loads(f.readline())['content'] for _ in range(min(block_rows, count - row))]
+                self._append('canonical', np.full(len(chunks), -1))
+                self._append('lsh', lsh_bands([shingle_set(chunk, params['shingle']) for chunk in chunks], params))
+                row += len(chunks)
+        logger.info(f'[KnowledgeIndex] 知识库 {self.kb_id} 索引已升级，补建 {count} 行近似去重带哈希')
+
+    def _build_band_terms(self):
+        """旧索引补建：按已存储的带哈希列写入带哈希词项，之后查找近似重复时不再扫描 lsh 列"""
+        count = self.manifest['count']
+        block_rows = KNOWLEDGE_SEARCH_CONFIG['SCAN_BLOCK_ROWS']
+        empty = (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint16))
+        if count:
+            lsh = np.memmap(os.path.join(self.data_path, _DATA_FILES['lsh'][0]), dtype=np.uint64, mode='r',
+                            shape=(count, self.manifest['dedup']['bands']))
+            for row in range(0, count, block_rows):
+                self._add_keyword_segment(*self._with_band_terms(*empty, lsh[row:row + block_rows]), start=row)
+            del lsh
+        self.manifest['keyword']['lsh'] = True
+        logger.info(f'[KnowledgeIndex] 知识库 {self.kb_id} 索引已升级，补建 {count} 行近似去重带哈希词项')
+
+    def _append(self, name, array):
+        filename, dtype = _DATA_FILES[name]
+        self._append_file(filename, np.asarray(array, dtype=dtype))
+
+    def _append_file(self, filename, array):
+        with open(os.path.join(self.data_path, filename), 'ab') as f:
+            f.write(np.ascontiguousarray(array).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove_file(self, file_id):
+        self.manifest['files'].pop(str(file_id), None)
+        self.manifest.get('text_artifacts', {}).pop(str(file_id), None)
+        self.manifest.get('stages', {}).pop(str(file_id), None)
+
+    def set_source(self, file_id, stamp):
+        self.manifest['sources'][str(file_id)] = stamp
+
+    def set_text_artifact(self, file_id, key):
+        """记录文件分段所依据的提取文本产物，父子分段的父块偏移指向该产物"""
+        self.manifest.setdefault('text_artifacts', {})[str(file_id)] = key
+
+    def set_stages(self, file_id, stages):
+        """记录写入该文件分段时各处理阶段的配置指纹，整体重新处理时据此判断可以复用哪些阶段"""
+        self.manifest.setdefault('stages', {})[str(file_id)] = stages
+
+    def dead_rows(self):
+        return self.manifest['count'] - sum(end - start for start, end in self.manifest['files'].values())
+
+    def needs_compaction(self):
+        dead = self.dead_rows()
+        return (dead >= KNOWLEDGE_INDEX_CONFIG['COMPACT_MIN_DEAD_ROWS']
+                and dead > self.manifest['count'] * KNOWLEDGE_INDEX_CONFIG['COMPACT_DEAD_RATIO'])
+
+    def compact(self, projection=None, matrix=None):
+        """把存活行按文件顺序复制到新一代目录，丢弃已移除或被替换的行；给出 projection 时按新拟合的投影矩阵
+        matrix 降维后写入，近似索引与紧凑副本随后按降维后的向量重建"""
+        old = self._view()
+        files = sorted(self.manifest['files'].items(), key=lambda item: item[1][0])
+        manifest = _empty_manifest(generation=self._start_generation(), version=self.manifest['version'])
+        manifest.update(embedding=self.manifest['embedding'], sources=self.manifest['sources'], metadata=self.manifest['metadata'],
+                        text_artifacts=self.manifest.get('text_artifacts', {}), stages=self.manifest.get('stages', {}),
+                        dedup=self.manifest['dedup'], projection=projection or self.manifest.get('projection'))
+        removed = self.dead_rows()
+        old_keyword_path, old_segments = self.keyword_path, self.manifest['keyword']['segments']
+        old_ann_path, old_ann = self.ann_path, self.manifest.get('ann')
+        row_map = _live_row_map(self.manifest)
+        canonical = self._compact_links(old, row_map)
+        if self.manifest.get('quantized') and projection is None:
+            # 沿用原缩放系数，从 float32 行重新量化
+            manifest['quantized'] = dict(self.manifest['quantized'], clipped=0)
+        self.manifest = manifest
+        if projection is None:
+            matrix = old._projection_matrix
+        if matrix is not None:
+            write_projection(self.data_path, matrix)
+        block_rows = KNOWLEDGE_SEARCH_CONFIG['SCAN_BLOCK_ROWS']
+        for file_id, (start, end) in files:
+            new_start = self.manifest['count']
+            for block_start in range(start, end, block_rows):
+                block_end = min(block_start + block_rows, end)
+                data = old.chunk_lines(block_start, block_end)
+                vectors = np.asarray(old.vectors[block_start:block_end])
+                self._write_rows(
+                    np.asarray(old.file_ids[block_start:block_end]),
+                    project(vectors, projection, matrix) if projection else vectors,
+                    np.asarray(old.doc_lens[block_start:block_end]),
+                    [line + b'\n' for line in data.split(b'\n')[:-1]],
+                    canonical[block_start:block_end],
+                    np.asarray(old.lsh[block_start:block_end]),
+                )
+            self.manifest['files'][file_id] = [new_start, self.manifest['count']]
+        self._merge_keyword_segments(old_keyword_path, old_segments, row_map)
+        if old_ann and projection is None:
+            self.manifest['ann'] = remap_ann(old_ann_path, self.ann_path, old_ann['name'], old_ann, row_map)
+        logger.info(f'[KnowledgeIndex] 知识库 {self.kb_id} 索引压缩完成，丢弃 {removed} 行')
+
+    def update_projection(self):
+        """PCA 降维：索引行数足够后按抽取的存活行拟合投影矩阵，已有行投影后写入新一代，之后写入的分段直接投影。
+        返回是否拟合"""
+        reduction = resolve_reduction(self.manifest['embedding'])
+        if self.manifest.get('projection') or not reduction or reduction['method'] != 'pca':
+            return False
+        live = self.manifest['count'] - self.dead_rows()
+        if live < max(KNOWLEDGE_REDUCTION_CONFIG['PCA_MIN_ROWS'], reduction['dim'] * 2):
+            return False
+        projection = new_projection(reduction, self.manifest['dim'])
+        if projection is None:
+            return False
+        start_time = time.monotonic()
+        index = self._view()
+        rows = np.flatnonzero(index.live_mask())
+        if len(rows) > KNOWLEDGE_REDUCTION_CONFIG['PCA_FIT_ROWS']:
+            rng = np.random.default_rng(KNOWLEDGE_REDUCTION_CONFIG['SEED'])
+            rows = np.sort(rng.choice(rows, KNOWLEDGE_REDUCTION_CONFIG['PCA_FIT_ROWS'], replace=False))
+        matrix, explained = fit_pca(index.vectors[rows], projection['dim'])
+        projection.update(fitted_rows=len(rows), explained_variance=round(explained, 4))
+        index = None
+        self.compact(projection, matrix)
+        logger.info(f'[KnowledgeIndex] 知识库 {self.kb_id} 拟合 PCA 投影: {projection["input_dim"]} → {projection["dim"]} 维，'
+                    f'保留方差 {explained:.2%}，耗时 {time.monotonic() - start_time:.2f}s')
+        return True
+
+    @staticmethod
+    def _compact_links(old, row_map):
+        """压缩后的规范行（按新行号）：规范行被丢弃时，链接到它的存活行中第一行成为新的规范行，其余改链到该行"""
+        canonical = np.array(old.canonical)
+        live = row_map >= 0
+        linked = np.flatnonzero(live & (canonical >= 0))
+        roots = canonical[linked]
+        orphaned = ~live[roots]
+        orphans, orphan_roots = linked[orphaned], roots[orphaned]
+        dropped, first = np.unique(orphan_roots, return_index=True)
+        promoted = orphans[first]
+        canonical[orphans] = promoted[np.searchsorted(dropped, orphan_roots)]
+        canonical[promoted] = -1
+        return np.where(canonical >= 0, row_map[np.maximum(canonical, 0)], -1)
+
+    def update_ann(self, vector_store_config, force=False):
+        """按 vector_store_config 构建、重建或移除近似最近邻索引；构建后追加的行超过一定比例时重建。
+        返回是否重新构建"""
+        live = self.manifest['count'] - self.dead_rows()
+        current = self.manifest.get('ann')
+        try:
+            config = resolve_ann_config(vector_store_config, self.manifest['dim'])
+        except AnnConfigError as e:
+            logger.warning(f'[KnowledgeIndex] 知识库 {self.kb_id} 近似索引配置无效，使用精确检索: {str(e)}')
+            config = None
+        metric = (vector_store_config or {}).get('similarity_metric') or 'cosine'
+        # 行数较少时精确扫描已足够快
+        if config is None or not live or (not force and live < KNOWLEDGE_INDEX_CONFIG['ANN_MIN_ROWS']):
+            self.manifest['ann'] = None
+            return False
+        if not force and current and current['config'] == config and current['metric'] == metric:
+            unindexed = self.manifest['count'] - current['rows']
+            if unindexed <= current['indexed'] * KNOWLEDGE_INDEX_CONFIG['ANN_REBUILD_RATIO']:
+                return False
+        name = f'ann_{self.manifest["version"] + 1}'
+        self.manifest['ann'] = build_ann(self._view(), self.ann_path, name, config, metric)
+        return True
+
+    def update_quantization(self, vector_store_config, force=False):
+        """按 vector_store_config.storage 生成或移除紧凑向量副本；int8 被截断的行超过一定比例时重新计算缩放系数。
+        返回是否重新生成"""
+        try:
+            storage = resolve_storage(vector_store_config)
+        except ValueError as e:
+            logger.warning(f'[KnowledgeIndex] 知识库 {self.kb_id} 向量存储精度配置无效，使用 float32: {str(e)}')
+            storage = 'float32'
+        current = self.manifest.get('quantized')
+        if storage == 'float32' or not self.manifest['count']:
+            self.manifest['quantized'] = None
+            return False
+        if not force and current and current['dtype'] == storage \
+                and current['clipped'] <= self.manifest['count'] * KNOWLEDGE_INDEX_CONFIG['INT8_REQUANTIZE_CLIP_RATIO']:
+            return False
+        start_time = time.monotonic()
+        index = self._view()
+        block_rows = KNOWLEDGE_SEARCH_CONFIG['SCAN_BLOCK_ROWS']
+
+        def blocks():
+            for start in range(0, index.count, block_rows):
+                yield np.asarray(index.vectors[start:start + block_rows])
+
+        info = {'dtype': storage, 'name': f'q_{self.manifest["version"] + 1}', 'clipped': 0}
+        if storage == 'int8':
+            info['scales'] = compute_scales(blocks()).astype(float).tolist()
+        filename = quantized_filename(info)
+        if os.path.exists(os.path.join(self.data_path, filename)):
+            os.remove(os.path.join(self.data_path, filename))
+        for block in blocks():
+            self._append_file(filename, quantize(block, info)[0])
+        self.manifest['quantized'] = info
+        logger.info(f'[KnowledgeIndex] 知识库 {self.kb_id} 生成 {storage} 向量副本: {index.count} 行，耗时 {time.monotonic() - start_time:.2f}s')
+        return True
+
+    def commit(self, publish=False):
+        """原子替换所写数据代的 manifest，再切换知识库的数据代指针（暂存代在 publish 时才成为当前代），
+        随后回收不再被引用且没有读者的旧数据代"""
+        generation = self.manifest['generation']
+        if self.is_staging and publish:
+            # 切换后的版本号必须大于当前代，旧版本的检索缓存不会被命中
+            self.manifest['version'] = max(self.manifest['version'], self.published_version)
+        self.manifest['version'] += 1
+        self.manifest['updated'] = time.time()
+        _write_manifest(self.data_path, self.manifest)
+        if not self.is_staging or publish:
+            pointers = {'index_generation': generation}
+            if self.is_staging:
+                pointers['index_staging_generation'] = 0
+            self.published, self.published_version = generation, self.manifest['version']
+            self.staging = 0 if self.is_staging else self.staging
+            self.is_staging = False
+        else:
+            pointers = {'index_staging_generation': generation}
+            self.staging = generation
+        _set_pointers(self.kb_id, **pointers)
+        _collect_generations(self.kb_id, {self.published, self.staging})
+        # 已合并掉的关键词段
+        referenced = {f'{segment}.{suffix}.npy' for segment in self.manifest['keyword']['segments'] for suffix in SEGMENT_FILES}
+        if os.path.isdir(self.keyword_path):
+            for name in os.listdir(self.keyword_path):
+                if name not in referenced:
+                    os.remove(os.path.join(self.keyword_path, name))
+        # 被替换的紧凑向量副本
+        quantized = self.manifest.get('quantized')
+        for name in os.listdir(self.data_path):
+            if name.startswith('q_') and (not quantized or name != quantized_filename(quantized)):
+                os.remove(os.path.join(self.data_path, name))
+        # 被替换的近似索引
+        ann = self.manifest.get('ann')
+        referenced = set(ann_paths(self.ann_path, ann['name']).values()) if ann else set()
+        if os.path.isdir(self.ann_path):
+            for name in os.listdir(self.ann_path):
+                if os.path.join(self.ann_path, name) not in referenced:
+                    os.remove(os.path.join(self.ann_path, name))
+        invalidate_kb_results(self.kb_id)
+        return self.manifest['version']
+
+
+def replace_file_rows(kb_id, file_id, chunks, embeddings, metadatas, embedding, vector_store_config=None, text_artifact=None,
+                      dedup=True, stages=None):
+    """把一个文件的分段写入知识库索引（替换该文件原有的行）；vector_store_config 启用近似最近邻索引时按需构建或重建，
+    text_artifact 为分段所依据的提取文本产物，dedup 时把近似重复的分段链接到规范行，stages 为各处理阶段的配置指纹。
+    embeddings 为模型输出的向量，按 embedding 中的降维设置写入。向量化模型、维度或降维设置变化时写入暂存代，当前代继续服务查询，暂存代包含当前代的全部文件后切换"""
+    dim = next((len(vector) for vector in embeddings if vector is not None), 0)
+    with index_write_lock(kb_id):
+        writer = KnowledgeIndexWriter(kb_id)
+        staged = bool(dim) and not writer.matches(embedding, dim)
+        if staged:
+            published_files = list(writer.manifest['files'])
+            writer = KnowledgeIndexWriter(kb_id, staging=True)
+            if not writer.matches(embedding, dim):
+                logger.warning(f'[KnowledgeIndex] 知识库 {kb_id} 重建中的向量化模型或维度再次变化，重新开始重建')
+                writer.reset()
+            elif not writer.manifest['count']:
+                logger.info(f'[KnowledgeIndex] 知识库 {kb_id} 向量化模型或维度变化，开始在数据代 {writer.manifest["generation"]} 重建索引')
+        linked = writer.append_file(file_id, chunks, embeddings, metadatas, embedding, dedup)
+        if text_artifact and writer.has_file(file_id):
+            writer.set_text_artifact(file_id, text_artifact)
+        if stages and writer.has_file(file_id):
+            writer.set_stages(file_id, stages)
+        projection_fitted = writer.update_projection()
+        if writer.needs_compaction():
+            writer.compact()
+        ann_built = writer.update_ann(vector_store_config)
+        writer.update_quantization(vector_store_config)
+        missing = writer.missing_files(published_files) if staged else []
+        if staged and not missing:
+            logger.info(f'[KnowledgeIndex] 知识库 {kb_id} 重建完成，切换到数据代 {writer.manifest["generation"]}')
+        version = writer.commit(publish=not missing)
+    return {
+        'index_version': version,
+        'index_generation': writer.manifest['generation'],
+        'index_staged': staged,
+        'index_pending_files': len(missing),
+        'linked_chunks': linked,
+        'ann_built': ann_built,
+        'index_dim': writer.manifest['dim'],
+        'projection_fitted': projection_fitted,
+    }
+
+
+def remove_file_rows(kb_id, file_id):
+    """从知识库索引（当前代与暂存代）中移除一个文件；移除后暂存代若已包含其余全部文件则切换为当前代"""
+    if not os.path.isdir(index_dir(kb_id)):
+        return None
+    with index_write_lock(kb_id):
+        writer = KnowledgeIndexWriter(kb_id)
+        version = writer.manifest['version']
+        if writer.has_file(file_id):
+            writer.remove_file(file_id)
+            if writer.needs_compaction():
+                writer.compact()
+            version = writer.commit()
+        if writer.staging:
+            staging = KnowledgeIndexWriter(kb_id, staging=True)
+            publish = not staging.missing_files(list(writer.manifest['files']))
+            if staging.has_file(file_id) or publish:
+                staging.remove_file(file_id)
+                staging_version = staging.commit(publish=publish)
+                version = staging_version if publish else version
+        return version
+
+
+def _pointed_manifests(kb_id):
+    """暂存代与当前代的 [(数据代, manifest)]，暂存代在前"""
+    path = index_dir(kb_id)
+    manifests = []
+    for generation in _read_pointers(kb_id)[::-1]:
+        manifest = _read_manifest(_generation_dir(path, generation)) if generation else None
+        if manifest is not None:
+            manifests.append((generation, manifest))
+    return manifests
+
+
+def stored_file_stages(kb_id):
+    """各文件写入索引时的处理阶段指纹 {file_id: stages}；文件在暂存代中时以暂存代为准"""
+    stages = {}
+    for _, manifest in reversed(_pointed_manifests(kb_id)):
+        for file_id in manifest['files']:
+            if file_id in manifest.get('stages', {}):
+                stages[file_id] = manifest['stages'][file_id]
+    return stages
+
+
+def read_file_chunks(kb_id, file_id, split_stage):
+    """读出索引中按 split_stage（分段阶段指纹）写入的该文件分段，返回 (chunks, metadatas, 提取文本产物)；没有时返回 None"""
+    for generation, manifest in _pointed_manifests(kb_id):
+        file_key = str(file_id)
+        if file_key not in manifest['files'] or manifest.get('stages', {}).get(file_key, {}).get('split') != split_stage:
+            continue
+        try:
+            index = KnowledgeIndex.open(kb_id, generation)
+        except FileNotFoundError:
+            continue
+        start, end = index.manifest['files'].get(file_key, (0, 0))
+        if start == end:
+            continue
+        rows = index.chunks(range(start, end))
+        return [row['content'] for row in rows], [row['metadata'] for row in rows], manifest['text_artifacts'].get(file_key)
+    return None
+
+
+def apply_vector_store_config(kb_id, vector_store_config):
+    """只有向量存储配置变化时，按新配置构建或移除近似索引与紧凑副本，不重新处理文件；返回新的索引版本（没有变化时为 None）"""
+    if not os.path.isdir(index_dir(kb_id)):
+        return None
+    with index_write_lock(kb_id):
+        writer = KnowledgeIndexWriter(kb_id)
+        if not writer.manifest['count']:
+            return None
+        ann, quantized = writer.manifest.get('ann'), writer.manifest.get('quantized')
+        writer.update_ann(vector_store_config)
+        writer.update_quantization(vector_store_config)
+        if (writer.manifest.get('ann'), writer.manifest.get('quantized')) == (ann, quantized):
+            return None
+        return writer.commit()
+
+
+def index_references(kb_id):
+    """当前代与暂存代引用的文件 id、已导入的旧版目录标记 {file_id: stamp} 与提取文本产物键"""
+    files, sources, artifacts = set(), {}, set()
+    for _, manifest in _pointed_manifests(kb_id):
+        files.update(manifest['files'])
+        sources.update(manifest['sources'])
+        artifacts.update(manifest.get('text_artifacts', {}).values())
+    return files, sources, artifacts
+
+
+def _generation_names(path):
+    return {name for name in os.listdir(path) if name.startswith('gen_')} if os.path.isdir(path) else set()
+
+
+def compact_index(kb_id, file_ids, dead_ratio, dry_run=False):
+    """整理知识库索引（当前代与暂存代）：移除已不在知识库中的文件，已移除的行达到 dead_ratio 时压缩为稠密的新一代，
+    回收不再被引用且没有读者的旧数据代。返回 {'stale_files', 'dead_rows', 'compacted', 'generations', 'bytes'}；
+    dry_run 时不做修改，bytes 为按已移除行比例估算的可回收字节数"""
+    path = index_dir(kb_id)
+    result = {'stale_files': 0, 'dead_rows': 0, 'compacted': 0, 'generations': 0, 'bytes': 0}
+    if not os.path.isdir(path):
+        return result
+    file_ids = {str(file_id) for file_id in file_ids}
+    with index_write_lock(kb_id):
+        pointers = [generation for generation in _read_pointers(kb_id) if generation]
+        before_bytes, before_generations = dir_bytes(path), _generation_names(path)
+        if dry_run:
+            for name in before_generations - {f'gen_{generation}' for generation in pointers}:
+                result['generations'] += 1
+                result['bytes'] += dir_bytes(os.path.join(path, name))
+            for generation in pointers:
+                manifest = _read_manifest(_generation_dir(path, generation), (INDEX_FORMAT,) + UPGRADABLE_FORMATS)
+                if manifest is None or not manifest['count']:
+                    continue
+                live = sum(end - start for file_id, (start, end) in manifest['files'].items() if file_id in file_ids)
+                dead = manifest['count'] - live
+                result['stale_files'] += sum(1 for file_id in manifest['files'] if file_id not in file_ids)
+                result['dead_rows'] += dead
+                if dead and dead >= manifest['count'] * dead_ratio:
+                    result['compacted'] += 1
+                    result['bytes'] += dir_bytes(_generation_dir(path, generation)) * dead // manifest['count']
+            return result
+        published_files = []
+        for staging, generation in zip((False, True), _read_pointers(kb_id)):
+            if not generation:
+                continue
+            writer = KnowledgeIndexWriter(kb_id, staging=staging)
+            stale = [file_id for file_id in writer.manifest['files'] if file_id not in file_ids]
+            for file_id in stale:
+                writer.remove_file(file_id)
+            dead = writer.dead_rows()
+            fragmented = bool(dead) and dead >= writer.manifest['count'] * dead_ratio
+            if fragmented:
+                writer.compact()
+            result['stale_files'] += len(stale)
+            result['dead_rows'] += dead
+            result['compacted'] += int(fragmented)
+            if stale or fragmented or writer.upgraded:
+                writer.commit(publish=not staging or not writer.missing_files(published_files))
+            published_files = list(writer.manifest['files'])
+        _collect_generations(kb_id, set(_read_pointers(kb_id)))
+        result['generations'] = len(before_generations - _generation_names(path))
+        result['bytes'] = max(before_bytes - dir_bytes(path), 0)
+    return result
+
+
+def export_layout(index, file_ids):
+    """快照导出：file_ids 中的文件按行号排列的 [(file_id, start, end)]，以及这些行按导出后连续行号重排的规范行
+    （规范行不导出时，链接到它的第一行成为新的规范行）"""
+    file_ids = {str(file_id) for file_id in file_ids}
+    files = sorted(((file_id, start, end) for file_id, (start, end) in index.manifest['files'].items() if file_id in file_ids),
+                   key=lambda item: item[1])
+    row_map = _live_row_map({'count': index.count, 'files': {file_id: [start, end] for file_id, start, end in files}})
+    canonical = KnowledgeIndexWriter._compact_links(index, row_map)
+    return files, canonical[row_map >= 0]
+
+
+def import_index(kb_id, info, blocks, vector_store_config=None, matrix=None):
+    """快照导入：把 blocks 逐块产生的 (file_ids, chunks, metadatas, vectors, canonical, lsh) 写入新知识库的索引，
+    不调用向量化模型；info 为快照中的 embedding / projection / dedup / stages / text_artifacts（文件 id 已换成新 id），
+    matrix 为 PCA 投影矩阵。写完后按 vector_store_config 构建近似索引与紧凑副本并切换为当前代，返回索引版本"""
+    with index_write_lock(kb_id):
+        writer = KnowledgeIndexWriter(kb_id)
+        if writer.manifest['count']:
+            raise ValueError(f'知识库 {kb_id} 的索引不为空，不能导入快照')
+        writer.manifest.update(embedding=info['embedding'], projection=info.get('projection'), dedup=info['dedup'])
+        if matrix is not None:
+            write_projection(writer.data_path, matrix)
+        files = writer.manifest['files']
+        for file_ids, chunks, metadatas, vectors, canonical, lsh in blocks:
+            start = writer.manifest['count']
+            writer.append_rows(file_ids, chunks, metadatas, vectors, canonical, lsh)
+            # 同一文件的行在快照中连续
+            for file_id in np.unique(file_ids).tolist():
+                rows = np.flatnonzero(file_ids == file_id)
+                first, last = start + int(rows[0]), start + int(rows[-1]) + 1
+                files[str(file_id)] = [files.get(str(file_id), [first])[0], last]
+        writer.merge_keyword_segments()
+        for file_id, stages in info.get('stages', {}).items():
+            writer.set_stages(file_id, stages)
+        for file_id, key in info.get('text_artifacts', {}).items():
+            writer.set_text_artifact(file_id, key)
+        writer.update_ann(vector_store_config)
+        writer.update_quantization(vector_store_config)
+        return writer.commit()
+
+
+def collect_generations(kb_id):
+    """回收不再被引用且没有读者的旧数据代，返回 (删除的代, 仍被读者持有的代)"""
+    if not os.path.isdir(index_dir(kb_id)):
+        return [], []
+    with index_write_lock(kb_id):
+        published, staging = _read_pointers(kb_id)
+        return _collect_generations(kb_id, {published, staging})
+
+
+def drop_index(kb_id):
+    """删除知识库时删除整个索引目录"""
+    shutil.rmtree(index_dir(kb_id), ignore_errors=True)
+    with _open_lock:
+        _open_indexes.pop(kb_id, None)
+    invalidate_kb_results(kb_id)
@@ -0,0 +1,46 @@
+"""
+旧版按文件存放的 Chroma 向量目录：只读，用于导入知识库索引和清理
+"""
+import os
+
+from .registry import lazy_import
+
+# langchain Chroma 默认集合名
+CHROMA_COLLECTION_NAME = 'langchain'
+CHROMA_ROOT = './chroma_db'
+
+
+def chroma_path(file_id):
+    """单个知识文件的 Chroma 持久化目录"""
+    return f"{CHROMA_ROOT}/{file_id}"
+
+
+def chroma_file_ids():
+    """磁盘上存在 Chroma 目录的知识文件 id"""
+    if not os.path.isdir(CHROMA_ROOT):
+        return []
+    return sorted(int(name) for name in os.listdir(CHROMA_ROOT) if name.isdigit() and os.path.isdir(chroma_path(name)))
+
+
+def chroma_stamp(persist_directory):
+    """Chroma 目录的修改标记，用于判断是否需要重新同步到知识库索引；目录不存在时返回 None"""
+    sqlite_path = os.path.join(persist_directory, 'chroma.sqlite3')
+    if not os.path.exists(sqlite_path):
+        return None
+    stat = os.stat(sqlite_path)
+    return f'{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def read_chroma(persist_directory, page_size=5000):
+    """读出 Chroma 目录中的全部分段，按 chunk_index 排序，返回 (chunks, embeddings, metadatas)"""
+    client = lazy_import('chromadb').PersistentClient(path=persist_directory)
+    try:
+        collection = client.get_collection(CHROMA_COLLECTION_NAME)
+    except Exception:
+        return [], [], []
+    rows = []
+    for offset in range(0, collection.count(), page_size):
+        page = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+        rows.extend(zip(page['documents'], page['embeddings'], page['metadatas']))
+    rows.sort(key=lambda row: (row[2] or {}).get('chunk_index', 0))
+    return [row[0] for row in rows], [row[1] for row in rows], [row[2] or {} for row in rows]
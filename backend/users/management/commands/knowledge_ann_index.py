@@ -0,0 +1,98 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import KnowledgeBase
+from users.knowledge.ann_index import INDEX_TYPES, AnnConfigError, resolve_search_params, benchmark_recall
+from users.knowledge.quantization import STORAGE_TYPES
+from users.knowledge.vector_index import KnowledgeIndexWriter, get_index, index_write_lock
+
+
+class Command(BaseCommand):
+    help = ('构建或重建知识库的近似最近邻索引（IVF / IVF-PQ）与紧凑向量副本（float16 / int8），'
+            '并以 float32 精确检索为基准测量 recall@k 与延迟')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kb_id', type=int, help='知识库 id')
+        parser.add_argument('--index-type', choices=INDEX_TYPES, help='写入知识库 vector_store_config.index_type')
+        parser.add_argument('--nlist', type=int, help='写入 vector_store_config.nlist，0 表示按行数自动确定')
+        parser.add_argument('--pq-m', type=int, help='写入 vector_store_config.pq_m（需整除向量维度）')
+        parser.add_argument('--storage', choices=STORAGE_TYPES, help='写入 vector_store_config.storage')
+        parser.add_argument('--rebuild', action='store_true', help='按当前配置重新构建近似索引与紧凑副本')
+        parser.add_argument('--benchmark', action='store_true', help='测量 recall@k 与平均延迟')
+        parser.add_argument('--queries', type=int, default=200, help='基准测试的查询数（从索引中随机抽取分段向量）')
+        parser.add_argument('--top-k', type=int, default=10, help='基准测试的 k')
+        parser.add_argument('--nprobe', default='', help='基准测试的 nprobe 列表，逗号分隔，默认使用知识库配置')
+        parser.add_argument('--rerank', type=int, default=None, help='基准测试的精确重排倍数，默认使用知识库配置')
+
+    def handle(self, *args, **options):
+        try:
+            kb = KnowledgeBase.objects.get(id=options['kb_id'])
+        except KnowledgeBase.DoesNotExist:
+            raise CommandError(f"知识库 {options['kb_id']} 不存在")
+        config = dict(kb.embedding_config or {})
+        vector_store_config = dict(config.get('vector_store_config') or {})
+        overrides = {key: options[key] for key in ('index_type', 'nlist', 'pq_m', 'storage') if options[key] is not None}
+        if overrides:
+            vector_store_config.update(overrides)
+            config['vector_store_config'] = vector_store_config
+            kb.embedding_config = config
+            kb.save(update_fields=['embedding_config'])
+            self.stdout.write(f'已更新知识库 {kb.id} 的向量存储配置: {overrides}')
+        metric = vector_store_config.get('similarity_metric') or 'cosine'
+
+        if options['rebuild'] or overrides:
+            with index_write_lock(kb.id):
+                writer = KnowledgeIndexWriter(kb.id)
+                built = writer.update_ann(vector_store_config, force=True)
+                writer.update_quantization(vector_store_config, force=True)
+                version = writer.commit()
+            ann = writer.manifest.get('ann')
+            if built:
+                self.stdout.write(
+                    f"构建 {ann['type']} 完成: {ann['indexed']} 行，nlist={ann['nlist']}，pq_m={ann['pq_m']}，"
+                    f"耗时 {ann['build_seconds']}s，索引版本 {version}")
+            else:
+                self.stdout.write(f'知识库 {kb.id} 使用精确检索，已移除近似索引，索引版本 {version}')
+
+        index = get_index(kb.id)
+        if index is None or not index.live_count():
+            raise CommandError(f'知识库 {kb.id} 尚无索引数据')
+        memory = index.memory_bytes()
+        self.stdout.write(
+            f"知识库 {kb.id}: {index.live_count()} 行，{index.dim} 维，索引类型 {index.index_type}，存储精度 {index.storage}，"
+            f"float32 向量 {memory['float32'] / 1024 / 1024:.1f}MB，检索扫描 {memory['scan'] / 1024 / 1024:.1f}MB")
+        if index.projection:
+            projection = index.projection
+            explained = f"，保留方差 {projection['explained_variance']:.2%}" if projection['method'] == 'pca' else ''
+            self.stdout.write(f"降维方式 {projection['method']}: {projection['input_dim']} → {projection['dim']} 维{explained}")
+        dedup = index.dedup_stats()
+        self.stdout.write(
+            f"近似重复行 {dedup['duplicate_rows']}（{dedup['dedup_ratio']:.2%}），参与检索 {dedup['visible_rows']} 行")
+        if index.ann:
+            self.stdout.write(
+                f"近似索引 {index.ann.info['name']}: nlist={index.ann.nlist}，pq_m={index.ann.pq_m}，"
+                f"{index.ann.size_bytes() / 1024 / 1024:.1f}MB，未索引的新增行 {index.count - index.ann.rows_covered}")
+
+        if not options['benchmark']:
+            return
+        try:
+            params = resolve_search_params(vector_store_config)
+        except AnnConfigError as e:
+            raise CommandError(str(e))
+        variants = []
+        if index.quantized:
+            variants.append((index.storage, {'use_ann': False, 'rescore': False}))
+            variants.append((f'{index.storage}+rescore', {'use_ann': False, 'rescore': True}))
+        if index.ann:
+            rerank = options['rerank'] or params['rerank']
+            for nprobe in [int(n) for n in options['nprobe'].split(',') if n.strip()] or [params['nprobe']]:
+                variants.append((f'{index.ann.type} nprobe={nprobe}', {'nprobe': nprobe, 'rerank': rerank}))
+        if not variants:
+            raise CommandError('知识库使用 float32 精确检索，没有可对比的检索方式，请先使用 --index-type 或 --storage')
+        rng = np.random.default_rng(0)
+        live_rows = np.flatnonzero(index.live_mask())
+        sample = np.sort(rng.choice(live_rows, min(options['queries'], len(live_rows)), replace=False))
+        queries = np.asarray(index.vectors[sample])
+        self.stdout.write(f"recall@{options['top_k']}（{len(queries)} 个查询，度量 {metric}）:")
+        for result in benchmark_recall(index, queries, options['top_k'], metric, variants):
+            self.stdout.write(f"  {result['mode']:<24} recall={result['recall']:.4f}  平均 {result['avg_ms']:.2f}ms")
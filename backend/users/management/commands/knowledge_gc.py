@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from users.knowledge.compaction import collect_garbage
+
+
+def _mb(size):
+    return f'{size / 1024 / 1024:.1f}MB'
+
+
+class Command(BaseCommand):
+    help = '回收已删除或重新处理的知识文件留下的向量与派生数据，压缩碎片化的知识库索引，报告回收的空间与耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计可回收的空间，不做修改')
+        parser.add_argument('--kb', type=int, action='append', default=[], metavar='KB_ID',
+                            help='只整理指定知识库的索引，可重复指定；不扫描旧版目录与提取文本产物')
+        parser.add_argument('--dead-ratio', type=float, default=None, help='已移除的行达到该比例时压缩索引，0 表示有已移除的行就压缩')
+
+    def handle(self, *args, **options):
+        report = collect_garbage(dry_run=options['dry_run'], kb_ids=options['kb'], dead_ratio=options['dead_ratio'])
+        indexes = report['indexes']
+        self.stdout.write(
+            f"知识库索引: 移除已删除文件 {indexes['stale_files']} 个，已移除的行 {indexes['dead_rows']}，"
+            f"压缩 {indexes['compacted']} 个，回收数据代 {indexes['generations']} 个，{_mb(indexes['bytes'])}")
+        if 'orphan_indexes' in report:
+            orphan = report['orphan_indexes']
+            self.stdout.write(f"已删除知识库的索引目录: {orphan['removed']} 个，{_mb(orphan['bytes'])}")
+            chroma = report['chroma']
+            self.stdout.write(
+                f"旧版 Chroma 目录: 文件已删除 {chroma['orphaned']} 个，已导入索引 {chroma['imported']} 个，{_mb(chroma['bytes'])}")
+            artifacts = report['text_artifacts']
+            self.stdout.write(f"提取文本产物: {artifacts['removed']} 个文件，{_mb(artifacts['bytes'])}")
+        action = '可回收' if report['dry_run'] else '共回收'
+        self.stdout.write(f"{action} {_mb(report['bytes_reclaimed'])}，耗时 {report['seconds']}s")
@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# 在全新的解释器中测量，避免当前进程已导入的模块影响结果
+PROFILE_SCRIPT = '''
+import json, os, resource, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+__import__(sys.argv[1])
+result = {'boot_seconds': time.perf_counter() - start, 'boot_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+if sys.argv[2] == '1':
+    from users.knowledge.registry import extractor_registry, embedding_backend_registry, import_timings
+    result['extractors'] = extractor_registry.load_all()
+    result['embedding_backends'] = embedding_backend_registry.load_all()
+    result['plugin_imports'] = import_timings()
+    result['plugins_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(result))
+'''
+
+
+class Command(BaseCommand):
+    help = '测量 Django 冷启动的导入耗时与内存，以及各知识库提取器、向量化后端首次使用时的导入耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default=settings.ROOT_URLCONF, help='启动后导入的模块，默认为 ROOT_URLCONF')
+        parser.add_argument('--plugins', action='store_true', help='同时导入全部已注册的提取器和向量化后端')
+        parser.add_argument('--top', type=int, default=15, help='列出累计导入耗时最长的模块数')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'account_system.settings'))
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT, options['module'], '1' if options['plugins'] else '0'],
+            capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+        )
+        if proc.returncode != 0:
+            self.stderr.write(proc.stderr[-2000:])
+            return
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        self.stdout.write(f"启动并导入 {options['module']}: {result['boot_seconds']:.2f}s，峰值内存 {result['boot_rss_mb']:.0f}MB")
+
+        # -X importtime 输出格式: "import time: self [us] | cumulative | imported package"
+        slowest = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            slowest.append((int(cumulative), name.strip()))
+        slowest.sort(reverse=True)
+        self.stdout.write(f"累计导入耗时最长的 {options['top']} 个模块:")
+        for cumulative, name in slowest[:options['top']]:
+            self.stdout.write(f'  {cumulative / 1e6:8.3f}s  {name}')
+
+        if options['plugins']:
+            for kind in ('extractors', 'embedding_backends'):
+                failed = {name: error for name, error in result[kind].items() if error}
+                self.stdout.write(f'{kind}: 共 {len(result[kind])} 个，导入失败 {len(failed)} 个')
+                for name, error in failed.items():
+                    self.stdout.write(f'  {name}: {error}')
+            self.stdout.write('插件首次导入耗时:')
+            for name, seconds in result['plugin_imports'].items():
+                self.stdout.write(f'  {seconds:8.3f}s  {name}')
+            self.stdout.write(f"导入全部插件后峰值内存 {result['plugins_rss_mb']:.0f}MB")
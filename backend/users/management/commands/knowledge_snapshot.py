@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.knowledge.snapshot import SnapshotError, export_knowledge_base, import_knowledge_base
+from users.models import KnowledgeBase
+
+
+class Command(BaseCommand):
+    help = '导出知识库快照（配置、文件记录、分段与向量），或从快照创建知识库（不调用向量化模型），用于迁移节点与故障恢复'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['export', 'import'])
+        parser.add_argument('path', help='快照文件路径')
+        parser.add_argument('--kb', type=int, help='导出的知识库 id')
+        parser.add_argument('--no-files', action='store_true', help='导出时不包含上传的原始文件')
+        parser.add_argument('--name', help='导入后的知识库名称，默认沿用快照中的名称')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'export':
+            if not options['kb']:
+                raise CommandError('导出需要指定 --kb')
+            try:
+                kb = KnowledgeBase.objects.get(id=options['kb'])
+            except KnowledgeBase.DoesNotExist:
+                raise CommandError(f"知识库 {options['kb']} 不存在")
+            result = export_knowledge_base(kb, options['path'], include_files=False if options['no_files'] else None)
+            self.stdout.write(
+                f"已导出知识库 {kb.id}（{kb.name}）: 文件 {result['files']} 个，{result['rows']} 行，"
+                f"{result['bytes'] / 1024 / 1024:.1f}MB，耗时 {result['seconds']}s")
+            return
+        try:
+            kb, result = import_knowledge_base(options['path'], name=options['name'])
+        except SnapshotError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"已导入知识库 {kb.id}（{kb.name}）: 文件 {result['files']} 个，{result['rows']} 行，"
+            f"提取文本产物 {result['text_artifacts']} 个，耗时 {result['seconds']}s")
@@ -0,0 +1,24 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from users.knowledge.jobs import KnowledgeWorker
+
+
+class Command(BaseCommand):
+    help = '启动知识库文件处理 worker，从数据库队列中领取并执行处理任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None, help='同时处理的任务数')
+        parser.add_argument('--poll-interval', type=float, default=None, help='队列为空时的轮询间隔（秒）')
+        parser.add_argument('--once', action='store_true', help='处理完当前队列后退出')
+        parser.add_argument('--preload', action='append', default=[], metavar='MODEL', help='启动时预加载的本地向量化模型，可重复指定')
+
+    def handle(self, *args, **options):
+        worker = KnowledgeWorker(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+        # 收到退出信号后不再领取新任务，等待进行中的任务结束
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        signal.signal(signal.SIGINT, lambda *_: worker.stop())
+        self.stdout.write(f'知识库 worker {worker.name} 启动，并发数 {worker.concurrency}')
+        worker.run(once=options['once'], preload_models=options['preload'])
+        self.stdout.write('知识库 worker 已退出')
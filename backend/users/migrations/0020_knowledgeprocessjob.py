@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_knowledgebase_embedding_config'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeProcessJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='处理参数')),
+                ('status', models.CharField(choices=[('queued', '排队中'), ('running', '处理中'), ('done', '已完成'), ('failed', '失败'), ('cancelled', '已取消')], db_index=True, default='queued', max_length=16, verbose_name='状态')),
+                ('stage', models.CharField(blank=True, default='', max_length=16, verbose_name='当前阶段')),
+                ('attempts', models.IntegerField(default=0, verbose_name='已执行次数')),
+                ('max_attempts', models.IntegerField(default=3, verbose_name='最大执行次数')),
+                ('cancel_requested', models.BooleanField(default=False, verbose_name='请求取消')),
+                ('worker', models.CharField(blank=True, default='', max_length=64, verbose_name='执行进程')),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='处理结果')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='错误信息')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('run_after', models.DateTimeField(blank=True, null=True, verbose_name='最早执行时间')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='开始时间')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='结束时间')),
+                ('heartbeat', models.DateTimeField(blank=True, null=True, verbose_name='心跳时间')),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='process_jobs', to='users.knowledgefile', verbose_name='知识文件')),
+                ('kb', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='process_jobs', to='users.knowledgebase', verbose_name='知识库')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='提交用户')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_knowledgeprocessjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgefile',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64, verbose_name='文件内容哈希'),
+        ),
+        migrations.AddField(
+            model_name='knowledgefile',
+            name='text_artifact',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='提取文本产物'),
+        ),
+    ]
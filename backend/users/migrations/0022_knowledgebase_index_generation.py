@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0021_knowledgefile_text_artifact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='index_generation',
+            field=models.IntegerField(default=0, verbose_name='当前索引数据代'),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='index_staging_generation',
+            field=models.IntegerField(default=0, verbose_name='重建中的索引数据代'),
+        ),
+    ]
@@ -82,6 +82,8 @@ class KnowledgeBase(models.Model):
     description = models.TextField(blank=True, null=True, verbose_name='描述')
     created = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     embedding_config = models.JSONField(default=dict, blank=True, null=True, verbose_name='分段与向量化配置')
+    index_generation = models.IntegerField(default=0, verbose_name='当前索引数据代')
+    index_staging_generation = models.IntegerField(default=0, verbose_name='重建中的索引数据代')
     def __str__(self):
         return self.name
 
@@ -91,9 +93,43 @@ class KnowledgeFile(models.Model):
     file = models.FileField(upload_to='knowledge/')
     created = models.DateTimeField(auto_now_add=True, verbose_name='上传时间')
     char_count = models.IntegerField(default=0, verbose_name='字符数')
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True, verbose_name='文件内容哈希')
+    text_artifact = models.CharField(max_length=64, blank=True, default='', verbose_name='提取文本产物')
     def __str__(self):
         return self.filename
 
+class KnowledgeProcessJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', '排队中'),
+        ('running', '处理中'),
+        ('done', '已完成'),
+        ('failed', '失败'),
+        ('cancelled', '已取消'),
+    ]
+    kb = models.ForeignKey(KnowledgeBase, on_delete=models.CASCADE, related_name='process_jobs', verbose_name='知识库')
+    file = models.ForeignKey(KnowledgeFile, on_delete=models.CASCADE, related_name='process_jobs', verbose_name='知识文件')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='提交用户')
+    params = models.JSONField(default=dict, blank=True, verbose_name='处理参数')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='queued', db_index=True, verbose_name='状态')
+    stage = models.CharField(max_length=16, blank=True, default='', verbose_name='当前阶段')
+    attempts = models.IntegerField(default=0, verbose_name='已执行次数')
+    max_attempts = models.IntegerField(default=3, verbose_name='最大执行次数')
+    cancel_requested = models.BooleanField(default=False, verbose_name='请求取消')
+    worker = models.CharField(max_length=64, blank=True, default='', verbose_name='执行进程')
+    result = models.JSONField(default=dict, blank=True, verbose_name='处理结果')
+    error = models.TextField(blank=True, null=True, verbose_name='错误信息')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    run_after = models.DateTimeField(null=True, blank=True, verbose_name='最早执行时间')
+    started = models.DateTimeField(null=True, blank=True, verbose_name='开始时间')
+    finished = models.DateTimeField(null=True, blank=True, verbose_name='结束时间')
+    heartbeat = models.DateTimeField(null=True, blank=True, verbose_name='心跳时间')
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return f'{self.file} {self.get_status_display()}'
+
 class Space(models.Model):
     name = models.CharField(max_length=128, unique=True, verbose_name='空间名称')
     created = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
@@ -88,6 +88,154 @@ CACHE_CONFIG = {
     'CULL_FREQUENCY': 3
 }
 
+# 知识库处理配置
+KNOWLEDGE_PROCESS_CONFIG = {
+    'EMBED_BATCH_SIZE': 64,  # 每批送入向量化模型的分段数
+    'MAX_EMBED_BATCH_SIZE': 2048,
+    'TOKEN_ENCODING': 'cl100k_base',  # Token分割使用的编码
+    'EMBED_WORKERS': 0,  # 本地模型并行向量化的进程数，0 表示按 CPU 核数自动设置，1 表示不并行
+    'EMBED_THREADS_PER_WORKER': 1,  # 每个向量化进程的计算线程数
+    'PARALLEL_MIN_CHUNKS': 256  # 分段数达到该值才启用多进程
+}
+
+# 知识库文件提取配置
+KNOWLEDGE_EXTRACT_CONFIG = {
+    'PDF_WORKERS': 0,  # PDF 并行提取进程数，0 表示按 CPU 核数自动设置
+    'PDF_PAGES_PER_TASK': 16,  # 每个提取任务处理的页数
+    'PDF_PARALLEL_MIN_PAGES': 64,  # 页数达到该值才启用多进程提取
+    'SHEET_ROWS_PER_SEGMENT': 50,  # 表格每个文本片段包含的行数
+    'ARTIFACT_BLOCK_CHARS': 65536,  # 提取文本产物每个压缩块的字符数
+    'ARTIFACT_COMPRESS_LEVEL': 6  # 提取文本产物的 zlib 压缩级别
+}
+
+# 本地向量化模型池配置
+KNOWLEDGE_EMBEDDING_POOL_CONFIG = {
+    'MEMORY_BUDGET_MB': 2048,  # 常驻模型的内存预算，超出后按最近最少使用淘汰
+    'DEVICE': 'cpu',
+    'PRELOAD_MODELS': []  # worker 启动时预加载的本地模型名
+}
+
+# 分段向量缓存配置
+KNOWLEDGE_EMBEDDING_CACHE_CONFIG = {
+    'ENABLED': True,
+    'MAX_MB': 2048  # 缓存文件容量上限，超出后按最近使用时间淘汰
+}
+
+# 知识库检索缓存配置（进程内）
+KNOWLEDGE_RETRIEVAL_CACHE_CONFIG = {
+    'ENABLED': True,
+    'QUERY_VECTOR_TTL': 3600,  # 查询向量缓存有效期（秒）
+    'QUERY_VECTOR_MAX_ENTRIES': 20000,
+    'QUERY_VECTOR_MAX_MB': 64,
+    'RESULT_TTL': 300,  # 检索结果缓存有效期（秒）
+    'RESULT_MAX_ENTRIES': 5000,
+    'RESULT_MAX_MB': 128
+}
+
+# 知识库后台处理任务配置
+KNOWLEDGE_JOB_CONFIG = {
+    'WORKER_CONCURRENCY': 2,  # 每个 worker 进程同时处理的任务数
+    'KB_MAX_CONCURRENT_JOBS': 2,  # 同一知识库同时处理的任务上限
+    'MAX_ATTEMPTS': 3,
+    'RETRY_BACKOFF': 30,  # 重试间隔（秒），按执行次数线性递增
+    'POLL_INTERVAL': 2,  # 空闲时轮询间隔（秒）
+    'STALE_SECONDS': 600,  # 心跳超时后视为 worker 异常退出，任务重新排队
+    'HEARTBEAT_SECONDS': 30,  # 运行中的任务由后台线程按该间隔写心跳，须远小于 STALE_SECONDS
+    'INDEX_SYNC_INTERVAL': 300  # worker 空闲时整理知识库索引（导入旧版目录、移除已删除文件）的间隔（秒），0 表示只在启动时执行
+}
+
+# 知识库检索配置
+KNOWLEDGE_SEARCH_CONFIG = {
+    'DEFAULT_TOP_K': 4,  # retrieval_config 未设置 top_k 时的返回数量
+    'MAX_TOP_K': 100,  # 单次检索最多返回的分段数
+    'SCAN_BLOCK_ROWS': 65536,  # 暴力检索时每次计算的行数，控制临时内存
+    'MMR_FETCH_FACTOR': 4,  # MMR 检索先取 top_k 的多少倍作为候选
+    'MMR_LAMBDA': 0.5,  # MMR 中相关性与多样性的权衡系数
+    'PARENT_FETCH_FACTOR': 3,  # 父子分段检索先取 top_k 的多少倍子块，合并到父块后返回 top_k 个
+    'HYBRID_FETCH_FACTOR': 4,  # 混合检索中向量与关键词各取 top_k 的多少倍作为候选
+    'HYBRID_KEYWORD_WEIGHT': 0.5,  # 混合检索中关键词得分的权重，可由 retrieval_config.keyword_weight 覆盖
+    'ANN_NPROBE': 16,  # 近似检索访问的倒排列表数，可由 vector_store_config.nprobe 覆盖
+    'ANN_RERANK_FACTOR': 10,  # IVF-PQ 估算后用原始向量精确重排 top_k 的多少倍候选，可由 vector_store_config.rerank 覆盖
+    'COMPACT_SCAN_BLOCK_ROWS': 4096,  # 扫描 float16 / int8 副本时每块的行数
+    'QUANTIZED_RESCORE_FACTOR': 4,  # 在紧凑副本上取 top_k 的多少倍候选，再用 float32 向量重排
+    'PREFILTER_MAX_RATIO': 0.2,  # 元数据过滤后的行数不超过总行数的该比例时，只计算筛选出的行，不再访问近似索引或扫描全部行
+    'BM25_K1': 1.2,
+    'BM25_B': 0.75
+}
+
+# 知识库向量索引配置
+KNOWLEDGE_INDEX_CONFIG = {
+    'COMPACT_DEAD_RATIO': 0.3,  # 已移除的行超过该比例时压缩索引
+    'COMPACT_MIN_DEAD_ROWS': 1000,  # 已移除的行数达到该值才考虑压缩
+    'KEYWORD_MAX_SEGMENTS': 8,  # 关键词倒排表的段数上限，超过后合并为一个段
+    'ANN_MIN_ROWS': 50000,  # 存活行数达到该值才构建近似最近邻索引，更小的知识库精确扫描已足够快
+    'ANN_REBUILD_RATIO': 0.2,  # 构建后追加的行超过已索引行的该比例时重建
+    'ANN_MAX_NLIST': 65536,  # 自动确定倒排列表数时的上限
+    'ANN_PQ_SUBVECTOR_DIM': 8,  # 自动确定 pq_m 时每个子空间的维数
+    'ANN_TRAIN_PER_LIST': 32,  # k-means 训练样本数相对列表数的倍数
+    'ANN_MAX_TRAIN_ROWS': 100000,  # k-means 训练样本数上限
+    'ANN_KMEANS_ITERS': 10,
+    'ANN_SEED': 20240601,
+    'INT8_REQUANTIZE_CLIP_RATIO': 0.01,  # int8 副本中超出缩放范围被截断的行超过该比例时重新计算缩放系数
+    'READER_IDLE_SECONDS': 60  # 进程内已打开的索引超过该时间未使用时关闭，释放数据代的读者锁，旧代才能被回收
+}
+
+# 知识库分段预览配置（只提取、清洗、分段，不向量化）
+KNOWLEDGE_PREVIEW_CONFIG = {
+    'SAMPLE_CHARS': 20000,  # 默认抽样的字符数
+    'MAX_SAMPLE_CHARS': 200000,  # 抽样字符数上限，保证预览在亚秒级返回
+    'SAMPLE_WINDOWS': 5,  # spread 抽样时在全文均匀选取的窗口数
+    'MAX_CHUNKS': 50,  # 返回内容的分段数，统计基于全部抽样分段
+    'HISTOGRAM_BINS': 10,
+    # 每百万 token 的向量化价格（美元），未列出的 OpenAI 模型按 DEFAULT 估算，本地模型不计费
+    'EMBEDDING_PRICES': {
+        'text-embedding-3-small': 0.02,
+        'text-embedding-3-large': 0.13,
+        'text-embedding-ada-002': 0.10,
+        'DEFAULT': 0.10
+    }
+}
+
+# 知识库分段近似去重配置（MinHash / LSH，按知识库）
+KNOWLEDGE_DEDUP_CONFIG = {
+    'ENABLED': True,  # embedding_config.dedup_config.enabled 未设置时是否去重
+    'NUM_PERM': 64,  # MinHash 签名长度
+    'BANDS': 16,  # LSH 分带数，每带 NUM_PERM / BANDS 个签名值；相似度约 (1/BANDS)^(BANDS/NUM_PERM) 以上的分段成为候选
+    'SHINGLE_CHARS': 5,  # 字符 k-gram 长度（去掉空白后）
+    'THRESHOLD': 0.85,  # k-gram 集合 Jaccard 相似度达到该值视为重复
+    'MAX_CANDIDATES': 8,  # 每个分段最多确认的候选数
+    'SEED': 20240701
+}
+
+# 知识库存储回收配置（knowledge_gc 命令与 worker 定期回收）
+KNOWLEDGE_GC_CONFIG = {
+    'INTERVAL_SECONDS': 24 * 3600,  # worker 空闲时自动回收的间隔，0 表示只通过命令执行
+    'GRACE_SECONDS': 3600,  # 最近修改过的提取文本产物与临时文件不回收，避免与进行中的处理冲突
+    'COMPACT_DEAD_RATIO': 0.05  # 已移除的行达到该比例时压缩索引（写入时的自动压缩阈值见 KNOWLEDGE_INDEX_CONFIG）
+}
+
+# 知识库快照导出/导入配置
+KNOWLEDGE_SNAPSHOT_CONFIG = {
+    'BLOCK_ROWS': 16384,  # 导出与导入时每次读写的行数，控制内存占用
+    'COMPRESS_LEVEL': 1,  # 分段文本的 deflate 压缩级别；向量以原始二进制存储，不压缩
+    'INCLUDE_FILES': True  # 是否默认包含上传的原始文件（导入后可以继续预览、重新处理）
+}
+
+# 向量降维配置：embedding_config.dimension 小于模型输出维度时按知识库降维存储，查询向量做同样的变换
+KNOWLEDGE_REDUCTION_CONFIG = {
+    # 训练时支持截断前缀维度（Matryoshka）的模型，直接截断并重新归一化；其他模型按知识库拟合 PCA
+    'MATRYOSHKA_MODELS': [
+        'text-embedding-3-small',
+        'text-embedding-3-large',
+        'nomic-ai/nomic-embed-text-v1.5',
+        'mixedbread-ai/mxbai-embed-large-v1',
+    ],
+    'MIN_DIMENSION': 8,
+    'PCA_MIN_ROWS': 1000,  # 索引行数达到该值（且不少于目标维度的 2 倍）后拟合 PCA，之前按模型原始维度存储
+    'PCA_FIT_ROWS': 20000,  # 拟合 PCA 时最多抽取的行数
+    'SEED': 20240801
+}
+
 # 日志配置
 LOG_CONFIG = {
     'MAX_BYTES': 10 * 1024 * 1024,  # 10MB
@@ -146,6 +294,19 @@ __all__ = [
     'API_CONFIG',
     'TOKEN_LIMITS',
     'CACHE_CONFIG',
+    'KNOWLEDGE_PROCESS_CONFIG',
+    'KNOWLEDGE_EXTRACT_CONFIG',
+    'KNOWLEDGE_EMBEDDING_POOL_CONFIG',
+    'KNOWLEDGE_EMBEDDING_CACHE_CONFIG',
+    'KNOWLEDGE_RETRIEVAL_CACHE_CONFIG',
+    'KNOWLEDGE_JOB_CONFIG',
+    'KNOWLEDGE_SEARCH_CONFIG',
+    'KNOWLEDGE_INDEX_CONFIG',
+    'KNOWLEDGE_PREVIEW_CONFIG',
+    'KNOWLEDGE_DEDUP_CONFIG',
+    'KNOWLEDGE_REDUCTION_CONFIG',
+    'KNOWLEDGE_GC_CONFIG',
+    'KNOWLEDGE_SNAPSHOT_CONFIG',
     'LOG_CONFIG',
     'SECURITY_CONFIG',
     'ERROR_CODES',
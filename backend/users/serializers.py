@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import User, UserGroup, Agent, ModelApi, TokenUsage, KnowledgeFile, KnowledgeBase, SpaceMember, Space, SpaceDocument
+from .models import User, UserGroup, Agent, ModelApi, TokenUsage, KnowledgeFile, KnowledgeBase, KnowledgeProcessJob, SpaceMember, Space, SpaceDocument
 from django.db import models
 
 class UserGroupSerializer(serializers.ModelSerializer):
@@ -88,7 +88,9 @@ class KnowledgeBaseSerializer(serializers.ModelSerializer):
     embedding_config = serializers.JSONField(required=False)
     class Meta:
         model = KnowledgeBase
-        fields = ['id', 'name', 'type', 'description', 'created', 'files_count', 'char_count', 'embedding_config']
+        fields = ['id', 'name', 'type', 'description', 'created', 'files_count', 'char_count', 'embedding_config',
+                  'index_generation', 'index_staging_generation']
+        read_only_fields = ['index_generation', 'index_staging_generation']
     def get_char_count(self, obj):
         return sum([getattr(f, 'char_count', 0) for f in obj.files.all()])
     def create(self, validated_data):
@@ -96,6 +98,16 @@ class KnowledgeBaseSerializer(serializers.ModelSerializer):
             validated_data['type'] = 'doc'
         return super().create(validated_data)
 
+class KnowledgeProcessJobSerializer(serializers.ModelSerializer):
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    filename = serializers.CharField(source='file.filename', read_only=True)
+
+    class Meta:
+        model = KnowledgeProcessJob
+        fields = ['id', 'kb', 'file', 'filename', 'status', 'status_display', 'stage', 'attempts', 'max_attempts',
+                  'cancel_requested', 'result', 'error', 'created', 'started', 'finished']
+        read_only_fields = fields
+
 class SpaceMemberSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     class Meta:
@@ -0,0 +1,97 @@
+"""知识库测试的公共部分：每个用例使用独立的媒体目录与知识库数据目录，向量化模型换成记录调用的假模型"""
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from ..knowledge import embedding_cache, pipeline, retrieval_cache, search, vector_store
+from ..knowledge.vector_index import release_idle_indexes
+from ..models import KnowledgeBase, KnowledgeFile, User
+
+PARAMS = {
+    'splitter_config': {'chunk_size': 100, 'chunk_overlap': 0},
+    'embedding_config': {'type': 'local', 'model': 'fake-model'},
+}
+
+
+class FakeEmbeddings:
+    """按字符二元组计数得到的确定性向量；texts 记录每次送入模型的分段"""
+    dim = 32
+
+    def __init__(self):
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        vector = np.zeros(self.dim)
+        for a, b in zip(text, text[1:]):
+            vector[(ord(a) * 31 + ord(b)) % self.dim] += 1
+        return (vector / (np.linalg.norm(vector) or 1)).tolist()
+
+
+class KnowledgeTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        settings = override_settings(
+            MEDIA_ROOT=f'{self.tmp}/media',
+            KNOWLEDGE_DATA_ROOT=f'{self.tmp}/data',
+            # 开发配置下工具栏对所有请求显示，接口测试中关闭
+            DEBUG_TOOLBAR_CONFIG={'SHOW_TOOLBAR_CALLBACK': lambda request: False, 'IS_RUNNING_TESTS': False},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # 旧版 Chroma 目录相对于工作目录，存储回收会删除不属于任何知识文件的目录
+        patcher = mock.patch.object(vector_store, 'CHROMA_ROOT', f'{self.tmp}/chroma_db')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.embedder = FakeEmbeddings()
+        build = lambda config, user=None: (self.embedder, 'fake-model', 'fake')
+        for module in (pipeline, search):
+            patcher = mock.patch.object(module, 'build_embedder', build)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        embedding_cache._cache = None
+        # 结果缓存按知识库 id 与索引版本区分，各用例的知识库 id 可能相同
+        retrieval_cache.query_vector_cache.clear()
+        retrieval_cache.result_cache.clear()
+
+    def tearDown(self):
+        # 进程内缓存的索引与向量缓存指向本用例的临时目录
+        release_idle_indexes(0)
+        embedding_cache._cache = None
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def api_client(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('tester', password='tester'))
+        return client
+
+    def create_kb(self, name='kb', params=None):
+        return KnowledgeBase.objects.create(name=name, type='doc', embedding_config=params or PARAMS)
+
+    def add_file(self, kb, text, filename='doc.txt'):
+        kf = KnowledgeFile(kb=kb, filename=filename)
+        kf.file.save(filename, ContentFile(text.encode('utf-8')), save=True)
+        return kf
+
+    def process(self, kf, params=None):
+        return pipeline.process_knowledge_file(kf, params or PARAMS)
+
+
+def paragraphs(count, seed=0):
+    """count 段互不相同、各 60 字的文本，按 PARAMS 分段时每段恰好是一个分段"""
+    chars = list('知识库索引向量检索模型文件分段提取清洗去重压缩导入导出任务队列心跳重试缓存')
+    rng = np.random.default_rng(seed)
+    return [f'第{seed:02d}-{i:03d}段' + ''.join(rng.choice(chars, 52)) for i in range(count)]
+
+
+def document(texts):
+    return '\n\n'.join(texts)
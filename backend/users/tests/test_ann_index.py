@@ -0,0 +1,65 @@
+from unittest import mock
+
+import numpy as np
+
+from ..knowledge.ann_index import benchmark_recall
+from ..knowledge.search import search_knowledge_base
+from ..knowledge.vector_index import get_index, replace_file_rows
+from ..rules import KNOWLEDGE_INDEX_CONFIG
+from .base import KnowledgeTestCase
+
+MODEL = {'type': 'local', 'model': 'fake-model', 'normalize': True}
+
+
+def clustered(count, dim, clusters, rng):
+    """围绕若干中心分布的向量，近邻检索结果不是平凡的"""
+    centers = rng.normal(size=(clusters, dim))
+    labels = rng.integers(clusters, size=count)
+    return (centers[labels] + 1.0 * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+class AnnIndexTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        self.kf = self.add_file(self.kb, 'x')
+        self.rng = np.random.default_rng(0)
+        self.vectors = clustered(2000, 32, 40, self.rng)
+        self.queries = self.vectors[self.rng.choice(len(self.vectors), 20, replace=False)] \
+            + 0.1 * self.rng.normal(size=(20, 32)).astype(np.float32)
+
+    def write(self, vector_store_config):
+        count = len(self.vectors)
+        return replace_file_rows(
+            self.kb.id, self.kf.id, [f'row {i}' for i in range(count)], list(self.vectors),
+            [{'chunk_index': i} for i in range(count)], MODEL, vector_store_config, dedup=False)
+
+    def recall(self, vector_store_config, **params):
+        with mock.patch.dict(KNOWLEDGE_INDEX_CONFIG, ANN_MIN_ROWS=100):
+            self.assertTrue(self.write(vector_store_config)['ann_built'])
+        index = get_index(self.kb.id)
+        self.assertEqual(index.index_type, vector_store_config['index_type'])
+        results = benchmark_recall(index, self.queries, 10, 'cosine', [('ann', params)])
+        return results[1]['recall']
+
+    def test_ivf_flat_recall(self):
+        self.assertGreaterEqual(self.recall({'index_type': 'ivf_flat', 'nlist': 32}, nprobe=8), 0.95)
+
+    def test_ivf_pq_recall(self):
+        config = {'index_type': 'ivf_pq', 'nlist': 32, 'pq_m': 4}
+        self.assertGreaterEqual(self.recall(config, nprobe=8, rerank=10), 0.95)
+
+    def test_small_knowledge_base_uses_flat_scan(self):
+        config = {'index_type': 'ivf_flat', 'nlist': 32}
+        self.assertFalse(self.write(config)['ann_built'])
+        index = get_index(self.kb.id)
+        self.assertIsNone(index.ann)
+        self.kb.refresh_from_db()
+        self.kb.embedding_config = dict(self.kb.embedding_config, vector_store_config=config)
+        self.kb.save()
+        response = search_knowledge_base(self.kb, 'row 1', top_k=5)
+        self.assertEqual(response['index_type'], 'flat')
+        query = index.project(self.embedder.embed_query('row 1'))
+        rows, _ = index.search(query, 5, exact=True)
+        self.assertEqual([result['content'] for result in response['results']], [f'row {row}' for row in rows])
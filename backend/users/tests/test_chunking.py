@@ -0,0 +1,70 @@
+from django.test import SimpleTestCase
+
+from ..knowledge.embedding import embed_in_batches, resolve_batch_size
+from ..knowledge.splitter import build_text_splitter, split_text
+from ..rules import KNOWLEDGE_PROCESS_CONFIG
+
+
+class RecordingEmbeddings:
+    """记录每次调用送入的分段数"""
+
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+
+class SplitterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.paragraphs = [f'第{i}段。' + '知识库分段测试文本' * 6 for i in range(6)]
+        self.text = '\n\n'.join(self.paragraphs)
+
+    def test_recursive_prefers_paragraphs(self):
+        chunks = split_text(self.text, {'chunk_size': 60, 'chunk_overlap': 0})
+        self.assertEqual(chunks, self.paragraphs)
+        chunks = split_text(self.text, {'chunk_size': 120, 'chunk_overlap': 0})
+        self.assertEqual(chunks, ['\n\n'.join(self.paragraphs[i:i + 2]) for i in range(0, 6, 2)])
+
+    def test_recursive_splits_long_text_with_overlap(self):
+        text = ''.join(chr(0x4e00 + i) for i in range(250))
+        chunks = split_text(text, {'chunk_size': 100, 'chunk_overlap': 20})
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertEqual(previous[-20:], chunk[:20])
+        self.assertEqual(chunks[0] + ''.join(chunk[20:] for chunk in chunks[1:]), text)
+
+    def test_character_uses_first_separator(self):
+        chunks = split_text(self.text, {'text_splitter': 'character', 'chunk_size': 60, 'chunk_overlap': 0})
+        self.assertEqual(chunks, self.paragraphs)
+        chunks = split_text('甲。乙乙。丙丙丙', {'text_splitter': 'character', 'chunk_size': 3, 'chunk_overlap': 0,
+                                                 'separators': ['。']})
+        self.assertEqual(chunks, ['甲', '乙乙', '丙丙丙'])
+
+    def test_invalid_config(self):
+        for config in ({'text_splitter': 'sentence'}, {'chunk_size': -1}, {'chunk_size': 100, 'chunk_overlap': 100},
+                       {'chunk_size': 100, 'chunk_overlap': -1}):
+            with self.assertRaises(ValueError):
+                build_text_splitter(config)
+
+
+class EmbedBatchTests(SimpleTestCase):
+
+    def test_resolve_batch_size(self):
+        self.assertEqual(resolve_batch_size({}), KNOWLEDGE_PROCESS_CONFIG['EMBED_BATCH_SIZE'])
+        self.assertEqual(resolve_batch_size({'batch_size': '16'}), 16)
+        self.assertEqual(resolve_batch_size({'batch_size': 10 ** 6}), KNOWLEDGE_PROCESS_CONFIG['MAX_EMBED_BATCH_SIZE'])
+        for batch_size in (-1, 'many'):
+            with self.assertRaises(ValueError):
+                resolve_batch_size({'batch_size': batch_size})
+
+    def test_fixed_size_batches(self):
+        embedder = RecordingEmbeddings()
+        chunks = [f'分段{i}' * (i + 1) for i in range(7)]
+        vectors = embed_in_batches(embedder, chunks, 3)
+        self.assertEqual(embedder.batches, [3, 3, 1])
+        self.assertEqual(vectors, [[float(len(chunk))] for chunk in chunks])
+        self.assertEqual(embed_in_batches(embedder, [], 3), [])
+        self.assertEqual(len(embedder.batches), 3)
@@ -0,0 +1,74 @@
+import os
+import time
+from unittest import mock
+
+from ..knowledge.compaction import collect_garbage
+from ..knowledge.text_artifact import TextArtifact, artifact_root
+from ..knowledge.vector_index import get_index, index_dir
+from ..rules import KNOWLEDGE_INDEX_CONFIG
+from .base import KnowledgeTestCase, document, paragraphs
+
+
+@mock.patch.dict(KNOWLEDGE_INDEX_CONFIG, READER_IDLE_SECONDS=0)
+class CollectGarbageTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        texts = paragraphs(4)
+        self.files = [
+            self.add_file(self.kb, document(texts), 'a.txt'),
+            self.add_file(self.kb, document(paragraphs(4, seed=1)), 'b.txt'),
+            self.add_file(self.kb, document(texts[:2] + paragraphs(2, seed=2)), 'c.txt'),
+        ]
+        for kf in self.files:
+            self.process(kf)
+
+    def age(self, path):
+        old = time.time() - 2 * 24 * 3600
+        os.utime(path, (old, old))
+
+    def test_deleted_file_rows_compacted(self):
+        before = get_index(self.kb.id)
+        self.assertEqual(before.dedup_stats()['duplicate_rows'], 2)
+        self.files[1].delete()
+        report = collect_garbage(dry_run=True)
+        self.assertEqual((report['indexes']['stale_files'], report['indexes']['compacted']), (1, 1))
+        self.assertEqual(get_index(self.kb.id).generation, before.generation)
+        del before
+        report = collect_garbage()
+        self.assertEqual(report['indexes']['stale_files'], 1)
+        self.assertEqual((report['indexes']['compacted'], report['indexes']['generations']), (1, 1))
+        index = get_index(self.kb.id)
+        self.assertEqual((index.count, index.live_count()), (8, 8))
+        self.assertEqual(sorted(index.manifest['files']), sorted(str(kf.id) for kf in (self.files[0], self.files[2])))
+        self.assertEqual(index.dedup_stats()['duplicate_rows'], 2)
+        self.assertEqual(sorted(name for name in os.listdir(index_dir(self.kb.id)) if name.startswith('gen_')),
+                         [f'gen_{index.generation}'])
+
+    def test_orphan_index_and_artifacts(self):
+        other = self.create_kb('other')
+        kf = self.add_file(other, document(paragraphs(2, seed=3)))
+        self.process(kf)
+        artifact = TextArtifact.open(kf.text_artifact)
+        kept = TextArtifact.open(self.files[0].text_artifact)
+        for path in (artifact.data_path, artifact.meta_path, kept.data_path, kept.meta_path):
+            self.age(path)
+        other_id = other.id
+        other.delete()
+        report = collect_garbage()
+        self.assertEqual(report['orphan_indexes']['removed'], 1)
+        self.assertFalse(os.path.exists(index_dir(other_id)))
+        self.assertEqual(report['text_artifacts']['removed'], 2)
+        self.assertIsNone(TextArtifact.open(artifact.key))
+        self.assertIsNotNone(TextArtifact.open(kept.key))
+
+    def test_recent_artifacts_kept(self):
+        other = self.create_kb('other')
+        kf = self.add_file(other, document(paragraphs(2, seed=3)))
+        self.process(kf)
+        key = kf.text_artifact
+        other.delete()
+        self.assertEqual(collect_garbage()['text_artifacts']['removed'], 0)
+        self.assertIsNotNone(TextArtifact.open(key))
+        self.assertTrue(os.path.isdir(artifact_root()))
@@ -0,0 +1,69 @@
+import copy
+
+from ..knowledge.dedup import find_duplicates
+from ..knowledge.search import search_knowledge_base
+from ..knowledge.vector_index import KnowledgeIndexWriter, get_index, index_write_lock, remove_file_rows
+from .base import PARAMS, KnowledgeTestCase, document, paragraphs
+
+NO_CACHE = copy.deepcopy(PARAMS)
+NO_CACHE['embedding_config']['use_cache'] = False
+
+
+class DedupTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        self.texts = paragraphs(5)
+        # 前三段加两个字，与第一个文件的分段近似重复
+        self.near = [text + '补充' for text in self.texts[:3]] + paragraphs(2, seed=1)
+        self.first = self.add_file(self.kb, document(self.texts), 'first.txt')
+        self.second = self.add_file(self.kb, document(self.near), 'second.txt')
+        self.process(self.first, NO_CACHE)
+        self.result = self.process(self.second, NO_CACHE)
+
+    def search(self):
+        results = search_knowledge_base(self.kb, self.texts[0], top_k=20, similarity_threshold=0)['results']
+        return sorted(result['content'] for result in results)
+
+    def test_duplicates_hidden_and_not_embedded(self):
+        self.assertEqual((self.result['duplicate_chunks'], self.result['embedded_count']), (3, 2))
+        self.assertEqual(self.embedder.texts, self.texts + self.near[3:])
+        self.assertEqual(get_index(self.kb.id).dedup_stats()['duplicate_rows'], 3)
+        self.assertEqual(self.search(), sorted(self.texts + self.near[3:]))
+
+    def test_duplicates_resurface_when_canonical_removed(self):
+        remove_file_rows(self.kb.id, self.first.id)
+        self.assertEqual(get_index(self.kb.id).dedup_stats()['duplicate_rows'], 0)
+        self.assertEqual(self.search(), sorted(self.near))
+
+    def test_duplicates_within_file(self):
+        kf = self.add_file(self.kb, document(paragraphs(2, seed=2) * 2), 'repeat.txt')
+        result = self.process(kf, NO_CACHE)
+        self.assertEqual((result['duplicate_chunks'], result['embedded_count']), (2, 2))
+
+    def test_band_postings_match_column_scan(self):
+        index = get_index(self.kb.id)
+        self.assertTrue(index.manifest['keyword']['lsh'])
+        bands = find_duplicates(self.near, index)[2]
+        for exclude in (None, self.first.id, self.second.id):
+            self.assertEqual(index.duplicate_candidates(bands, exclude),
+                             index._scan_duplicate_candidates(bands, exclude))
+        self.assertTrue(all(index.duplicate_candidates(bands)[:3]))
+
+    def test_legacy_index_backfills_band_terms(self):
+        index = get_index(self.kb.id)
+        bands = find_duplicates(self.near, index)[2]
+        expected = index.duplicate_candidates(bands)
+        with index_write_lock(self.kb.id):
+            writer = KnowledgeIndexWriter(self.kb.id)
+            writer.manifest['keyword'] = {**writer.manifest['keyword'], 'segments': [], 'lsh': False}
+            writer.commit()
+        legacy = get_index(self.kb.id)
+        self.assertFalse(legacy.manifest['keyword']['lsh'])
+        self.assertEqual(legacy.duplicate_candidates(bands), expected)
+        with index_write_lock(self.kb.id):
+            KnowledgeIndexWriter(self.kb.id).commit()
+        upgraded = get_index(self.kb.id)
+        self.assertTrue(upgraded.manifest['keyword']['lsh'])
+        self.assertEqual(upgraded.duplicate_candidates(bands), expected)
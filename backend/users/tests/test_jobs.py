@@ -0,0 +1,87 @@
+import datetime
+
+from django.utils import timezone
+
+from ..knowledge.jobs import (JobContext, cancel_job, claim_next_job, enqueue_process_job, requeue_stale_jobs,
+                              retry_job, run_job)
+from ..models import KnowledgeProcessJob
+from .base import PARAMS, KnowledgeTestCase, document, paragraphs
+
+
+class JobStateTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        self.kf = self.add_file(self.kb, document(paragraphs(3)))
+
+    def state(self, job):
+        job.refresh_from_db()
+        return job.status
+
+    def test_enqueue_reuses_queued_job(self):
+        job = enqueue_process_job(self.kf, PARAMS)
+        again = enqueue_process_job(self.kf, {**PARAMS, 'incremental': True})
+        self.assertEqual(job.id, again.id)
+        self.assertEqual(self.state(job), 'queued')
+        self.assertTrue(job.params['incremental'])
+
+    def test_claim_and_run(self):
+        job = enqueue_process_job(self.kf, PARAMS)
+        claimed = claim_next_job('worker-1')
+        self.assertEqual((claimed.id, claimed.status, claimed.worker, claimed.attempts), (job.id, 'running', 'worker-1', 1))
+        self.assertIsNone(claim_next_job('worker-2'))
+        run_job(claimed)
+        self.assertEqual(self.state(job), 'done')
+        self.assertEqual(job.result['chunk_count'], 3)
+        self.assertIsNotNone(job.finished)
+
+    def test_retryable_failure_requeues_then_fails(self):
+        def fail(texts):
+            raise RuntimeError('model offline')
+        self.embedder.embed_documents = fail
+        job = enqueue_process_job(self.kf, {**PARAMS, 'embedding_config': {**PARAMS['embedding_config'], 'use_cache': False}})
+        KnowledgeProcessJob.objects.filter(id=job.id).update(max_attempts=2)
+        with self.assertLogs('users.knowledge', 'WARNING'):
+            run_job(claim_next_job('worker-1'))
+        self.assertEqual(self.state(job), 'queued')
+        self.assertIn('model offline', job.error)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIsNone(claim_next_job('worker-1'))
+        KnowledgeProcessJob.objects.filter(id=job.id).update(run_after=None)
+        with self.assertLogs('users.knowledge', 'ERROR'):
+            run_job(claim_next_job('worker-1'))
+        self.assertEqual(self.state(job), 'failed')
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(retry_job(job))
+        self.assertEqual((self.state(job), job.attempts, job.error), ('queued', 0, None))
+
+    def test_cancel(self):
+        job = enqueue_process_job(self.kf, PARAMS)
+        self.assertTrue(cancel_job(job))
+        self.assertEqual(self.state(job), 'cancelled')
+        self.assertFalse(cancel_job(job))
+        self.assertTrue(retry_job(job))
+        claimed = claim_next_job('worker-1')
+        self.assertTrue(cancel_job(claimed))
+        self.assertEqual(self.state(job), 'running')
+        run_job(claimed)
+        self.assertEqual(self.state(job), 'cancelled')
+        self.assertEqual(self.embedder.texts, [])
+
+    def test_stale_running_job_requeued(self):
+        job = enqueue_process_job(self.kf, PARAMS)
+        claim_next_job('worker-1')
+        KnowledgeProcessJob.objects.filter(id=job.id).update(heartbeat=timezone.now() - datetime.timedelta(days=1))
+        with self.assertLogs('users.knowledge', 'WARNING'):
+            self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual((self.state(job), job.worker), ('queued', ''))
+        claim_next_job('worker-2')
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+    def test_heartbeat_thread_stops_with_job(self):
+        enqueue_process_job(self.kf, PARAMS)
+        job = claim_next_job('worker-1')
+        with JobContext(job) as context:
+            self.assertTrue(context._thread.is_alive())
+        self.assertFalse(context._thread.is_alive())
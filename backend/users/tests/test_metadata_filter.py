@@ -0,0 +1,81 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..knowledge.metadata_filter import FilterError, filter_files, parse_filters
+from ..knowledge.search import KnowledgeSearchError, search_knowledge_base
+from ..knowledge.vector_index import get_index, replace_file_rows
+from .base import KnowledgeTestCase, paragraphs
+
+MODEL = {'type': 'local', 'model': 'fake-model', 'normalize': True}
+
+
+class ParseFiltersTests(SimpleTestCase):
+
+    def test_normalizes_conditions(self):
+        self.assertEqual(parse_filters({'page': 3, 'file_id': ['7'], 'sheet': 'S1', 'section': ''}),
+                         {'page': [3], 'file_id': [7], 'sheet': ['S1']})
+        self.assertEqual(parse_filters({'page': {'gte': '2', 'lte': None}}), {'page': {'gte': 2}})
+        self.assertEqual(parse_filters(None), {})
+
+    def test_rejects_invalid_conditions(self):
+        for filters in ({'author': 'x'}, {'page': {'gt': 1}}, {'page': 'first'}, {'uploaded': '2024-13-01'}, ['page']):
+            with self.assertRaises(FilterError):
+                parse_filters(filters)
+
+
+class MetadataFilterTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        self.texts = paragraphs(10)
+        # 报告：第 1–6 页，前三页属于“引言”；表格：两个工作表，没有页码与章节
+        self.report = self.add_file(self.kb, 'x', 'report.pdf')
+        self.sheet = self.add_file(self.kb, 'x', 'data.xlsx')
+        self.write(self.report, self.texts[:6], [
+            {'page': page, 'section': '引言' if page <= 3 else '方法'} for page in range(1, 7)])
+        self.write(self.sheet, self.texts[6:], [{'sheet': 'S1'}, {'sheet': 'S1'}, {'sheet': 'S2'}, {}])
+        self.index = get_index(self.kb.id)
+
+    def write(self, kf, texts, metadatas):
+        vectors = self.embedder.embed_documents(texts)
+        replace_file_rows(self.kb.id, kf.id, texts, vectors, metadatas, MODEL, dedup=False)
+
+    def matched(self, filters):
+        filters = parse_filters(filters)
+        mask = self.index.filter_mask(filters, filter_files(self.kb.files.all(), filters))
+        return [self.index.chunk(row)['content'] for row in np.flatnonzero(mask & self.index.live_mask())]
+
+    def test_equality_in_and_range(self):
+        self.assertEqual(self.matched({'page': 2}), self.texts[1:2])
+        self.assertEqual(self.matched({'page': [1, 3, 99]}), [self.texts[0], self.texts[2]])
+        self.assertEqual(self.matched({'page': {'gte': 5}}), self.texts[4:6])
+        self.assertEqual(self.matched({'page': {'gte': 2, 'lte': 4}}), self.texts[1:4])
+        self.assertEqual(self.matched({'sheet': 'S2'}), self.texts[8:9])
+        self.assertEqual(self.matched({'source': 'DATA'}), self.texts[6:])
+        self.assertEqual(self.matched({'file_id': self.report.id}), self.texts[:6])
+
+    def test_conditions_combined_with_and(self):
+        self.assertEqual(self.matched({'page': {'lte': 4}, 'section': '方法'}), self.texts[3:4])
+        self.assertEqual(self.matched({'source': 'report', 'section': '引'}), self.texts[:3])
+        self.assertEqual(self.matched({'file_id': self.sheet.id, 'sheet': ['S1', 'S2']}), self.texts[6:9])
+
+    def test_rows_missing_field_excluded(self):
+        # 表格的行没有页码，报告的行没有工作表；最后一行没有任何元数据
+        self.assertEqual(self.matched({'page': {'gte': 1}}), self.texts[:6])
+        self.assertEqual(self.matched({'sheet': ['S1', 'S2']}), self.texts[6:9])
+        self.assertEqual(self.matched({'source': 'data', 'page': {'gte': 1}}), [])
+
+    def test_filtered_search_returns_matching_rows(self):
+        response = search_knowledge_base(self.kb, self.texts[0], top_k=10, filters={'page': {'gte': 3}})
+        self.assertEqual(response['filtered_rows'], 4)
+        self.assertEqual(sorted(result['metadata']['page'] for result in response['results']), [3, 4, 5, 6])
+        unfiltered = search_knowledge_base(self.kb, self.texts[0], top_k=1)
+        self.assertEqual(unfiltered['results'][0]['content'], self.texts[0])
+
+    def test_empty_candidate_set(self):
+        for filters in ({'page': 99}, {'source': 'missing'}, {'sheet': 'S1', 'page': 1}):
+            response = search_knowledge_base(self.kb, self.texts[0], filters=filters)
+            self.assertEqual((response['filtered_rows'], response['results']), (0, []))
+        with self.assertRaises(KnowledgeSearchError):
+            search_knowledge_base(self.kb, self.texts[0], filters={'author': 'x'})
@@ -0,0 +1,61 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..knowledge import parallel_embedding
+from ..knowledge.parallel_embedding import ParallelEmbeddings
+from ..knowledge.process_pool import SharedProcessPool
+from .workers import embed_batch
+
+
+class SharedProcessPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = SharedProcessPool('测试')
+        self.addCleanup(self.pool.shutdown)
+
+    def test_grown_pool_keeps_old_executor_until_released(self):
+        with self.pool.acquire(1) as small:
+            with self.pool.acquire(2) as large:
+                self.assertIsNot(small, large)
+                self.assertEqual(large.submit(abs, -2).result(), 2)
+            # 扩容后旧进程池仍可提交
+            self.assertEqual(small.submit(abs, -1).result(), 1)
+            with self.pool.acquire(1) as again:
+                self.assertIs(again, large)
+        self.assertEqual(list(self.pool._users.values()), [0])
+        with self.assertRaises(RuntimeError):
+            small.submit(abs, -1)
+
+
+class ParallelEmbeddingsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = SharedProcessPool('测试')
+        self.addCleanup(self.pool.shutdown)
+        for target, value in (('embedding_process_pool', self.pool), ('_embed_batch', embed_batch)):
+            patcher = mock.patch.object(parallel_embedding, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent_jobs_with_different_worker_counts(self):
+        texts = ['x' * i for i in range(1, 25)]
+        results = {}
+
+        def run(name, workers):
+            embedder = ParallelEmbeddings(None, ('local', 'model', 'cpu', True), workers, batch_size=2)
+            results[name] = embedder.embed_documents(texts)
+
+        first = threading.Thread(target=run, args=('first', 1))
+        first.start()
+        while not self.pool._users and first.is_alive():
+            threading.Event().wait(0.01)
+        # 第一个任务仍在逐个窗口提交时，第二个任务需要更多进程，进程池被替换
+        self.assertTrue(first.is_alive())
+        run('second', 3)
+        first.join()
+        expected = [[float(len(text)), 4.0] for text in texts]
+        self.assertEqual(results, {'first': expected, 'second': expected})
+        self.assertEqual(self.pool._current[0], 3)
+        self.assertEqual(list(self.pool._users.values()), [0])
@@ -0,0 +1,58 @@
+from django.test import SimpleTestCase
+
+from ..knowledge.search import search_knowledge_base
+from ..knowledge.splitter import resolve_parent_config
+from ..knowledge.text_artifact import TextArtifact
+from ..knowledge.vector_index import get_index
+from .base import KnowledgeTestCase, document, paragraphs
+
+PARENT_PARAMS = {
+    'splitter_config': {'chunk_size': 100, 'chunk_overlap': 0, 'use_parent_document': True,
+                        'parent_chunk_size': 400, 'parent_chunk_overlap': 0},
+    'embedding_config': {'type': 'local', 'model': 'fake-model'},
+}
+
+
+class ParentConfigTests(SimpleTestCase):
+
+    def test_parent_config(self):
+        self.assertIsNone(resolve_parent_config({'chunk_size': 100}))
+        config = resolve_parent_config(PARENT_PARAMS['splitter_config'])
+        self.assertEqual((config['chunk_size'], config['chunk_overlap']), (400, 0))
+        with self.assertRaises(ValueError):
+            resolve_parent_config({'chunk_size': 500, 'use_parent_document': True, 'parent_chunk_size': 400})
+
+
+class ParentDocumentTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb(params=PARENT_PARAMS)
+        self.texts = paragraphs(12)
+        self.text = document(self.texts)
+        self.kf = self.add_file(self.kb, self.text)
+        self.process(self.kf, PARENT_PARAMS)
+        self.kf.refresh_from_db()
+
+    def test_children_point_to_parent_spans(self):
+        index = get_index(self.kb.id)
+        artifact = TextArtifact.open(self.kf.text_artifact)
+        rows = index.chunks(range(index.count))
+        # 每段 60 字（含分隔共 62 字），400 字的父块容纳 6 段，每段是一个子块
+        self.assertEqual([row['content'] for row in rows], self.texts)
+        spans = sorted({tuple(row['metadata']['parent']) for row in rows})
+        self.assertEqual(len(spans), 2)
+        for row in rows:
+            start, end = row['metadata']['parent']
+            parent = artifact.read(start, end)
+            self.assertEqual(parent, self.text[start:end])
+            self.assertIn(row['content'], parent)
+        self.assertEqual(artifact.read(*spans[0]), document(self.texts[:6]))
+
+    def test_children_collapse_to_parent(self):
+        response = search_knowledge_base(self.kb, self.texts[7], top_k=5)
+        self.assertTrue(response['parent_document'])
+        results = response['results']
+        self.assertEqual([result['content'] for result in results], [document(self.texts[6:]), document(self.texts[:6])])
+        self.assertEqual(results[0]['child_content'], self.texts[7])
+        self.assertEqual(len({tuple(result['metadata']['parent']) for result in results}), 2)
@@ -0,0 +1,50 @@
+import copy
+
+import numpy as np
+
+from ..knowledge.vector_index import get_index
+from .base import PARAMS, KnowledgeTestCase, document, paragraphs
+
+
+def params(**embedding_config):
+    result = copy.deepcopy(PARAMS)
+    result['embedding_config'].update(embedding_config)
+    result['dedup_config'] = {'enabled': False}
+    return result
+
+
+class EmbedOnceTests(KnowledgeTestCase):
+
+    def test_each_chunk_embedded_once(self):
+        kb = self.create_kb()
+        texts = paragraphs(5)
+        kf = self.add_file(kb, document(texts + texts[:2]))
+        result = self.process(kf, params(use_cache=False))
+        self.assertEqual(result['chunk_count'], 7)
+        self.assertEqual(result['embedded_count'], 7)
+        self.assertEqual(self.embedder.texts, texts + texts[:2])
+        index = get_index(kb.id)
+        expected = np.asarray([self.embedder.embed_query(text) for text in texts + texts[:2]], dtype=np.float32)
+        np.testing.assert_allclose(index.vectors, expected, rtol=1e-6)
+
+    def test_reprocess_hits_cache(self):
+        kb = self.create_kb()
+        texts = paragraphs(5)
+        kf = self.add_file(kb, document(texts))
+        self.process(kf, params())
+        self.assertEqual(len(self.embedder.texts), 5)
+        result = self.process(kf, params())
+        self.assertEqual(len(self.embedder.texts), 5)
+        self.assertEqual((result['embedded_count'], result['cache_hits'], result['cache_misses']), (0, 5, 0))
+        self.assertEqual(get_index(kb.id).live_count(), 5)
+
+    def test_changed_file_embeds_only_new_chunks(self):
+        kb = self.create_kb()
+        texts = paragraphs(5)
+        kf = self.add_file(kb, document(texts))
+        self.process(kf, params())
+        extra = paragraphs(2, seed=1)
+        other = self.add_file(kb, document(texts[:3] + extra), 'other.txt')
+        result = self.process(other, params())
+        self.assertEqual(self.embedder.texts[5:], extra)
+        self.assertEqual((result['embedded_count'], result['cache_hits']), (2, 3))
@@ -0,0 +1,84 @@
+from unittest import mock
+
+from django.urls import reverse
+
+from ..knowledge import preview
+from ..knowledge.preview import count_tokens
+from ..rules import KNOWLEDGE_PREVIEW_CONFIG
+from .base import PARAMS, KnowledgeTestCase, document, paragraphs
+
+
+class FilePreviewViewTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # 按字符数估算 token，结果不依赖 tiktoken 编码表能否下载
+        patcher = mock.patch.object(preview, '_token_encoding', lambda: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = self.api_client()
+        self.kb = self.create_kb()
+        self.texts = paragraphs(40)
+        self.kf = self.add_file(self.kb, document(self.texts))
+        self.url = reverse('knowledge_file_preview', args=[self.kf.id])
+
+    def post(self, sample, **params):
+        response = self.client.post(self.url, dict(PARAMS, sample=sample, **params), format='json')
+        return response.status_code, response.data
+
+    def assert_statistics(self, data):
+        contents = [chunk['content'] for chunk in data['chunks']]
+        self.assertEqual(data['chunk_count'], len(contents))
+        self.assertTrue(set(contents) <= set(self.texts))
+        for chunk in data['chunks']:
+            self.assertEqual(chunk['metadata']['tokens'], count_tokens(chunk['content']))
+        histogram = data['histogram']['chars']
+        self.assertEqual(sum(histogram['counts']), data['chunk_count'])
+        self.assertEqual(len(histogram['edges']), KNOWLEDGE_PREVIEW_CONFIG['HISTOGRAM_BINS'] + 1)
+        self.assertEqual((histogram['min'], histogram['max'], histogram['edges'][-1]), (60, 60, 100))
+        self.assertEqual(data['histogram']['tokens']['max'], max(count_tokens(text) for text in contents))
+        # 按抽样比例推算全文：每段一个分段
+        self.assertLessEqual(abs(data['estimate']['chunks'] - len(self.texts)), 2)
+        total_tokens = sum(count_tokens(text) for text in self.texts)
+        self.assertLessEqual(abs(data['estimate']['tokens'] - total_tokens), total_tokens * 0.05)
+        self.assertEqual(data['estimate']['cost_usd'], 0.0)
+        return contents
+
+    def test_head_sample(self):
+        status, data = self.post({'mode': 'head', 'chars': 620})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['sample']['windows'], 1)
+        self.assertLessEqual(data['sample']['chars_sampled'], 620)
+        self.assertEqual(data['sample']['scope_chars'], len(document(self.texts)))
+        contents = self.assert_statistics(data)
+        self.assertEqual(contents, self.texts[:len(contents)])
+        self.assertGreaterEqual(len(contents), 9)
+
+    def test_spread_sample(self):
+        status, data = self.post({'mode': 'spread', 'chars': 620})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['sample']['windows'], KNOWLEDGE_PREVIEW_CONFIG['SAMPLE_WINDOWS'])
+        contents = self.assert_statistics(data)
+        # 窗口覆盖全文的开头、中部与结尾
+        positions = [self.texts.index(text) for text in contents]
+        self.assertEqual((positions[0], positions[-1]), (0, len(self.texts) - 1))
+        self.assertTrue(any(15 <= position <= 25 for position in positions))
+
+    def test_cost_estimate(self):
+        embedding_config = {'type': 'openai', 'model': 'text-embedding-3-small', 'batch_size': 8}
+        status, data = self.post({'chars': 620}, embedding_config=embedding_config)
+        self.assertEqual(status, 200)
+        estimate = data['estimate']
+        self.assertEqual(estimate['embed_calls'], -(-estimate['chunks'] // 8))
+        self.assertEqual(estimate['cost_usd'], round(estimate['tokens'] / 1_000_000 * 0.02, 6))
+
+    def test_invalid_parameters(self):
+        for sample, splitter_config in (
+                ({'mode': 'middle'}, PARAMS['splitter_config']),
+                ({'chars': -5}, PARAMS['splitter_config']),
+                ({}, {'chunk_size': 100, 'chunk_overlap': 100}),
+                ({}, {'text_splitter': 'sentence'}),
+                ({}, {'chunk_size': 100, 'use_parent_document': True, 'parent_chunk_size': 50})):
+            status, data = self.post(sample, splitter_config=splitter_config)
+            self.assertEqual(status, 400, (sample, splitter_config))
+            self.assertIn('error', data)
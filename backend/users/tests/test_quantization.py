@@ -0,0 +1,72 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..knowledge.quantization import compact_dot, compute_scales, quantize
+from ..knowledge.vector_index import get_index, replace_file_rows
+from .base import KnowledgeTestCase
+
+MODEL = {'type': 'local', 'model': 'fake-model', 'normalize': True}
+
+
+class QuantizeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vectors = np.random.default_rng(0).normal(size=(200, 32)).astype(np.float32)
+
+    def test_float16_round_trip(self):
+        compact, clipped = quantize(self.vectors, {'dtype': 'float16'})
+        self.assertEqual((compact.dtype, clipped), (np.float16, 0))
+        error = np.abs(compact.astype(np.float32) - self.vectors)
+        # float16 有 11 位有效精度，舍入误差不超过绝对值的 2^-11
+        self.assertTrue((error <= np.abs(self.vectors) * 2 ** -11 + 1e-7).all())
+
+    def test_int8_round_trip(self):
+        scales = compute_scales(np.array_split(self.vectors, 3))
+        np.testing.assert_allclose(scales, np.abs(self.vectors).max(axis=0) / 127)
+        info = {'dtype': 'int8', 'scales': scales.tolist()}
+        compact, clipped = quantize(self.vectors, info)
+        self.assertEqual((compact.dtype, clipped), (np.int8, 0))
+        # 对称量化的误差不超过半个量化步长
+        error = np.abs(compact * scales.astype(np.float32) - self.vectors)
+        self.assertTrue((error <= scales / 2 + 1e-6).all())
+        query = self.vectors[0]
+        np.testing.assert_allclose(compact_dot(compact, query, info), (compact * scales) @ query, rtol=1e-4, atol=1e-4)
+
+    def test_int8_clips_out_of_range_rows(self):
+        info = {'dtype': 'int8', 'scales': compute_scales([self.vectors]).tolist()}
+        compact, clipped = quantize(self.vectors[:3] * [[1], [2], [1]], info)
+        self.assertEqual(clipped, 1)
+        self.assertLessEqual(np.abs(compact.astype(np.int16)).max(), 127)
+
+
+class QuantizedSearchTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        self.kf = self.add_file(self.kb, 'x')
+        rng = np.random.default_rng(1)
+        self.vectors = rng.normal(size=(500, 32)).astype(np.float32)
+        self.queries = rng.normal(size=(20, 32)).astype(np.float32)
+
+    def write(self, storage):
+        count = len(self.vectors)
+        replace_file_rows(self.kb.id, self.kf.id, [f'row {i}' for i in range(count)], list(self.vectors),
+                          [{'chunk_index': i} for i in range(count)], MODEL, {'storage': storage}, dedup=False)
+        return get_index(self.kb.id)
+
+    def test_rescored_top_k_matches_float32(self):
+        for storage in ('int8', 'float16'):
+            index = self.write(storage)
+            self.assertEqual(index.storage, storage)
+            self.assertEqual(index.memory_bytes()['scan'], index.memory_bytes()['float32'] * (1 if storage == 'int8' else 2) // 4)
+            for query in self.queries:
+                exact_rows, exact_scores = index.search(query, 10, exact=True)
+                rows, scores = index.search(query, 10)
+                np.testing.assert_array_equal(rows, exact_rows)
+                np.testing.assert_allclose(scores, exact_scores, rtol=1e-6)
+
+    def test_float32_storage_drops_compact_copy(self):
+        self.write('int8')
+        index = self.write('float32')
+        self.assertEqual((index.storage, index.quantized), ('float32', None))
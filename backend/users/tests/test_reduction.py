@@ -0,0 +1,97 @@
+import copy
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..knowledge.reduction import project, resolve_reduction
+from ..knowledge.search import search_knowledge_base
+from ..knowledge.vector_index import get_index
+from ..rules import KNOWLEDGE_REDUCTION_CONFIG
+from .base import PARAMS, KnowledgeTestCase, document, paragraphs
+
+
+def reduced(dimension, reduction):
+    params = copy.deepcopy(PARAMS)
+    params['embedding_config'].update(dimension=dimension, reduction=reduction)
+    return params
+
+
+class ResolveReductionTests(SimpleTestCase):
+
+    def test_method_by_model(self):
+        self.assertIsNone(resolve_reduction({'model': 'text-embedding-3-small'}))
+        self.assertEqual(resolve_reduction({'model': 'text-embedding-3-small', 'dimension': '256'}),
+                         {'method': 'truncate', 'dim': 256})
+        self.assertEqual(resolve_reduction({'model': 'BAAI/bge-m3', 'dimension': 256}), {'method': 'pca', 'dim': 256})
+        for config in ({'dimension': 4}, {'dimension': 'small'}, {'dimension': 64, 'reduction': 'svd'}):
+            with self.assertRaises(ValueError):
+                resolve_reduction(config)
+
+    def test_truncate_renormalizes_prefix(self):
+        vectors = np.random.default_rng(0).normal(size=(5, 32)).astype(np.float32)
+        projected = project(vectors, {'method': 'truncate', 'input_dim': 32, 'dim': 8})
+        expected = vectors[:, :8] / np.linalg.norm(vectors[:, :8], axis=1, keepdims=True)
+        np.testing.assert_allclose(projected, expected, rtol=1e-6)
+        np.testing.assert_allclose(project(vectors[0], {'method': 'truncate', 'input_dim': 32, 'dim': 8}), expected[0], rtol=1e-6)
+
+
+class ReductionIndexTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.texts = paragraphs(20) + paragraphs(30, seed=1)
+        self.kb = self.create_kb()
+        self.first = self.add_file(self.kb, document(self.texts[:20]), 'first.txt')
+        self.second = self.add_file(self.kb, document(self.texts[20:]), 'second.txt')
+
+    def assert_finds_own_documents(self, texts):
+        for text in texts:
+            self.assertEqual(search_knowledge_base(self.kb, text, top_k=1)['results'][0]['content'], text)
+
+    def test_truncation(self):
+        params = reduced(16, 'truncate')
+        self.process(self.first, params)
+        index = get_index(self.kb.id)
+        self.assertEqual((index.dim, index.vectors.shape[1]), (16, 16))
+        self.assertEqual(index.projection, {'method': 'truncate', 'input_dim': 32, 'dim': 16})
+        np.testing.assert_allclose(index.vectors[0], project(self.embedder.embed_query(self.texts[0]), index.projection), rtol=1e-6)
+        self.assert_finds_own_documents(self.texts[:20:4])
+
+    def test_pca_fitted_after_min_rows(self):
+        params = reduced(16, 'pca')
+        with mock.patch.dict(KNOWLEDGE_REDUCTION_CONFIG, PCA_MIN_ROWS=40):
+            result = self.process(self.first, params)
+            self.assertFalse(result['projection_fitted'])
+            index = get_index(self.kb.id)
+            # 行数不足时按模型原始维度存储
+            self.assertEqual((index.dim, index.projection), (32, None))
+            before = index.generation
+            result = self.process(self.second, params)
+        self.assertTrue(result['projection_fitted'])
+        self.assertEqual(result['index_dim'], 16)
+        index = get_index(self.kb.id)
+        self.assertEqual((index.dim, index.input_dim, index.count), (16, 32, 50))
+        self.assertEqual((index.projection['method'], index.projection['fitted_rows']), ('pca', 50))
+        self.assertEqual(index.projection_matrix.shape, (17, 32))
+        # 拟合后已有行投影写入新一代
+        self.assertNotEqual(index.generation, before)
+        self.assert_finds_own_documents(self.texts[::7])
+
+    def test_projection_change_rebuilds_index(self):
+        self.process(self.first, reduced(16, 'truncate'))
+        self.process(self.second, reduced(16, 'truncate'))
+        old = get_index(self.kb.id)
+        params = reduced(12, 'truncate')
+        self.kb.refresh_from_db()
+        self.kb.embedding_config = params
+        self.kb.save()
+        result = self.process(self.first, params)
+        # 新维度写入暂存代，全部文件重建前旧代继续服务查询
+        self.assertEqual((result['index_staged'], result['index_pending_files']), (True, 1))
+        self.assertEqual(get_index(self.kb.id).dim, 16)
+        self.process(self.second, params)
+        index = get_index(self.kb.id)
+        self.assertEqual((index.dim, index.count), (12, 50))
+        self.assertNotEqual(index.generation, old.generation)
+        self.assert_finds_own_documents(self.texts[::9])
@@ -0,0 +1,62 @@
+import copy
+
+from django.urls import reverse
+
+from ..models import KnowledgeBase, KnowledgeProcessJob
+from .base import PARAMS, KnowledgeTestCase, document, paragraphs
+
+
+def changed(**sections):
+    """在 PARAMS 基础上修改部分配置"""
+    params = copy.deepcopy(PARAMS)
+    for name, values in sections.items():
+        params[name] = dict(params.get(name) or {}, **values)
+    return params
+
+
+class ReprocessPlanTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.api_client()
+        self.kb = self.create_kb()
+        self.files = [self.add_file(self.kb, document(paragraphs(3, seed)), f'{seed}.txt') for seed in range(2)]
+        for kf in self.files:
+            self.process(kf)
+        self.ids = [kf.id for kf in self.files]
+        self.url = reverse('knowledgebase-reprocess', args=[self.kb.id])
+
+    def plan(self, params):
+        response = self.client.post(f'{self.url}?dry_run=1', params, format='json')
+        self.assertEqual(response.status_code, 200)
+        return {stage: ids for stage, ids in response.data['stages'].items() if ids}, response.data['unchanged']
+
+    def test_unchanged_config(self):
+        self.assertEqual(self.plan(PARAMS), ({}, self.ids))
+        # 只影响速度或检索的配置不需要重新处理
+        params = changed(embedding_config={'batch_size': 8}, retrieval_config={'top_k': 3})
+        self.assertEqual(self.plan(params), ({}, self.ids))
+
+    def test_loader_change_restarts_extract(self):
+        self.assertEqual(self.plan(changed(loader_config={'encoding': 'gbk'})), ({'extract': self.ids}, []))
+
+    def test_splitter_change_restarts_split(self):
+        self.assertEqual(self.plan(changed(splitter_config={'chunk_size': 80})), ({'split': self.ids}, []))
+        self.assertEqual(self.plan(changed(clean_config={'remove_extra_whitespace': True})), ({'split': self.ids}, []))
+
+    def test_embedding_change_restarts_embed(self):
+        self.assertEqual(self.plan(changed(embedding_config={'model': 'other-model'})), ({'embed': self.ids}, []))
+
+    def test_unprocessed_file_starts_at_extract(self):
+        kf = self.add_file(self.kb, document(paragraphs(2, 5)), 'new.txt')
+        self.assertEqual(self.plan(PARAMS), ({'extract': [kf.id]}, self.ids))
+
+    def test_dry_run_only_returns_plan(self):
+        self.plan(changed(splitter_config={'chunk_size': 80}))
+        self.assertEqual(KnowledgeBase.objects.get(id=self.kb.id).embedding_config, PARAMS)
+        self.assertFalse(KnowledgeProcessJob.objects.exists())
+        params = changed(splitter_config={'chunk_size': 80})
+        response = self.client.post(self.url, params, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(response.data['jobs']), 2)
+        self.assertEqual(KnowledgeBase.objects.get(id=self.kb.id).embedding_config, params)
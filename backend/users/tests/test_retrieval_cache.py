@@ -0,0 +1,98 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..knowledge import retrieval_cache, vector_index
+from ..knowledge.retrieval_cache import TTLCache
+from ..knowledge.search import search_knowledge_base
+from ..knowledge.vector_index import compact_index, remove_file_rows
+from ..rules import KNOWLEDGE_RETRIEVAL_CACHE_CONFIG
+from .base import KnowledgeTestCase, document, paragraphs
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class TTLCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(retrieval_cache, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_expired_entries_evicted(self):
+        cache = TTLCache(ttl=10, max_entries=10, max_bytes=1000)
+        cache.put('a', 1, 1)
+        self.clock.now += 9
+        self.assertEqual(cache.get('a'), 1)
+        self.clock.now += 2
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_least_recently_used_evicted(self):
+        cache = TTLCache(ttl=10, max_entries=2, max_bytes=10)
+        cache.put('a', 1, 4)
+        cache.put('b', 2, 4)
+        cache.get('a')
+        cache.put('c', 3, 4)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        cache.put('big', 4, 11)
+        self.assertIsNone(cache.get('big'))
+
+
+class SearchCacheTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        self.texts = paragraphs(4)
+        self.process(self.add_file(self.kb, document(self.texts)))
+        self.new_texts = paragraphs(2, seed=1)
+        self.query = self.new_texts[0]
+
+    def search(self):
+        return search_knowledge_base(self.kb, self.query, top_k=3)
+
+    def contents(self, response):
+        return [result['content'] for result in response['results']]
+
+    def test_results_refreshed_when_index_changes(self):
+        # 模拟由其他进程写入索引：本进程的结果缓存不会被主动清除，只能依靠索引版本失效
+        with mock.patch.object(vector_index, 'invalidate_kb_results', lambda kb_id: 0):
+            first = self.search()
+            self.assertIsNone(first['cache'])
+            self.assertEqual(self.search()['cache'], 'result')
+            kf = self.add_file(self.kb, document(self.new_texts), 'new.txt')
+            self.process(kf)
+            added = self.search()
+            self.assertEqual(added['cache'], 'query_vector')
+            self.assertGreater(added['index_version'], first['index_version'])
+            self.assertEqual(self.contents(added)[0], self.query)
+            remove_file_rows(self.kb.id, kf.id)
+            compact_index(self.kb.id, [file.id for file in self.kb.files.all() if file.id != kf.id], dead_ratio=0)
+            removed = self.search()
+            self.assertNotEqual(removed['index_generation'], added['index_generation'])
+            self.assertNotEqual(removed['cache'], 'result')
+            self.assertEqual(self.contents(removed), self.contents(first))
+
+    def test_local_write_clears_results(self):
+        self.search()
+        self.assertEqual(retrieval_cache.result_cache.stats()['entries'], 1)
+        self.process(self.add_file(self.kb, document(self.new_texts), 'new.txt'))
+        self.assertEqual(retrieval_cache.result_cache.stats()['entries'], 0)
+
+    def test_results_expire(self):
+        clock = Clock()
+        with mock.patch.object(retrieval_cache, 'time', clock):
+            self.search()
+            self.assertEqual(self.search()['cache'], 'result')
+            clock.now += KNOWLEDGE_RETRIEVAL_CACHE_CONFIG['RESULT_TTL'] + 1
+            # 结果过期，查询向量仍在有效期内
+            self.assertEqual(self.search()['cache'], 'query_vector')
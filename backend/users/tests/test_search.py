@@ -0,0 +1,79 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..knowledge.keyword_index import term_hash, tokenize
+from ..knowledge.search import _min_max, search_knowledge_base
+from ..knowledge.vector_index import compact_index, get_index, remove_file_rows
+from .base import KnowledgeTestCase, document, paragraphs
+
+TERM = 'xj-9000'
+
+
+class TokenizeTests(SimpleTestCase):
+
+    def test_cjk_bigrams(self):
+        self.assertEqual(tokenize('知识库检索'), ['知识', '识库', '库检', '检索'])
+        self.assertEqual(tokenize('库'), ['库'])
+        # 标点与空白断开中文串，不产生跨越的二字组
+        self.assertEqual(tokenize('向量，检索 模型'), ['向量', '检索', '模型'])
+
+    def test_words_and_compounds(self):
+        self.assertEqual(tokenize('CS-101课程'), ['cs-101', 'cs', '101', '课程'])
+        self.assertEqual(tokenize('x^2+y^2'), ['x^2+y^2', 'x', '2', 'y', '2'])
+        # 全角字母数字按 NFKC 归一
+        self.assertEqual(tokenize('ＡＢＣ１２'), ['abc12'])
+
+
+class HybridSearchTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        self.texts = paragraphs(6)
+        self.texts[2] = self.texts[2][:50] + TERM
+        self.texts[4] = self.texts[4][:50] + TERM
+        self.kf = self.add_file(self.kb, document(self.texts))
+        self.process(self.kf)
+
+    def search(self, query, **kwargs):
+        return search_knowledge_base(self.kb, query, top_k=20, **kwargs)
+
+    def test_exact_term_ranked_above_vector_only_hits(self):
+        results = self.search(TERM, strategy='hybrid')['results']
+        self.assertEqual(len(results), len(self.texts))
+        matched = [result['content'] for result in results if result['keyword_score'] > 0]
+        self.assertEqual(sorted(matched), sorted([self.texts[2], self.texts[4]]))
+        self.assertEqual([result['content'] for result in results[:2]], matched)
+        self.assertTrue(all(result['keyword_score'] == 0 for result in results[2:]))
+
+    def test_hybrid_scores_fuse_normalized_scores(self):
+        query = self.texts[1][8:30]
+        response = self.search(query, strategy='hybrid')
+        results = response['results']
+        vector = _min_max(np.array([result['vector_score'] for result in results]))
+        keyword = _min_max(np.array([result['keyword_score'] for result in results]))
+        weight = response['keyword_weight']
+        fused = (1 - weight) * vector + weight * keyword
+        np.testing.assert_allclose([result['score'] for result in results], fused, atol=1e-4)
+        self.assertEqual([result['score'] for result in results], sorted((r['score'] for r in results), reverse=True))
+        self.assertEqual(results[0]['content'], self.texts[1])
+        # 向量得分与单独向量检索一致
+        similarity = {r['content']: r['score'] for r in self.search(query, similarity_threshold=0)['results']}
+        for result in results:
+            self.assertAlmostEqual(result['vector_score'], similarity[result['content']], places=4)
+
+    def test_removed_rows_leave_postings(self):
+        other = self.add_file(self.kb, document(paragraphs(2, seed=1)[:1] + [TERM]), 'other.txt')
+        self.process(other)
+        index = get_index(self.kb.id)
+        self.assertEqual(len(index.keyword_search(TERM, None)[0]), 3)
+        remove_file_rows(self.kb.id, other.id)
+        index = get_index(self.kb.id)
+        rows, _ = index.keyword_search(TERM, None)
+        self.assertEqual(sorted(index.chunk(row)['content'] for row in rows), sorted([self.texts[2], self.texts[4]]))
+        # 压缩后倒排表中不再有已移除的行
+        compact_index(self.kb.id, [self.kf.id], dead_ratio=0)
+        index = get_index(self.kb.id)
+        self.assertEqual(index.count, len(self.texts))
+        postings = [p for p in (s.postings(term_hash(TERM)) for s in index.keyword_segments) if p is not None]
+        self.assertEqual(sorted(int(row) for rows, _ in postings for row in rows), sorted(rows))
@@ -0,0 +1,92 @@
+import json
+import os
+import zipfile
+
+import numpy as np
+
+from ..knowledge.snapshot import SnapshotError, export_knowledge_base, import_knowledge_base
+from ..knowledge.text_artifact import TextArtifact
+from ..knowledge.vector_index import get_index
+from ..models import KnowledgeBase
+from .base import KnowledgeTestCase, document, paragraphs
+
+
+class SnapshotTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        self.texts = paragraphs(6)
+        self.kf = self.add_file(self.kb, document(self.texts + self.texts[:2]))
+        self.process(self.kf)
+        self.path = os.path.join(self.tmp, 'kb.zip')
+
+    def export(self, include_files=True):
+        export_knowledge_base(self.kb, self.path, include_files)
+        return self.path
+
+    def rewrite(self, replace=None, extra=None, info=None):
+        """复制快照归档，替换或追加成员，info 修改 snapshot.json"""
+        path = os.path.join(self.tmp, 'evil.zip')
+        with zipfile.ZipFile(self.path) as source, zipfile.ZipFile(path, 'w') as target:
+            for item in source.infolist():
+                data = source.read(item.filename)
+                if item.filename == 'snapshot.json' and info:
+                    data = json.loads(data)
+                    info(data)
+                    data = json.dumps(data)
+                target.writestr(item.filename, (replace or {}).get(item.filename, data))
+            for name, data in (extra or {}).items():
+                target.writestr(name, data)
+        return path
+
+    def test_round_trip(self):
+        self.export()
+        kb, result = import_knowledge_base(self.path, 'copy')
+        self.assertEqual(result['files'], 1)
+        source, copy = get_index(self.kb.id), get_index(kb.id)
+        self.assertEqual(source.dedup_stats()['duplicate_rows'], 2)
+        self.assertEqual(copy.count, source.count)
+        np.testing.assert_array_equal(copy.vectors, source.vectors)
+        np.testing.assert_array_equal(copy.canonical, source.canonical)
+        self.assertEqual(copy.dedup_stats(), source.dedup_stats())
+        self.assertEqual(copy.chunks(range(copy.count)), [
+            {**chunk, 'metadata': {**chunk['metadata'], 'file_id': kb.files.get().id}}
+            for chunk in source.chunks(range(source.count))
+        ])
+        kf = kb.files.get()
+        with kf.file.open('rb') as f:
+            self.assertEqual(f.read().decode('utf-8'), document(self.texts + self.texts[:2]))
+        self.assertIsNotNone(TextArtifact.open(kf.text_artifact))
+
+    def test_without_files_leaves_file_empty(self):
+        self.export(include_files=False)
+        path = self.rewrite(info=lambda info: info['files'][0].update(file='/etc/passwd'))
+        kb, _ = import_knowledge_base(path, 'copy')
+        self.assertFalse(kb.files.get().file)
+
+    def test_rejects_artifact_member_outside_store(self):
+        self.export()
+        key = self.kf.text_artifact
+        with zipfile.ZipFile(self.path) as zf:
+            blocks, meta = zf.read(f'text/{key}.blocks'), zf.read(f'text/{key}.json')
+        path = self.rewrite(extra={'text/../escaped.blocks': blocks, 'text/../escaped.json': meta})
+        with self.assertRaises(SnapshotError):
+            import_knowledge_base(path, 'copy')
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'escaped.json')))
+        self.assertFalse(KnowledgeBase.objects.filter(name='copy').exists())
+
+    def test_rejects_artifact_key_in_records(self):
+        self.export()
+        for field in ('text_artifact', 'index_artifact'):
+            path = self.rewrite(info=lambda info: info['files'][0].update({field: '../../escaped'}))
+            with self.assertRaises(SnapshotError):
+                import_knowledge_base(path, 'copy')
+            self.assertFalse(KnowledgeBase.objects.filter(name='copy').exists())
+
+    def test_rejects_missing_file_member(self):
+        self.export()
+        path = self.rewrite(info=lambda info: info['files'][0].update(member='files/1/../../../etc/passwd'))
+        with self.assertRaises(SnapshotError):
+            import_knowledge_base(path, 'copy')
+        self.assertFalse(KnowledgeBase.objects.filter(name='copy').exists())
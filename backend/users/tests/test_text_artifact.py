@@ -0,0 +1,35 @@
+import os
+
+from django.urls import reverse
+
+from ..knowledge.jobs import enqueue_process_job
+from ..knowledge.text_artifact import artifact_root
+from .base import PARAMS, KnowledgeTestCase, document, paragraphs
+
+
+class FileTextViewTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.api_client()
+        self.kb = self.create_kb()
+        self.text = document(paragraphs(3))
+        self.kf = self.add_file(self.kb, self.text)
+        self.url = reverse('knowledge_file_text', args=[self.kf.id])
+
+    def test_reads_processed_text_by_offset(self):
+        self.process(self.kf)
+        response = self.client.get(self.url, {'start': 10, 'length': 20})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['text'], self.text[10:30])
+        self.assertEqual(response.data['length'], len(self.text))
+
+    def test_missing_artifact_not_extracted_in_request(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+        enqueue_process_job(self.kf, PARAMS)
+        response = self.client.get(self.url)
+        self.assertEqual((response.status_code, response.data['status']), (409, 'queued'))
+        self.kf.refresh_from_db()
+        self.assertEqual(self.kf.text_artifact, '')
+        self.assertFalse(os.path.exists(artifact_root()))
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+
+from ..knowledge.vector_index import (KnowledgeIndexWriter, collect_generations, get_index, index_dir,
+                                      index_write_lock, release_idle_indexes, replace_file_rows)
+from ..models import KnowledgeBase
+from .base import KnowledgeTestCase, paragraphs
+
+MODEL = {'type': 'local', 'model': 'fake-model', 'normalize': True}
+
+
+class IndexCommitTests(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kb = self.create_kb()
+        self.rng = np.random.default_rng(0)
+
+    def rows(self, count, seed, dim=8):
+        texts = paragraphs(count, seed)
+        vectors = self.rng.random((count, dim)).astype(np.float32)
+        return texts, list(vectors), [{'chunk_index': i} for i in range(count)]
+
+    def write(self, kf, count, seed, embedding=MODEL, dim=8):
+        texts, vectors, metadatas = self.rows(count, seed, dim)
+        return replace_file_rows(self.kb.id, kf.id, texts, vectors, metadatas, embedding, dedup=False), vectors
+
+    def pointers(self):
+        kb = KnowledgeBase.objects.get(id=self.kb.id)
+        return kb.index_generation, kb.index_staging_generation
+
+    def test_uncommitted_rows_are_discarded(self):
+        first, second, third = (self.add_file(self.kb, str(i), f'{i}.txt') for i in range(3))
+        result, vectors = self.write(first, 3, 1)
+        with index_write_lock(self.kb.id):
+            writer = KnowledgeIndexWriter(self.kb.id)
+            # 写入中断：数据已追加但 manifest 未提交
+            writer.append_file(second.id, *self.rows(4, 2), MODEL, dedup=False)
+        index = get_index(self.kb.id)
+        self.assertEqual((index.count, index.version), (3, result['index_version']))
+        self.assertNotIn(str(second.id), index.manifest['files'])
+        _, third_vectors = self.write(third, 2, 3)
+        index = get_index(self.kb.id)
+        self.assertEqual(index.count, 5)
+        self.assertEqual(sorted(index.manifest['files']), sorted([str(first.id), str(third.id)]))
+        np.testing.assert_array_equal(index.vectors, np.asarray(vectors + third_vectors))
+        self.assertEqual(index.chunk(3)['content'], paragraphs(2, 3)[0])
+
+    def test_staging_generation_published_when_complete(self):
+        first, second = self.add_file(self.kb, '1', '1.txt'), self.add_file(self.kb, '2', '2.txt')
+        self.write(first, 3, 1)
+        self.write(second, 3, 2)
+        published = self.pointers()[0]
+        other = dict(MODEL, model='other-model')
+        result, _ = self.write(first, 3, 1, other, dim=4)
+        self.assertEqual((result['index_staged'], result['index_pending_files']), (True, 1))
+        self.assertEqual(self.pointers(), (published, result['index_generation']))
+        old = get_index(self.kb.id)
+        self.assertEqual((old.embedding, old.count), (MODEL, 6))
+        result, _ = self.write(second, 3, 2, other, dim=4)
+        self.assertEqual(self.pointers(), (result['index_generation'], 0))
+        index = get_index(self.kb.id)
+        self.assertEqual((index.embedding, index.dim, index.count), (other, 4, 6))
+        self.assertGreater(index.version, old.version)
+        # 旧代仍被读者持有，释放后才回收
+        self.assertEqual(collect_generations(self.kb.id), ([], [published]))
+        del old
+        release_idle_indexes(0)
+        self.assertEqual(collect_generations(self.kb.id), ([published], []))
+        self.assertEqual(sorted(os.listdir(index_dir(self.kb.id))), [f'gen_{index.generation}', 'write.lock'])
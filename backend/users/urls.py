@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import LoginView, UserInfoView, SetRoleView, CaptchaView, dashboard, MemberListView, MemberDetailView, UserGroupListView, UserGroupDetailView, AgentListCreateView, AgentRetrieveUpdateDestroyView, ModelApiListCreateView, ModelApiRetrieveUpdateDestroyView, refresh_usage, TokenUsageListCreateView, token_usage_stats, KnowledgeBaseListCreateView, KnowledgeBaseRetrieveUpdateDestroyView, SpaceListCreateView, SpaceRetrieveUpdateDestroyView, SpaceMemberListCreateView, SpaceMemberRetrieveUpdateDestroyView, SpaceDocumentListCreateView, SpaceDocumentRetrieveUpdateDestroyView, KnowledgeFileProcessView, KnowledgeFileListView, KnowledgeFileUploadView
+from .views import LoginView, UserInfoView, SetRoleView, CaptchaView, dashboard, MemberListView, MemberDetailView, UserGroupListView, UserGroupDetailView, AgentListCreateView, AgentRetrieveUpdateDestroyView, ModelApiListCreateView, ModelApiRetrieveUpdateDestroyView, refresh_usage, TokenUsageListCreateView, token_usage_stats, KnowledgeBaseListCreateView, KnowledgeBaseRetrieveUpdateDestroyView, KnowledgeBaseSearchView, KnowledgeBaseReprocessView, KnowledgeBaseExportView, KnowledgeBaseImportView, SpaceListCreateView, SpaceRetrieveUpdateDestroyView, SpaceMemberListCreateView, SpaceMemberRetrieveUpdateDestroyView, SpaceDocumentListCreateView, SpaceDocumentRetrieveUpdateDestroyView, KnowledgeFileProcessView, KnowledgeFileTextView, KnowledgeFilePreviewView, KnowledgeFileListView, KnowledgeFileRetrieveDestroyView, KnowledgeFileUploadView, KnowledgeProcessJobListView, KnowledgeProcessJobDetailView, KnowledgeProcessJobCancelView, KnowledgeProcessJobRetryView
 
 urlpatterns = [
     path('login/', LoginView.as_view()),
@@ -20,6 +20,10 @@ urlpatterns = [
     path('tokenusages/stats/', token_usage_stats, name='tokenusage-stats'),
     path('knowledgebases/', KnowledgeBaseListCreateView.as_view(), name='knowledgebase-list'),
     path('knowledgebases/<int:id>/', KnowledgeBaseRetrieveUpdateDestroyView.as_view(), name='knowledgebase-detail'),
+    path('knowledgebases/<int:id>/search/', KnowledgeBaseSearchView.as_view(), name='knowledgebase-search'),
+    path('knowledgebases/<int:id>/reprocess/', KnowledgeBaseReprocessView.as_view(), name='knowledgebase-reprocess'),
+    path('knowledgebases/<int:id>/export/', KnowledgeBaseExportView.as_view(), name='knowledgebase-export'),
+    path('knowledgebases/import/', KnowledgeBaseImportView.as_view(), name='knowledgebase-import'),
     path('spaces/', SpaceListCreateView.as_view(), name='space-list'),
     path('spaces/<int:id>/', SpaceRetrieveUpdateDestroyView.as_view(), name='space-detail'),
     path('spaces/<int:space_id>/members/', SpaceMemberListCreateView.as_view(), name='space-member-list'),
@@ -27,6 +31,13 @@ urlpatterns = [
     path('spaces/<int:space_id>/documents/', SpaceDocumentListCreateView.as_view(), name='space-document-list'),
     path('spaces/<int:space_id>/documents/<int:id>/', SpaceDocumentRetrieveUpdateDestroyView.as_view(), name='space-document-detail'),
     path('knowledgebases/files/<int:file_id>/process/', KnowledgeFileProcessView.as_view(), name='knowledge_file_process'),
+    path('knowledgebases/files/<int:file_id>/text/', KnowledgeFileTextView.as_view(), name='knowledge_file_text'),
+    path('knowledgebases/files/<int:file_id>/preview/', KnowledgeFilePreviewView.as_view(), name='knowledge_file_preview'),
     path('knowledgefiles/', KnowledgeFileListView.as_view(), name='knowledgefile-list'),
     path('knowledgefiles/upload/', KnowledgeFileUploadView.as_view(), name='knowledgefile-upload'),
+    path('knowledgefiles/<int:id>/', KnowledgeFileRetrieveDestroyView.as_view(), name='knowledgefile-detail'),
+    path('knowledgejobs/', KnowledgeProcessJobListView.as_view(), name='knowledgejob-list'),
+    path('knowledgejobs/<int:id>/', KnowledgeProcessJobDetailView.as_view(), name='knowledgejob-detail'),
+    path('knowledgejobs/<int:id>/cancel/', KnowledgeProcessJobCancelView.as_view(), name='knowledgejob-cancel'),
+    path('knowledgejobs/<int:id>/retry/', KnowledgeProcessJobRetryView.as_view(), name='knowledgejob-retry'),
 ] 
\ No newline at end of file
@@ -3,8 +3,8 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from django.contrib.auth import authenticate, login
-from .models import User, UserGroup, Agent, ModelApi, TokenUsage, KnowledgeBase, Space, SpaceMember, SpaceDocument, KnowledgeFile
-from .serializers import UserSerializer, UserGroupSerializer, AgentSerializer, ModelApiSerializer, TokenUsageSerializer, KnowledgeBaseSerializer, SpaceSerializer, SpaceMemberSerializer, SpaceDocumentSerializer, KnowledgeFileSerializer
+from .models import User, UserGroup, Agent, ModelApi, TokenUsage, KnowledgeBase, Space, SpaceMember, SpaceDocument, KnowledgeFile, KnowledgeProcessJob
+from .serializers import UserSerializer, UserGroupSerializer, AgentSerializer, ModelApiSerializer, TokenUsageSerializer, KnowledgeBaseSerializer, SpaceSerializer, SpaceMemberSerializer, SpaceDocumentSerializer, KnowledgeFileSerializer, KnowledgeProcessJobSerializer
 from django.contrib.auth.decorators import login_required
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -24,20 +24,17 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import serializers
 import traceback
 import os
-import pandas as pd
-from docx import Document
-import pdfplumber
-from pptx import Presentation
-from ebooklib import epub
-from bs4 import BeautifulSoup
-import markdown
-
-from langchain.text_splitter import RecursiveCharacterTextSplitter, CharacterTextSplitter, TokenTextSplitter
-from langchain_community.embeddings import OpenAIEmbeddings, HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-import openai
-from sentence_transformers import SentenceTransformer
-openai.api_key = getattr(settings, "OPENAI_API_KEY", os.environ.get("OPENAI_API_KEY"))
+import json
+
+from .knowledge.jobs import enqueue_process_job, cancel_job, retry_job
+from .knowledge.reprocess import reprocess_knowledge_base
+from .knowledge.preview import preview_knowledge_file
+from .knowledge.text_artifact import TextArtifact, file_content_hash
+from .knowledge.extractors import UnsupportedFileType
+from .knowledge.search import search_knowledge_base, KnowledgeSearchError
+from .knowledge.vector_index import remove_file_rows, drop_index
+from .knowledge.snapshot import iter_snapshot, import_knowledge_base
+from django.http import StreamingHttpResponse
 
 logger = logging.getLogger(__name__)
 
@@ -454,6 +451,12 @@ class KnowledgeBaseRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIVi
     permission_classes = [IsAuthenticated]
     lookup_field = 'id'
 
+    def perform_destroy(self, instance):
+        kb_id = instance.id
+        instance.delete()
+        drop_index(kb_id)
+        logger.info(f'[KnowledgeBase] 删除知识库 {kb_id} 及其向量索引')
+
 class SpaceListCreateView(generics.ListCreateAPIView):
     queryset = Space.objects.all().order_by('-created')
     serializer_class = SpaceSerializer
@@ -502,50 +505,8 @@ class SpaceDocumentRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIVi
     def get_queryset(self):
         space_id = self.kwargs['space_id']
 
-def extract_text_from_file(file_path, ext, encoding='utf-8'):
-    ext = ext.lower()
-    if ext in ['.txt', '.vtt', '.properties']:
-        with open(file_path, 'r', encoding=encoding) as f:
-            return f.read()
-    elif ext in ['.md', '.markdown', '.mdx']:
-        with open(file_path, 'r', encoding=encoding) as f:
-            return markdown.markdown(f.read())
-    elif ext in ['.docx']:
-        doc = Document(file_path)
-        return '\n'.join([p.text for p in doc.paragraphs])
-    elif ext in ['.pdf']:
-        with pdfplumber.open(file_path) as pdf:
-            return '\n'.join(page.extract_text() or "" for page in pdf.pages)
-    elif ext in ['.csv']:
-        df = pd.read_csv(file_path)
-        return df.to_string(index=False)
-    elif ext in ['.xlsx', '.xls']:
-        df = pd.read_excel(file_path)
-        return df.to_string(index=False)
-    elif ext in ['.pptx', '.ppt']:
-        prs = Presentation(file_path)
-        text = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text.append(shape.text)
-        return '\n'.join(text)
-    elif ext in ['.html', '.htm', '.xml']:
-        with open(file_path, 'r', encoding=encoding) as f:
-            soup = BeautifulSoup(f, 'html.parser')
-            return soup.get_text()
-    elif ext in ['.epub']:
-        book = epub.read_epub(file_path)
-        text = []
-        for item in book.get_items():
-            if item.get_type() == epub.ITEM_DOCUMENT:
-                soup = BeautifulSoup(item.get_content(), 'html.parser')
-                text.append(soup.get_text())
-        return '\n'.join(text)
-    else:
-        return "暂不支持该文件类型"
-
 class KnowledgeFileProcessView(APIView):
+    """提交知识文件处理任务，立即返回任务id，由后台 worker 执行"""
     def post(self, request, file_id):
         try:
             params = request.data
@@ -559,123 +520,57 @@ class KnowledgeFileProcessView(APIView):
             kb.embedding_config = params
             kb.save(update_fields=['embedding_config'])
 
-            file_path = kf.file.path
-            ext = os.path.splitext(file_path)[-1].lower()
-            encoding = params.get("loader_config", {}).get("encoding", "utf-8")
-            try:
-                file_content = extract_text_from_file(file_path, ext, encoding)
-            except Exception as e:
-                logger.error(f'[KnowledgeFileProcess] 读取文件内容失败: {str(e)}')
-                return Response({"error": f"读取文件内容失败: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            if file_content == "暂不支持该文件类型":
-                return Response({"error": file_content}, status=status.HTTP_400_BAD_REQUEST)
-
-            # 2. 文本清洗
-            clean_config = params.get('clean_config', {})
-            import re
-
-            # 保存原始字符数
-            kf.char_count = len(file_content)
-            kf.save(update_fields=['char_count'])
-
-            try:
-                if clean_config.get('clean_text'):
-                    file_content = re.sub(r'[ \t\r\f\v]+', ' ', file_content)
-                if clean_config.get('remove_urls'):
-                    file_content = re.sub(r'https?://\S+', '', file_content)
-                if clean_config.get('remove_emails'):
-                    file_content = re.sub(r'\S+@\S+', '', file_content)
-                if clean_config.get('remove_extra_whitespace'):
-                    file_content = ' '.join(file_content.split())
-                if clean_config.get('remove_special_chars'):
-                    file_content = re.sub(r'[^\w\s]', '', file_content)
-            except Exception as e:
-                logger.error(f'[KnowledgeFileProcess] 文本清洗失败: {str(e)}')
-                return Response({"error": f"文本清洗失败: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            # 3. 文本分段
-            splitter_config = params.get('splitter_config', {})
-            split_method = splitter_config.get('text_splitter', 'recursive')
-            chunk_size = splitter_config.get('chunk_size', 1000)
-            chunk_overlap = splitter_config.get('chunk_overlap', 200)
-            separators = splitter_config.get('separators', ['\n\n'])
-
-            # 4. 嵌入生成
-            embedding_config = params.get('embedding_config', {})
-            embedding_model = embedding_config.get('model', 'sentence-transformers/all-MiniLM-L6-v2')
-            embedding_type = embedding_config.get('type', 'local')  # 默认使用本地模型
-
-            user = request.user
-            logger.info(f'[KnowledgeFileProcess] 当前用户: {user.username} 开始处理知识库文件')
-
-            # 根据配置选择向量化模型
-            try:
-                if embedding_type == 'local':
-                    # 使用本地模型
-                    model_name = embedding_model if embedding_model else "sentence-transformers/all-MiniLM-L6-v2"
-                    embedder = HuggingFaceEmbeddings(
-                        model_name=model_name,
-                        model_kwargs={'device': 'cpu'},
-                        encode_kwargs={'normalize_embeddings': True}
-                    )
-                    logger.info(f'[KnowledgeFileProcess] 使用本地模型 {model_name} 进行向量化')
-                elif embedding_type == 'openai':
-                    # 使用 OpenAI API
-                    api_key = user.openai_api_key
-                    from .models import ModelApi
-                    model_api = ModelApi.objects.filter(model='openai').order_by('-time').first()
-                    api_key = model_api.apikey if model_api else api_key
-                    logger.info(f'[KnowledgeFileProcess] 当前用户: {user.username}, OpenAI API密钥: {api_key}')
-                    if not api_key:
-                        logger.error(f'[KnowledgeFileProcess] 用户 {user.username} 和全局都未设置OpenAI API密钥')
-                        return Response({"error": "请先在个人设置或API管理中设置OpenAI API密钥"}, status=status.HTTP_400_BAD_REQUEST)
-                    embedder = OpenAIEmbeddings(
-                        model=embedding_model,
-                        openai_api_key=api_key
-                    )
-                else:
-                    logger.error(f'[KnowledgeFileProcess] 不支持的嵌入模型类型: {embedding_type}')
-                    return Response({"error": "不支持的嵌入模型类型"}, status=status.HTTP_400_BAD_REQUEST)
-            except Exception as e:
-                logger.error(f'[KnowledgeFileProcess] 初始化向量化模型失败: {str(e)}')
-                return Response({"error": f"初始化向量化模型失败: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            # 5. 向量存储
-            try:
-                # 生成嵌入向量
-                embeddings = embedder.embed_documents(file_content)
-            except Exception as e:
-                if 'RateLimitError' in str(e):
-                    logger.error(f'[KnowledgeFileProcess] 用户 {user.username} 调用 API 被限流，请稍后重试或更换 API Key')
-                    return Response({"error": "API 调用频率超限，请稍后重试或更换 API Key"}, status=status.HTTP_429_TOO_MANY_REQUESTS)
-                else:
-                    logger.error(f'[KnowledgeFileProcess] 生成嵌入向量失败: {str(e)}')
-                    return Response({"error": f"生成嵌入向量失败: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            # 6. 检索索引（Chroma自动支持）
-            persist_directory = f"./chroma_db/{file_id}"
-            os.makedirs(persist_directory, exist_ok=True)
-            vectordb = Chroma.from_texts(
-                texts=file_content,
-                embedding=embedder,
-                persist_directory=persist_directory,
-                metadatas=[{"file_id": file_id, "chunk_index": i} for i in range(len(file_content))]
-            )
-            vectordb.persist()
-
-            # 7. 返回结果
-            result = {
-                'file_id': file_id,
-                'chunk_count': len(file_content),
-                'embedding_model': model_name,
-                'embedding_type': embedding_type,
-                'vector_store_path': persist_directory
-            }
-            return Response(result)
+            job = enqueue_process_job(kf, params, request.user)
+            logger.info(f'[KnowledgeFileProcess] 用户 {request.user.username} 提交文件 {file_id} 处理任务 {job.id}')
+            data = KnowledgeProcessJobSerializer(job).data
+            data['job_id'] = job.id
+            return Response(data, status=status.HTTP_202_ACCEPTED)
         except Exception as e:
             logger.error(f'[KnowledgeFileProcess] 未知错误: {str(e)}', exc_info=True)
             return Response({"error": f"未知错误: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class KnowledgeProcessJobListView(generics.ListAPIView):
+    """知识文件处理任务列表"""
+    queryset = KnowledgeProcessJob.objects.select_related('file').order_by('-created')
+    serializer_class = KnowledgeProcessJobSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['kb', 'file', 'status']
+    ordering_fields = ['created']
+
+class KnowledgeProcessJobDetailView(generics.RetrieveAPIView):
+    """知识文件处理任务状态查询"""
+    queryset = KnowledgeProcessJob.objects.select_related('file')
+    serializer_class = KnowledgeProcessJobSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'id'
+
+class KnowledgeProcessJobCancelView(APIView):
+    """取消知识文件处理任务"""
+    permission_classes = [IsAuthenticated]
+    def post(self, request, id):
+        try:
+            job = KnowledgeProcessJob.objects.get(id=id)
+        except KnowledgeProcessJob.DoesNotExist:
+            return Response({"error": "任务不存在"}, status=status.HTTP_404_NOT_FOUND)
+        if not cancel_job(job):
+            return Response({"error": f"任务当前状态为{job.get_status_display()}，无法取消"}, status=status.HTTP_400_BAD_REQUEST)
+        job.refresh_from_db()
+        return Response(KnowledgeProcessJobSerializer(job).data)
+
+class KnowledgeProcessJobRetryView(APIView):
+    """重新执行失败或已取消的知识文件处理任务"""
+    permission_classes = [IsAuthenticated]
+    def post(self, request, id):
+        try:
+            job = KnowledgeProcessJob.objects.get(id=id)
+        except KnowledgeProcessJob.DoesNotExist:
+            return Response({"error": "任务不存在"}, status=status.HTTP_404_NOT_FOUND)
+        if not retry_job(job):
+            return Response({"error": f"任务当前状态为{job.get_status_display()}，无法重试"}, status=status.HTTP_400_BAD_REQUEST)
+        job.refresh_from_db()
+        return Response(KnowledgeProcessJobSerializer(job).data)
+
 class KnowledgeFileUploadView(APIView):
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated]
@@ -686,6 +581,8 @@ class KnowledgeFileUploadView(APIView):
         if serializer.is_valid():
             try:
                 instance = serializer.save()
+                instance.content_hash = file_content_hash(instance.file.path)
+                instance.save(update_fields=['content_hash'])
                 logger.info(f'[KnowledgeFileUpload] 文件上传成功: {instance.filename}')
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             except Exception as e:
@@ -694,6 +591,171 @@ class KnowledgeFileUploadView(APIView):
         logger.error(f'[KnowledgeFileUpload] 数据验证失败: {serializer.errors}')
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class KnowledgeFileRetrieveDestroyView(generics.RetrieveDestroyAPIView):
+    """知识文件详情与删除，删除时同时从知识库索引中移除该文件的分段"""
+    queryset = KnowledgeFile.objects.all()
+    serializer_class = KnowledgeFileSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'id'
+
+    def perform_destroy(self, instance):
+        kb_id, file_id = instance.kb_id, instance.id
+        instance.delete()
+        remove_file_rows(kb_id, file_id)
+        logger.info(f'[KnowledgeFile] 删除知识文件 {file_id}，已从知识库 {kb_id} 索引中移除')
+
+class KnowledgeFilePreviewView(APIView):
+    """分段预览：按请求中的分段参数对文件抽样执行提取、清洗、分段，返回分段、长度分布与向量化费用估算，不向量化"""
+    permission_classes = [IsAuthenticated]
+    def post(self, request, file_id):
+        try:
+            kf = KnowledgeFile.objects.get(id=file_id)
+        except KnowledgeFile.DoesNotExist:
+            return Response({"error": "知识文件不存在"}, status=status.HTTP_404_NOT_FOUND)
+        params = dict(request.data)
+        sample = params.pop('sample', None)
+        try:
+            result = preview_knowledge_file(kf, params, sample)
+        except UnsupportedFileType as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f'[KnowledgePreview] 文件 {file_id} 分段预览失败: {str(e)}', exc_info=True)
+            return Response({"error": f"分段预览失败: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.info(f'[KnowledgePreview] 文件 {file_id} 预览 {result["chunk_count"]} 段，耗时 {result["took_ms"]}ms')
+        return Response(result)
+
+class KnowledgeFileTextView(APIView):
+    """读取知识文件的提取文本（按字符偏移分页）；提取文本由处理任务生成，请求中不解析文件"""
+    permission_classes = [IsAuthenticated]
+    def get(self, request, file_id):
+        try:
+            kf = KnowledgeFile.objects.get(id=file_id)
+        except KnowledgeFile.DoesNotExist:
+            return Response({"error": "知识文件不存在"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            start = max(int(request.query_params.get('start', 0)), 0)
+            length = min(max(int(request.query_params.get('length', 5000)), 1), 100000)
+        except ValueError:
+            return Response({"error": "start 和 length 必须为整数"}, status=status.HTTP_400_BAD_REQUEST)
+        artifact = TextArtifact.open(kf.text_artifact) if kf.text_artifact else None
+        if artifact is None:
+            job = kf.process_jobs.filter(status__in=['queued', 'running']).order_by('-created').first()
+            if job:
+                return Response({"error": "文件正在处理中，提取文本尚未生成", "job_id": job.id, "status": job.status},
+                                status=status.HTTP_409_CONFLICT)
+            return Response({"error": "该文件还没有提取文本，请先处理文件"}, status=status.HTTP_404_NOT_FOUND)
+        end = start + length
+        return Response({
+            'file_id': kf.id,
+            'char_count': artifact.char_count,
+            'length': artifact.length,
+            'start': start,
+            'end': min(end, artifact.length),
+            'text': artifact.read(start, end),
+            'segments': [
+                {'start': s, 'end': e, 'metadata': metadata}
+                for s, e, metadata in artifact.segments if s < end and e > start
+            ],
+        })
+
+class KnowledgeBaseSearchView(APIView):
+    """知识库语义检索：GET 使用 query 参数，POST 使用请求体；未指定的参数取知识库 retrieval_config"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, id):
+        return self._search(request, id, request.query_params)
+
+    def post(self, request, id):
+        return self._search(request, id, request.data)
+
+    def _search(self, request, id, params):
+        try:
+            kb = KnowledgeBase.objects.get(id=id)
+        except KnowledgeBase.DoesNotExist:
+            return Response({"error": "知识库不存在"}, status=status.HTTP_404_NOT_FOUND)
+        metadata_filters = params.get('filters')
+        if isinstance(metadata_filters, str):
+            # GET 请求的 filters 为 JSON 字符串
+            try:
+                metadata_filters = json.loads(metadata_filters) if metadata_filters.strip() else None
+            except ValueError:
+                return Response({"error": "filters 必须为 JSON 对象"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = search_knowledge_base(
+                kb,
+                params.get('query') or params.get('q'),
+                user=request.user,
+                top_k=params.get('top_k'),
+                strategy=params.get('strategy'),
+                similarity_threshold=params.get('similarity_threshold'),
+                filters=metadata_filters,
+            )
+        except KnowledgeSearchError as e:
+            return Response({"error": e.message}, status=e.status_code)
+        except Exception as e:
+            logger.error(f'[KnowledgeSearch] 知识库 {id} 检索失败: {str(e)}', exc_info=True)
+            return Response({"error": f"检索失败: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.info(f'[KnowledgeSearch] 知识库 {id} 检索 {len(result["results"])} 条，耗时 {result["took_ms"]}ms')
+        return Response(result)
+
+class KnowledgeBaseReprocessView(APIView):
+    """按新的分段/embedding参数重新处理知识库全部文件：只重做配置变化影响到的阶段，?dry_run=1 时只返回计划"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, id):
+        try:
+            kb = KnowledgeBase.objects.get(id=id)
+        except KnowledgeBase.DoesNotExist:
+            return Response({"error": "知识库不存在"}, status=status.HTTP_404_NOT_FOUND)
+        if not isinstance(request.data, dict):
+            return Response({"error": "处理参数必须为 JSON 对象"}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = request.query_params.get('dry_run') in ('1', 'true')
+        try:
+            result = reprocess_knowledge_base(kb, dict(request.data), request.user, dry_run=dry_run)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f'[KnowledgeReprocess] 知识库 {id} 重新处理失败: {str(e)}', exc_info=True)
+            return Response({"error": f"重新处理失败: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.info(f'[KnowledgeReprocess] 用户 {request.user.username} 重新处理知识库 {id}，创建任务 {len(result["jobs"])} 个')
+        return Response(result, status=status.HTTP_200_OK if dry_run else status.HTTP_202_ACCEPTED)
+
+class KnowledgeBaseExportView(APIView):
+    """流式下载知识库快照（分段、向量与配置），?files=0 时不包含上传的原始文件"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, id):
+        try:
+            kb = KnowledgeBase.objects.get(id=id)
+        except KnowledgeBase.DoesNotExist:
+            return Response({"error": "知识库不存在"}, status=status.HTTP_404_NOT_FOUND)
+        include_files = request.query_params.get('files') not in ('0', 'false')
+        response = StreamingHttpResponse(iter_snapshot(kb, include_files), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="kb_{kb.id}_snapshot.zip"'
+        logger.info(f'[KnowledgeSnapshot] 用户 {request.user.username} 导出知识库 {id}')
+        return response
+
+class KnowledgeBaseImportView(APIView):
+    """上传知识库快照创建新知识库，不调用向量化模型；name 为空时沿用快照中的名称"""
+    permission_classes = [IsAuthenticated]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request):
+        snapshot = request.FILES.get('snapshot')
+        if not snapshot:
+            return Response({"error": "未上传快照文件"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            kb, result = import_knowledge_base(snapshot, name=request.data.get('name') or None)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f'[KnowledgeSnapshot] 导入快照失败: {str(e)}', exc_info=True)
+            return Response({"error": f"导入快照失败: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.info(f'[KnowledgeSnapshot] 用户 {request.user.username} 导入快照创建知识库 {kb.id}')
+        return Response(dict(KnowledgeBaseSerializer(kb).data, snapshot=result), status=status.HTTP_201_CREATED)
+
 class KnowledgeFileListView(generics.ListAPIView):
     serializer_class = KnowledgeFileSerializer
     permission_classes = [IsAuthenticated]
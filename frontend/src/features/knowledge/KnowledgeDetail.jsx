@@ -174,7 +174,8 @@ const KnowledgeDetail = () => {
             <Descriptions.Item label="模型名称">{config.embedding_config?.model || 'sentence-transformers/all-MiniLM-L6-v2'}</Descriptions.Item>
             <Descriptions.Item label="检索策略">
               {config.retrieval_config?.strategy === 'similarity' ? '相似度检索' : 
-               config.retrieval_config?.strategy === 'mmr' ? 'MMR检索' : '通用'}
+               config.retrieval_config?.strategy === 'mmr' ? 'MMR检索' :
+               config.retrieval_config?.strategy === 'hybrid' ? '混合检索' : '通用'}
             </Descriptions.Item>
             <Descriptions.Item label="Top K">{config.retrieval_config?.top_k || 4}</Descriptions.Item>
             <Descriptions.Item label="相似度阈值">{config.retrieval_config?.similarity_threshold || 0.7}</Descriptions.Item>
@@ -244,6 +245,7 @@ const KnowledgeDetail = () => {
                 <Select>
                   <Select.Option value="similarity">相似度检索</Select.Option>
                   <Select.Option value="mmr">MMR检索</Select.Option>
+                  <Select.Option value="hybrid">混合检索</Select.Option>
                 </Select>
               </Form.Item>
               <Form.Item name="top_k" label="Top K">
@@ -28,11 +28,14 @@ const defaultParams = {
   // 向量化设置
   embedding_type: 'local',
   embedding_model: 'sentence-transformers/all-MiniLM-L6-v2',
-  embedding_dimension: 1536,
+  embedding_dimension: null,
   
   // 向量存储设置
   vector_store: 'chroma',
   similarity_metric: 'cosine',
+  index_type: 'flat',
+  nprobe: 16,
+  storage: 'float32',
   
   // 检索设置
   retrieval_strategy: 'similarity',
@@ -63,6 +66,7 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
   const kb = location.state?.kb;
   const [form] = Form.useForm();
   const [previewData, setPreviewData] = useState(null);
+  const [sampleMode, setSampleMode] = useState('head');
   const [loading, setLoading] = useState(false);
   const navigate = useNavigate();
 
@@ -76,6 +80,7 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
     ...kb.embedding_config.vector_store_config,
     ...kb.embedding_config.retrieval_config,
     ...kb.embedding_config.metadata_config,
+    embedding_dimension: kb.embedding_config.embedding_config?.dimension ?? null,
   } : defaultParams;
 
   const embeddingType = Form.useWatch ? Form.useWatch('embedding_type', form) : form.getFieldValue('embedding_type');
@@ -90,10 +95,13 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
       const values = await form.validateFields();
       setLoading(true);
       const fileId = file.id || 1;
-      const res = await axios.post(`/api/knowledgebases/files/${fileId}/preview/`, values);
+      const res = await axios.post(`/api/knowledgebases/files/${fileId}/preview/`, {
+        ...buildRequestData(values),
+        sample: { mode: sampleMode }
+      });
       setPreviewData(res.data);
     } catch (e) {
-      message.error('分段预览失败');
+      message.error(e.response?.data?.error || '分段预览失败');
     }
     setLoading(false);
   };
@@ -103,47 +111,57 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
     setPreviewData(null);
   };
 
+  // 按照后端期望的格式组织数据
+  const buildRequestData = (values) => ({
+    loader_config: {
+      encoding: values.encoding || 'utf-8'
+    },
+    clean_config: {
+      clean_text: values.clean_text,
+      remove_urls: values.remove_urls,
+      remove_emails: values.remove_emails,
+      remove_extra_whitespace: values.remove_extra_whitespace,
+      remove_special_chars: values.remove_special_chars
+    },
+    splitter_config: {
+      text_splitter: values.text_splitter,
+      chunk_size: values.chunk_size,
+      chunk_overlap: values.chunk_overlap,
+      separators: values.separators,
+      use_parent_document: values.use_parent_document,
+      parent_chunk_size: values.parent_chunk_size,
+      parent_chunk_overlap: values.parent_chunk_overlap
+    },
+    embedding_config: {
+      model: values.embedding_model,
+      dimension: values.embedding_dimension || undefined
+    },
+    vector_store_config: {
+      type: values.vector_store,
+      similarity_metric: values.similarity_metric,
+      index_type: values.index_type,
+      nprobe: values.nprobe,
+      storage: values.storage
+    },
+    retrieval_config: {
+      strategy: values.retrieval_strategy,
+      top_k: values.top_k,
+      similarity_threshold: values.similarity_threshold
+    },
+    metadata_config: {
+      fields: values.metadata_fields
+    }
+  });
+
   const handleSaveAndProcess = async () => {
     try {
       const values = await form.validateFields();
       setLoading(true);
       const fileId = file.id || 1;
-      
-      // 按照后端期望的格式组织数据
-      const requestData = {
-        loader_config: {
-          encoding: values.encoding || 'utf-8'
-        },
-        clean_config: {
-          clean_text: values.clean_text,
-          remove_urls: values.remove_urls,
-          remove_emails: values.remove_emails,
-          remove_extra_whitespace: values.remove_extra_whitespace,
-          remove_special_chars: values.remove_special_chars
-        },
-        splitter_config: {
-          text_splitter: values.text_splitter,
-          chunk_size: values.chunk_size,
-          chunk_overlap: values.chunk_overlap,
-          separators: values.separators
-        },
-        embedding_config: {
-          model: values.embedding_model
-        },
-        vector_store_config: {
-          type: values.vector_store
-        },
-        retrieval_config: {
-          strategy: values.retrieval_strategy,
-          top_k: values.top_k,
-          similarity_threshold: values.similarity_threshold
-        },
-        metadata_config: {
-          fields: values.metadata_fields
-        }
-      };
+      const requestData = buildRequestData(values);
 
       const res = await axios.post(`/api/knowledgebases/files/${fileId}/process/`, requestData);
+      message.success(`已提交处理任务 #${res.data.job_id}，后台处理中`);
       navigate(`/dashboard/knowledge/${file.kb || file.kb_id}`);
     } catch (e) {
       console.error('处理失败:', e);
@@ -152,6 +170,30 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
     setLoading(false);
   };
 
+  // 按新参数重新处理知识库全部文件，后端只重做参数变化影响到的阶段
+  const handleReprocessKb = async () => {
+    const kbId = kb?.id || file?.kb || file?.kb_id;
+    if (!kbId) {
+      message.warning('未找到所属知识库');
+      return;
+    }
+    try {
+      const values = await form.validateFields();
+      setLoading(true);
+      const res = await axios.post(`/api/knowledgebases/${kbId}/reprocess/`, buildRequestData(values));
+      const { stages, unchanged, jobs } = res.data;
+      message.success(
+        `已提交 ${jobs.length} 个处理任务（重新提取 ${stages.extract.length}，重新分段 ${stages.split.length}，` +
+        `仅重新向量化 ${stages.embed.length}），${unchanged.length} 个文件无需处理`
+      );
+      navigate(`/dashboard/knowledge/${kbId}`);
+    } catch (e) {
+      console.error('重新处理失败:', e);
+      message.error(e.response?.data?.error || '重新处理知识库失败');
+    }
+    setLoading(false);
+  };
+
   return (
     <div style={{ background: '#fff', borderRadius: 12, padding: 24, minHeight: 520, width: '100%', maxWidth: '100%', margin: 0 }}>
       <div style={{ display: 'flex', alignItems: 'center', marginBottom: 24 }}>
@@ -208,6 +250,15 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
                       <Form.Item name="separators" label="分割符">
                         <Select mode="tags" style={{ width: '100%' }} />
                       </Form.Item>
+                      <Form.Item name="use_parent_document" valuePropName="checked">
+                        <Checkbox>父子分段（小块检索，返回所在父块）</Checkbox>
+                      </Form.Item>
+                      <Form.Item name="parent_chunk_size" label="父块大小">
+                        <InputNumber min={200} max={10000} style={{ width: 200 }} addonAfter="字符" />
+                      </Form.Item>
+                      <Form.Item name="parent_chunk_overlap" label="父块重叠">
+                        <InputNumber min={0} max={2000} style={{ width: 200 }} addonAfter="字符" />
+                      </Form.Item>
                     </Panel>
 
                     <Panel header="文本清洗设置" key="3">
@@ -251,8 +302,8 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
                           ))}
                         </Select>
                       </Form.Item>
-                      <Form.Item name="embedding_dimension" label="向量维度">
-                        <InputNumber disabled style={{ width: 200 }} />
+                      <Form.Item name="embedding_dimension" label="向量维度" tooltip="小于模型输出维度时降维存储，留空使用模型原始维度">
+                        <InputNumber min={8} placeholder="模型原始维度" style={{ width: 200 }} />
                       </Form.Item>
                     </Panel>
 
@@ -271,6 +322,23 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
                           <Select.Option value="dot">点积</Select.Option>
                         </Select>
                       </Form.Item>
+                      <Form.Item name="index_type" label="索引类型" tooltip="大规模知识库可使用近似索引，行数较少时自动使用精确检索">
+                        <Select>
+                          <Select.Option value="flat">精确检索</Select.Option>
+                          <Select.Option value="ivf_flat">IVF 近似检索</Select.Option>
+                          <Select.Option value="ivf_pq">IVF-PQ 近似检索（省内存）</Select.Option>
+                        </Select>
+                      </Form.Item>
+                      <Form.Item name="storage" label="向量存储精度" tooltip="int8 / float16 在压缩后的向量上检索，内存占用约为 float32 的 1/4 / 1/2，并用原始向量对候选重排">
+                        <Select>
+                          <Select.Option value="float32">float32</Select.Option>
+                          <Select.Option value="float16">float16</Select.Option>
+                          <Select.Option value="int8">int8</Select.Option>
+                        </Select>
+                      </Form.Item>
+                      <Form.Item name="nprobe" label="检索列表数" tooltip="近似检索时访问的倒排列表数，越大召回越高、越慢">
+                        <InputNumber min={1} max={1024} style={{ width: 200 }} />
+                      </Form.Item>
                     </Panel>
 
                     <Panel header="检索设置" key="3">
@@ -278,6 +346,7 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
                         <Select>
                           <Select.Option value="similarity">相似度检索</Select.Option>
                           <Select.Option value="mmr">MMR多样性检索</Select.Option>
+                          <Select.Option value="hybrid">混合检索（关键词 + 向量）</Select.Option>
                         </Select>
                       </Form.Item>
                       <Form.Item name="top_k" label="返回结果数量">
@@ -316,6 +385,9 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
                   <Button type="primary" onClick={handleSaveAndProcess}>
                     保存并处理
                   </Button>
+                  <Button onClick={handleReprocessKb}>
+                    应用到全部文件
+                  </Button>
                 </Space>
               </div>
             </Form>
@@ -323,7 +395,23 @@ const KnowledgeSegmentSetting = ({ onBack }) => {
 
           {/* 右侧预览面板 */}
           <div style={{ flex: 1, minWidth: 320, background: '#f7f8fa', borderRadius: 8, padding: 24, minHeight: 480 }}>
-            <div style={{ fontWeight: 500, marginBottom: 16 }}>预览效果</div>
+            <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: 16 }}>
+              <span style={{ fontWeight: 500 }}>预览效果</span>
+              <Select size="small" value={sampleMode} onChange={setSampleMode} style={{ width: 140 }}>
+                <Select.Option value="head">抽样：文件开头</Select.Option>
+                <Select.Option value="spread">抽样：全文均匀</Select.Option>
+              </Select>
+            </div>
+            {previewData?.estimate && (
+              <div style={{ marginBottom: 12, fontSize: 12, color: '#666' }}>
+                抽样 {previewData.sample.chars_sampled} / {previewData.sample.scope_chars} 字符，
+                预计全文 {previewData.estimate.chunks} 块、{previewData.estimate.tokens} tokens，
+                向量化费用约 ${previewData.estimate.cost_usd}
+                {previewData.histogram?.chars && (
+                  <span>；块长度 中位数 {previewData.histogram.chars.p50}，P90 {previewData.histogram.chars.p90}，最大 {previewData.histogram.chars.max}</span>
+                )}
+              </div>
+            )}
             {previewData ? (
               <div style={{ maxHeight: 400, overflow: 'auto' }}>
                 {Array.isArray(previewData.chunks) && previewData.chunks.length > 0 ? (
@@ -14,6 +14,11 @@ cleanup() {
         kill $(cat backend/backend.pid) 2>/dev/null || true
         rm backend/backend.pid
     fi
+    # 查找并终止知识库 worker 进程
+    if [ -f "backend/worker.pid" ]; then
+        kill $(cat backend/worker.pid) 2>/dev/null || true
+        rm backend/worker.pid
+    fi
     # 查找并终止前端进程
     if [ -f "frontend/frontend.pid" ]; then
         kill $(cat frontend/frontend.pid) 2>/dev/null || true
@@ -111,6 +116,10 @@ start_backend() {
     # 启动服务
     nohup python3 manage.py runserver 0.0.0.0:8000 > backend.log 2>&1 &
     echo $! > backend.pid
+
+    # 启动知识库处理 worker
+    nohup python3 manage.py knowledge_worker > worker.log 2>&1 &
+    echo $! > worker.pid
     
     # 等待服务启动
     sleep 5